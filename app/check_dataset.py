@@ -9,6 +9,7 @@ from argparse import ArgumentParser, Namespace, RawDescriptionHelpFormatter
 from datetime import timedelta
 
 import app.checks as checks
+from .check_registry import CheckScheduler, WORKING, CURRENT, HISTORY
 from .qc_config import QCConfig
 from .data.data_source import DataSource
 from .log.result_log import ResultLog
@@ -27,10 +28,12 @@ def check_working(ds: DataSource, config: QCConfig) -> ResultLog:
     (sheet URL defined in app/data/worksheet_wrapper.py)
     """
 
-    log = ResultLog()
+    log = ResultLog(consolidate_threshold=config.consolidate_threshold, incremental=True)
 
     ds._target_date = config.working_date
 
+    ds.prefetch(["working", "history", "cds_counties", "csbs_counties", "nyt_counties"])
+
     df = ds.working
     if is_missing(df): 
         log.internal("Source", "Working not available")
@@ -68,42 +71,9 @@ def check_working(ds: DataSource, config: QCConfig) -> ResultLog:
 
     # *** WHEN YOU CHANGE A CHECK THAT IMPACTS WORKING, MAKE SURE TO UPDATE THE EXCEL TRACKING DOCUMENT ***
 
-    cnt = 0
-    for row in df.itertuples():
-        try:
-
-            checks.total(row, log)
-            #checks.total_tests(row, log)
-            checks.last_update(row, log)
-            checks.last_checked(row, log, config)
-            checks.checkers_initials(row, log, config)
-            checks.positives_rate(row, log)
-            checks.death_rate(row, log)
-            checks.less_recovered_than_positive(row, log)
-            checks.pendings_rate(row, log)
-
-            if not ds.history is None:
-                df_history = ds.history[ds.history.state == row.state]
-                has_changed = checks.increasing_values(row, df_history, log, config)
-                if has_changed:
-                    checks.expected_positive_increase(row, df_history, log, "working", config)
-
-            #checks.delta_vs_cumulative(row, df_history, log, config)
-
-            if not ds.county_rollup is None:
-                df_county_rollup = ds.county_rollup[ds.county_rollup.state == row.state]
-                if  not df_county_rollup.empty:
-                    checks.counties_rollup_to_state(row, df_county_rollup, log)
-
-        except Exception as ex:
-            logger.exception(ex)
-            log.internal(row.state, f"{ex}")
-
-        if cnt != 0 and cnt % 10 == 0:
-            logger.info(f"  processed {cnt} states")
-        cnt += 1
-
-    logger.info(f"  processed {cnt} states")
+    scheduler = CheckScheduler(WORKING, ds, log, config)
+    scheduler.run_rows(df)
+    scheduler.report_timings()
 
     checks.missing_tests(log)
 
@@ -134,7 +104,9 @@ def check_current(ds: DataSource, config: QCConfig) -> ResultLog:
     Check the current published results
     """
 
-    log = ResultLog()
+    log = ResultLog(consolidate_threshold=config.consolidate_threshold, incremental=True)
+
+    ds.prefetch(["current", "history", "cds_counties", "csbs_counties", "nyt_counties"])
 
     df = ds.current
     if is_missing(df): 
@@ -154,47 +126,31 @@ def check_current(ds: DataSource, config: QCConfig) -> ResultLog:
     df["lastCheckEt"] = config.push_date
     df["push_num"] = config.push_num
 
-    for row in df.itertuples():
-        checks.total(row, log)        
-        checks.last_update(row, log)
-        checks.positives_rate(row, log)
-        checks.death_rate(row, log)
-        checks.pendings_rate(row, log)
-
-        if not ds.history is None:
-            df_history = ds.history[ds.history.state == row.state]
-            checks.consistent_with_history(row, df_history, log)
-
-        if not ds.history is None:
-            df_history = ds.history[ds.history.state == row.state]
-            has_changed = checks.increasing_values(row, df_history, log, config)
-            if has_changed:
-                checks.expected_positive_increase(row, df_history, log, "current", config)
-
-        if not ds.county_rollup is None:
-            df_county_rollup = ds.county_rollup[ds.county_rollup.state == row.state]
-            if not df_county_rollup.empty:
-                checks.counties_rollup_to_state(row, df_county_rollup, log)
+    scheduler = CheckScheduler(CURRENT, ds, log, config)
+    scheduler.run_rows(df)
+    scheduler.report_timings()
 
     log.consolidate()
     return log
 
 
-def check_history(ds: DataSource) -> ResultLog:
+def check_history(ds: DataSource, config: QCConfig = None) -> ResultLog:
     """
     Check the history
     """
 
-    log = ResultLog()
+    if not config: config = QCConfig()
+
+    log = ResultLog(consolidate_threshold=config.consolidate_threshold, incremental=True)
 
     df = ds.history
     if is_missing(df): 
         log.internal("Source", "History not available")
         return None
 
-    for state in df["state"].drop_duplicates().values:
-        state_df = df.loc[df["state"] == state]
-        checks.monotonically_increasing(state_df, log)
+    scheduler = CheckScheduler(HISTORY, ds, log, config)
+    scheduler.run_states(df["state"].drop_duplicates().values)
+    scheduler.report_timings()
 
     log.consolidate()
     return log
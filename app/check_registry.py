@@ -0,0 +1,382 @@
+#
+# Check registry and scheduler
+#
+#   Each check in checks.py registers itself with @check(...), declaring:
+#
+#      kinds   -- the datasets it applies to (working, current, history)
+#      inputs  -- the arguments it takes, in order (see INPUTS)
+#      depends -- a check that must run first and return a truthy value
+#      order   -- where it runs relative to the other checks for a state
+#      vector  -- name of the vectorized version in vector_checks (optional)
+#
+#   CheckScheduler runs the registered checks for a kind.  The inputs for a
+#   state are resolved once and shared by all its checks; checks whose inputs
+#   are not available are skipped.  Time spent in each check is accumulated.
+#
+#   With workers > 1 the rows are split into contiguous shards that run on a
+#   process pool.  The history/rollup indexes are sent once to each worker
+#   (not once per shard) and the partial logs are merged back in row order.
+#   The workers are always spawned (also on Linux) because the service runs
+#   the checks on its request and refresh threads, so the entry script needs
+#   the usual __main__ guard.
+#
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Callable, Any
+from loguru import logger
+import pandas as pd
+import numpy as np
+
+from .qc_config import QCConfig
+from .data.data_source import DataSource
+from .data.history_index import HistoryIndex
+from .data.rollup_index import RollupIndex
+from .modeling.batch_forecast import BatchForecast
+from .modeling.forecast_params import ForecastParamStore
+from .modeling.forecast_cache import get_forecast_cache
+from .log.result_log import ResultLog
+import app.vector_checks as vector_checks
+
+WORKING = "working"
+CURRENT = "current"
+HISTORY = "history"
+
+# inputs a check can ask for
+#
+#   row     -- the itertuples() record for a state (working/current)
+#   history -- StateHistory for the state
+#   rollup  -- county Rollup for the state
+#   log     -- the ResultLog
+#   config  -- the QCConfig
+#   context -- the kind being checked
+#   forecasts -- BatchForecast for the row's target date (None if disabled)
+#   forecast_params -- ForecastParamStore for warm starts (None if disabled)
+#
+INPUTS = ["row", "history", "rollup", "log", "config", "context", "forecasts", "forecast_params"]
+
+
+class CheckSpec:
+    " a registered check "
+
+    def __init__(self, func: Callable, kinds: List[str], inputs: List[str],
+                 depends: str = None, order: int = 0, vector: str = None):
+        for x in inputs:
+            if not x in INPUTS: raise Exception(f"Unknown input {x} for check {func.__name__}")
+
+        self.name = func.__name__
+        self.func = func
+        self.kinds = kinds
+        self.inputs = inputs
+        self.depends = depends
+        self.order = order
+        self.vector = vector
+
+    def __repr__(self) -> str:
+        return f"CheckSpec({self.name}, kinds={self.kinds}, inputs={self.inputs})"
+
+
+REGISTRY: Dict[str, CheckSpec] = {}
+
+def check(kinds: List[str], inputs: List[str], depends: str = None, order: int = 0, vector: str = None):
+    " decorator to register a check "
+
+    def register(func: Callable) -> Callable:
+        spec = CheckSpec(func, kinds, inputs, depends=depends, order=order, vector=vector)
+        if spec.name in REGISTRY: raise Exception(f"Duplicate check {spec.name}")
+        REGISTRY[spec.name] = spec
+        return func
+
+    return register
+
+def checks_for(kind: str) -> List[CheckSpec]:
+    " the checks for a kind, in run order "
+
+    specs = [x for x in REGISTRY.values() if kind in x.kinds]
+    specs.sort(key=lambda x: x.order)
+
+    names = set(x.name for x in specs)
+    for x in specs:
+        if x.depends != None and not x.depends in names:
+            raise Exception(f"Check {x.name} depends on {x.depends} which does not run for {kind}")
+    return specs
+
+
+# shards per worker, more than one so a slow shard doesn't hold up the pool
+SHARDS_PER_WORKER = 4
+
+
+class SharedInputs:
+    """ the read-only parts of a DataSource that the checks use (sent to the workers)
+
+    forecast_param_entries is a ForecastParamStore.snapshot(), each worker
+    builds its own store from it (see _run_shard)
+    """
+
+    def __init__(self, history_index: HistoryIndex, county_rollup_index: RollupIndex,
+                 forecasts: Dict[int, BatchForecast] = None, forecast_param_entries: Dict = None,
+                 county_rollup: pd.DataFrame = None):
+        self.history_index = history_index
+        self.county_rollup_index = county_rollup_index
+        self.county_rollup = county_rollup
+        self.forecasts = forecasts
+        self.forecast_param_entries = forecast_param_entries
+
+
+class CheckScheduler:
+
+    def __init__(self, kind: str, ds: DataSource, log: ResultLog, config: QCConfig):
+        self.kind = kind
+        self.ds = ds
+        self.log = log
+        self.config = config
+
+        self.specs = checks_for(kind)
+        self.needed = set(n for x in self.specs for n in x.inputs)
+
+        # name -> [calls, seconds]
+        self.timings: Dict[str, List[float]] = { x.name: [0, 0.0] for x in self.specs }
+
+        # target date -> models for all states (workers get them from the parent)
+        self._forecasts: Dict[int, BatchForecast] = dict(getattr(ds, "forecasts", None) or {})
+        self._forecast_params: ForecastParamStore = getattr(ds, "forecast_params", None)
+
+    def run_rows(self, df: pd.DataFrame, workers: int = None):
+        """ run the checks for every row of a working/current frame
+
+        workers defaults to config.check_workers, 1 runs in-process
+        """
+
+        if workers is None: workers = self.config.check_workers
+        if workers > 1 and df.shape[0] > 1:
+            self._run_rows_parallel(df, workers)
+        else:
+            self._run_rows_serial(df)
+
+        if self._forecast_params != None:
+            self._forecast_params.save()
+        cache = get_forecast_cache()
+        if cache != None and "forecasts" in self.needed:
+            cache.evict()
+
+    def _run_rows_serial(self, df: pd.DataFrame):
+
+        vresults = self._evaluate_vector(df=df)
+
+        cnt = 0
+        for pos, row in enumerate(df.itertuples()):
+            try:
+                self._run_state(row.state, row, pos, vresults)
+            except Exception as ex:
+                logger.exception(ex)
+                self.log.internal(row.state, f"{ex}")
+
+            if cnt != 0 and cnt % 10 == 0:
+                logger.info(f"  processed {cnt} states")
+            cnt += 1
+
+        logger.info(f"  processed {cnt} states")
+
+    def run_states(self, states: List[str]):
+        " run the checks for each state (no row, used for history) "
+
+        vresults = self._evaluate_vector(states=states)
+        for pos, state in enumerate(states):
+            self._run_state(state, None, pos, vresults)
+
+    def report_timings(self):
+        " log the time spent in each check "
+
+        total = sum(x[1] for x in self.timings.values())
+        logger.info(f"check timings for {self.kind} ({total:.3f} secs):")
+        for name, (calls, secs) in sorted(self.timings.items(), key=lambda x: -x[1][1]):
+            if calls == 0:
+                logger.info(f"  {name:<32} skipped")
+            else:
+                logger.info(f"  {name:<32} {secs:8.3f} secs  {calls:5.0f} calls")
+
+    def _run_rows_parallel(self, df: pd.DataFrame, workers: int):
+
+        # fit the forecasts once here instead of in every worker
+        if "forecasts" in self.needed:
+            for target_date in df["targetDate"].drop_duplicates().values:
+                self._get_forecasts(int(target_date))
+
+        params = self._get_forecast_params() if "forecast_params" in self.needed else None
+        shared = SharedInputs(
+            self.ds.history_index if "history" in self.needed else None,
+            self.ds.county_rollup_index if "rollup" in self.needed else None,
+            self._forecasts,
+            params.snapshot() if params != None else None,
+            self.ds.county_rollup if "rollup" in self.needed else None)
+
+        n_shards = min(df.shape[0], workers * SHARDS_PER_WORKER)
+        shards = [df.iloc[x[0]:x[-1]+1] for x in np.array_split(np.arange(df.shape[0]), n_shards)]
+        logger.info(f"  run {df.shape[0]} states in {n_shards} shards on {workers} processes")
+
+        # spawn, not fork: the service runs the checks from one of its threads
+        # and forking a threaded process can copy a lock held by another thread
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(self.kind, shared, self.config),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(_run_shard, x) for x in shards]
+
+            # merge in submission order so the messages are in row order
+            for shard, future in zip(shards, futures):
+                try:
+                    partial, timings, updates = future.result()
+                    if params != None: params.merge(updates)
+                except Exception as ex:
+                    logger.exception(ex)
+                    logger.warning(f"  shard {shard.state.iloc[0]}-{shard.state.iloc[-1]} failed in worker -> run in-process")
+                    partial = ResultLog()
+                    scheduler = CheckScheduler(self.kind, shared, partial, self.config)
+                    scheduler._forecast_params = params
+                    scheduler._run_rows_serial(shard)
+                    timings = scheduler.timings
+
+                self.log.merge(partial)
+                for name, (calls, secs) in timings.items():
+                    self.timings[name][0] += calls
+                    self.timings[name][1] += secs
+
+    # ---
+
+    def _evaluate_vector(self, df: pd.DataFrame = None, states: List[str] = None) -> vector_checks.VectorResults:
+        """ run the vectorized checks up-front (None means use the per-row checks)
+
+        df for working/current, states for history
+        """
+
+        if not self.config.vectorize_checks: return None
+
+        names = [x.vector for x in self.specs if x.vector != None]
+        if len(names) == 0: return None
+
+        start = time.perf_counter()
+        try:
+            if df is None:
+                history_index = self.ds.history_index
+                if history_index is None: return None
+                vresults = vector_checks.evaluate_history(history_index, states, names)
+            else:
+                rollup = self.ds.county_rollup if "rollup" in self.needed else None
+                vresults = vector_checks.evaluate(df, names, rollup)
+        except Exception as ex:
+            logger.exception(ex)
+            self.log.internal("Vector", f"vectorized checks failed, using row checks: {ex}")
+            return None
+
+        # split the time evenly, the checks run together
+        secs = (time.perf_counter() - start) / len(names)
+        for x in self.specs:
+            if x.vector != None:
+                self.timings[x.name][0] += 1
+                self.timings[x.name][1] += secs
+        return vresults
+
+    def _resolve(self, state: str, row) -> Dict[str, Any]:
+        " inputs for a state, missing inputs are left out "
+
+        values = { "log": self.log, "config": self.config, "context": self.kind }
+        if row != None:
+            values["row"] = row
+
+        # only touch the datasources that are needed
+        if "history" in self.needed:
+            history_index = self.ds.history_index
+            if history_index != None:
+                values["history"] = history_index.get(state)
+
+        if "rollup" in self.needed:
+            rollup_index = self.ds.county_rollup_index
+            if rollup_index != None:
+                rollup = rollup_index.get(state)
+                if rollup != None: values["rollup"] = rollup
+
+        if "forecasts" in self.needed:
+            values["forecasts"] = self._get_forecasts(row.targetDate) if row != None else None
+        if "forecast_params" in self.needed:
+            values["forecast_params"] = self._get_forecast_params()
+
+        return values
+
+    def _get_forecast_params(self) -> ForecastParamStore:
+        " parameters from earlier runs, loaded on first use "
+
+        if not self.config.warm_start_forecast: return None
+        if self._forecast_params is None:
+            self._forecast_params = ForecastParamStore(self.config.forecast_params_path)
+        return self._forecast_params
+
+    def _get_forecasts(self, target_date: int) -> BatchForecast:
+        " models for all states for a target date, fit on first use "
+
+        if not self.config.batch_forecast: return None
+
+        forecasts = self._forecasts.get(target_date)
+        if forecasts is None:
+            history_index = self.ds.history_index
+            if history_index is None: return None
+
+            params = self._get_forecast_params()
+
+            start = time.perf_counter()
+            forecasts = BatchForecast(history_index, target_date,
+                window=self.config.fit_window_days, params=params, cache=get_forecast_cache())
+            if params != None: forecasts.save_params(params)
+            logger.info(f"  fit forecasts for {forecasts.n_fit} of {len(forecasts.states)} states in {time.perf_counter() - start:.3f} secs")
+            self._forecasts[target_date] = forecasts
+        return forecasts
+
+    def _run_state(self, state: str, row, pos: int, vresults: vector_checks.VectorResults):
+
+        values = self._resolve(state, row)
+
+        results: Dict[str, Any] = {}
+        for x in self.specs:
+            if x.depends != None and not results.get(x.depends):
+                continue
+
+            if x.vector != None and vresults != None:
+                vresults.emit(self.log, pos, [x.vector])
+                results[x.name] = None
+                continue
+
+            if any(not n in values for n in x.inputs):
+                continue
+
+            start = time.perf_counter()
+            results[x.name] = x.func(*[values[n] for n in x.inputs])
+            t = self.timings[x.name]
+            t[0] += 1
+            t[1] += time.perf_counter() - start
+
+
+# --- process pool workers
+
+_worker_args = None
+
+def _init_worker(kind: str, shared: SharedInputs, config: QCConfig):
+    " called once per worker process "
+    global _worker_args
+
+    # make sure the checks are registered (spawned workers start empty)
+    import app.checks
+    _worker_args = (kind, shared, config)
+
+def _run_shard(df: pd.DataFrame):
+    """ run the checks for a shard
+
+    returns the partial log, the timings and the forecast params that were added
+    """
+
+    kind, shared, config = _worker_args
+    log = ResultLog()
+    scheduler = CheckScheduler(kind, shared, log, config)
+    params = None
+    if shared.forecast_param_entries != None:
+        params = ForecastParamStore(entries=shared.forecast_param_entries)
+        scheduler._forecast_params = params
+    scheduler._run_rows_serial(df)
+    return log, scheduler.timings, params.updates() if params != None else []
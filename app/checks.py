@@ -7,10 +7,17 @@
 #   Each message has a category.  See ResultLog for a list of categories.
 ##
 # To add a new check:
-#    1. create the routine here
-#    2. add it to the calling routines in check_dataset
-#    3. put it behind the experimental flag (config.enable_experimental) at first
-#    4. WHEN YOU CHANGE A CHECK THAT IMPACTS WORKING, MAKE SURE TO UPDATE THE EXCEL TRACKING DOCUMENT
+#    1. create the routine here and register it with @check(kinds, inputs, ...)
+#         kinds   -- the datasets it runs for (WORKING, CURRENT, HISTORY)
+#         inputs  -- the arguments it takes, in order (see check_registry.INPUTS)
+#         order   -- where it runs among the checks for a state
+#         depends -- a check that must run first and return True (e.g. a
+#                    forecast that needs a consistent history)
+#         vector  -- the name of a vectorized version in vector_checks, used
+#                    instead of the row routine when config.vectorize_checks is on
+#                    (it must report the same messages)
+#    2. put it behind the experimental flag (config.enable_experimental) at first
+#    3. WHEN YOU CHANGE A CHECK THAT IMPACTS WORKING, MAKE SURE TO UPDATE THE EXCEL TRACKING DOCUMENT
 #
 
 
@@ -23,8 +30,16 @@ from typing import Tuple
 from app.util import udatetime
 
 from .qc_config import QCConfig
+from .check_registry import check, WORKING, CURRENT, HISTORY
+import app.vector_checks as vector_checks
+from .data.schema import BLANK_COUNT
+from .data.history_index import StateHistory
+from .data.rollup_index import Rollup
 from .log.result_log import ResultLog
 from .modeling.forecast import Forecast
+from .modeling.batch_forecast import BatchForecast
+from .modeling.forecast_params import ForecastParamStore
+from .modeling.forecast_cache import get_forecast_cache
 from .modeling.forecast_plot import plot_to_file
 from .modeling.forecast_io import save_forecast_hd5, load_forecast_hd5
 
@@ -47,6 +62,7 @@ def missing_tests(log: ResultLog):
 
 # ----------------------------------------------------------------
 
+@check(kinds=[WORKING, CURRENT], inputs=["row", "log"], order=10, vector=vector_checks.TOTAL)
 def total(row, log: ResultLog):
     """Check that pendings, positive, and negative sum to the reported total"""
 
@@ -95,11 +111,11 @@ def total_tests(row, log: ResultLog):
         log.data_entry(row.state, f"Formula broken -> Positive ({n_pos}) + Negative ({n_neg}) != Total Tests ({n_tests}), delta = {n_diff}")
 
 
+@check(kinds=[WORKING, CURRENT], inputs=["row", "log"], order=20)
 def last_update(row, log: ResultLog):
     """Source has updated within a reasonable timeframe"""
 
-    xrow = row._asdict()
-    msg = xrow.get("lastUpdateEt_msg")
+    msg = getattr(row, "lastUpdateEt_msg", None)
     if msg:
         log.data_entry(row.state, f"Last Update (DT) is {msg}")
         return
@@ -114,13 +130,13 @@ def last_update(row, log: ResultLog):
     #elif hours > 18.0:
     #   log.data_source(row.state, f"Last Updated (col T) hasn't been updated in {hours:.0f}  hours")
 
+@check(kinds=[WORKING], inputs=["row", "log", "config"], order=30)
 def last_checked(row, log: ResultLog, config: QCConfig):
     """Data was checked within a reasonable timeframe"""
 
     if not config.is_near_release: return
 
-    xrow = row._asdict()
-    msg =  xrow.get("lastCheckEt_msg")
+    msg = getattr(row, "lastCheckEt_msg", None)
     if msg:
         log.data_entry(row.state, f"Last Checked (DT) is {msg}")
         return
@@ -148,6 +164,7 @@ def last_checked(row, log: ResultLog, config: QCConfig):
         return
 
 
+@check(kinds=[WORKING], inputs=["row", "log", "config"], order=40)
 def checkers_initials(row, log: ResultLog, config: QCConfig):
     """Confirm that checker initials are records"""
 
@@ -176,6 +193,7 @@ def checkers_initials(row, log: ResultLog, config: QCConfig):
     #   log.data_source(row.state, f"Last Updated (col T) hasn't been updated in {hours:.0f}  hours")
 
 
+@check(kinds=[WORKING, CURRENT], inputs=["row", "log"], order=50, vector=vector_checks.POSITIVES_RATE)
 def positives_rate(row, log: ResultLog):
     """Check that positives compose <20% test results"""
 
@@ -190,6 +208,7 @@ def positives_rate(row, log: ResultLog):
         if percent_pos > 80.0 and n_pos > 20:
             log.data_quality(row.state, f"high positives rate {percent_pos:.0f}% (positive={n_pos:,}, total={n_tot:,})")
 
+@check(kinds=[WORKING, CURRENT], inputs=["row", "log"], order=60, vector=vector_checks.DEATH_RATE)
 def death_rate(row, log: ResultLog):
     """Check that deaths are <5% of test results"""
 
@@ -205,6 +224,7 @@ def death_rate(row, log: ResultLog):
             log.data_quality(row.state, f"high death rate {percent_deaths:.0f}% (positive={n_deaths:,}, total={n_tot:,})")
 
 
+@check(kinds=[WORKING], inputs=["row", "log"], order=70, vector=vector_checks.LESS_RECOVERED_THAN_POSITIVE)
 def less_recovered_than_positive(row, log: ResultLog):
     """Check that we don't have more recovered than positive"""
 
@@ -212,6 +232,7 @@ def less_recovered_than_positive(row, log: ResultLog):
         log.data_quality(row.state, f"More recovered than positive (recovered={row.recovered:,}, positive={row.positive:,})")
 
 
+@check(kinds=[WORKING, CURRENT], inputs=["row", "log"], order=80, vector=vector_checks.PENDINGS_RATE)
 def pendings_rate(row, log: ResultLog):
     """Check that pendings are not more than 20% of total"""
 
@@ -229,55 +250,42 @@ def pendings_rate(row, log: ResultLog):
 
 # ----------------------------------------------------------------
 
-COUNTY_ERROR_THRESHOLDS = {
-    "positive-small": (.5, 1.5),
-    "positive-large": (.75, 1.25),
-    "death-small": (.5, 1.5),
-    "death-large": (.75, 1.25),
-}
+# shared with the vectorized version
+COUNTY_ERROR_THRESHOLDS = vector_checks.COUNTY_ERROR_THRESHOLDS
 
-def counties_rollup_to_state(row, counties: pd.DataFrame, log: ResultLog):
+@check(kinds=[WORKING, CURRENT], inputs=["row", "rollup", "log"], order=120,
+       vector=vector_checks.COUNTIES_ROLLUP_TO_STATE)
+def counties_rollup_to_state(row, rollup: Rollup, log: ResultLog):
     """
     Check that county totals from NYT, CSBS, CDS datasets are
  about equal to the reported state totals. Metrics compared are:
         - positive cases
         - patient deaths
-    """
 
-    df = counties.copy()
+    The median source is compared (see Rollup)
+    """
 
     t = "positive-small" if row.positive < 500 else "positive-large"
     thresholds = COUNTY_ERROR_THRESHOLDS[t]
-    df["c"] = row.positive
-    df["c_min"] = (thresholds[0] * df["cases"]).astype(np.int)
-    df["c_max"] = (thresholds[1] * df["cases"] + 10).astype(np.int)
-    df["c_ok"] = (df.c_min <= df.c) & (df.c <= df.c_max)
+    cases = rollup.median_cases
+    c_min = int(thresholds[0] * cases)
+    c_max = int(thresholds[1] * cases + 10)
 
     t = "death-small" if row.death < 50 else "death-large"
     thresholds = COUNTY_ERROR_THRESHOLDS[t]
-    df["d"] = row.death
-    df["d_min"] = (thresholds[0] * df["deaths"]).astype(np.int)
-    df["d_max"] = (thresholds[1] * df["deaths"] + 10).astype(np.int)
-    df["d_ok"] = (df.d_min <= df.d) & (df.d <= df.d_max)
-
-    # use median
-    xindex = (df.shape[0] // 2)
-    # use biggest value
-    #xindex = df.shape[0] - 1
+    deaths = rollup.median_deaths
+    d_min = int(thresholds[0] * deaths)
+    d_max = int(thresholds[1] * deaths + 10)
 
     if row.positive > 1000:
-        df.sort_values(by="cases", inplace=True)
-        mid = df.iloc[xindex]
-        if not mid.c_ok:
-            logger.warning(f"  {row.state}: positive ({row.positive:,}) does not match county aggregate ({mid.c_min:,} to {mid.c_max:,})")
-            log.data_quality(row.state, f"positive ({row.positive:,}) does not match {mid.source} county aggregate ({mid.cases:,}, allow {mid.c_min:,} to {mid.c_max:,})")
+        if not (c_min <= row.positive <= c_max):
+            logger.warning(f"  {row.state}: positive ({row.positive:,}) does not match county aggregate ({c_min:,} to {c_max:,})")
+            log.data_quality(row.state, f"positive ({row.positive:,}) does not match {rollup.median_cases_source} county aggregate ({cases:,}, allow {c_min:,} to {c_max:,})")
 
     if row.death > 200:
-        df.sort_values(by="deaths", inplace=True)
-        mid = df.iloc[xindex]
-        if not mid.d_ok:
-            logger.warning(f"  {row.state}:   death ({row.death:,}) does not match county aggregate ({mid.d_min:,} to {mid.d_max:,})")
-            log.data_quality(row.state, f"death ({row.death:,}) does not match {mid.source} county aggregate ({mid.deaths:,}, allow {mid.d_min:,} to {mid.d_max:,})")
+        if not (d_min <= row.death <= d_max):
+            logger.warning(f"  {row.state}:   death ({row.death:,}) does not match county aggregate ({d_min:,} to {d_max:,})")
+            log.data_quality(row.state, f"death ({row.death:,}) does not match {rollup.median_deaths_source} county aggregate ({deaths:,}, allow {d_min:,} to {d_max:,})")
 
 # ----------------------------------------------------------------
 
@@ -287,21 +295,11 @@ IGNORE_THRESHOLDS = {
     "death": 20,
 }
 
-def find_last_change(val, vec_vals: pd.Series, vec_date) -> Tuple[int, datetime]:
-    vals = vec_vals.values
-    for i in range(len(vals)):
-        if vals[i] != val: 
-            sdate = str(vec_date.values[i])
-            d = datetime(int(sdate[0:4]), int(sdate[4:6]), int(sdate[6:8]))
-            return vals[i], udatetime.naivedatetime_as_eastern(d)
-    return 0, None
-
-def consistent_with_history(row, df: pd.DataFrame, log: ResultLog) -> bool:
+@check(kinds=[CURRENT], inputs=["row", "history", "log"], order=90)
+def consistent_with_history(row, df: StateHistory, log: ResultLog) -> bool:
     """Check that row values match same date in history
     """
 
-    df = df[df.date == row.targetDate]
-
     #dict_row = row._asdict()
 
     return
@@ -310,7 +308,8 @@ def consistent_with_history(row, df: pd.DataFrame, log: ResultLog) -> bool:
     #exit(-1)
 
 
-def increasing_values(row, df: pd.DataFrame, log: ResultLog, config: QCConfig = None) -> bool:
+@check(kinds=[WORKING, CURRENT], inputs=["row", "history", "log", "config"], order=100)
+def increasing_values(row, df: StateHistory, log: ResultLog, config: QCConfig = None) -> bool:
     """Check that new values more than previous values
 
     df contains the historical values (newest first).  offset controls how many days to look back.
@@ -321,13 +320,11 @@ def increasing_values(row, df: pd.DataFrame, log: ResultLog, config: QCConfig =
 
     if not config: config = QCConfig()
 
-    df = df[df.date < row.targetDate]
-
-    dict_row = row._asdict()
+    df = df.before(row.targetDate)
 
     # local time is an editable field that it supposed to be the last time the data changed.
     # last_updated is the same value but adjusted to eastern TZ 
-    if "localTime" in dict_row:
+    if hasattr(row, "localTime"):
         local_time = row.localTime 
         d_local = local_time.year * 10000 + local_time.month * 100 + local_time.day
     else:
@@ -354,7 +351,7 @@ def increasing_values(row, df: pd.DataFrame, log: ResultLog, config: QCConfig =
     source_messages = []
     has_issues, consolidate, n_days, n_days_prev = False, True, -1, 0
     for c in fieldList:
-        val = dict_row.get(c)
+        val = getattr(row, c, None)
         if val is None:
             log.internal(row.state, f"{c} missing column")
             has_issues, consolidate = True, False
@@ -366,10 +363,10 @@ def increasing_values(row, df: pd.DataFrame, log: ResultLog, config: QCConfig =
             if debug: logger.debug(f"  {c} missing history column")
             continue
 
-        vec = df[c].values
+        vec = df[c]
 
         prev_val = vec[0] if vec.size > 0 else 0
-        prev_date = df["date"].iloc[0] if vec.size > 0 else 0
+        prev_date = df["date"][0] if vec.size > 0 else 0
 
 
         if val < prev_val and (val > 0 and prev_val != 0): # negative values indicate blank/errors
@@ -394,7 +391,7 @@ def increasing_values(row, df: pd.DataFrame, log: ResultLog, config: QCConfig =
             continue
 
         if val == prev_val:
-            changed_val, changed_date = find_last_change(val, df[c], df["date"])
+            changed_val, changed_date = df.last_change(c)
 
             n_days = int((d_target - changed_date).total_seconds() // (60*60*24))
 
@@ -417,7 +414,7 @@ def increasing_values(row, df: pd.DataFrame, log: ResultLog, config: QCConfig =
                     consolidate = False
                     if debug: logger.debug(f"  {c} ({val:,}) hasn't changed since {changed_date.month}/{changed_date.day} ({n_days} days ago) -> force individual lines ")
             else:
-                d_last_change = max(d_last_change, df["date"].values[-1])
+                d_last_change = max(d_last_change, df["date"][-1])
                 has_issues, consolidate = True, False
                 log.data_source(row.state, f"{c} ({val:,}) constant for all time")
                 if debug: logger.debug(f"  {c} ({val:,}) constant -> force individual lines ")
@@ -527,7 +524,8 @@ def increasing_values(row, df: pd.DataFrame, log: ResultLog, config: QCConfig =
 
 # ----------------------------------------------------------------
 
-def monotonically_increasing(df: pd.DataFrame, log: ResultLog):
+@check(kinds=[HISTORY], inputs=["history", "log"], order=10, vector=vector_checks.MONOTONICALLY_INCREASING)
+def monotonically_increasing(history: StateHistory, log: ResultLog):
     """Check that timeseries values are monotonically increasing
 
     Input is expected to be the values for a single state
@@ -535,32 +533,27 @@ def monotonically_increasing(df: pd.DataFrame, log: ResultLog):
 
     columns_to_check = ["positive", "negative","hospitalized", "death"]
 
-    state = df["state"].min()
-    if state != df["state"].max():
-        raise Exception("Expected input to be for a single state")
-
-    # TODO: don't group on state -- this is already filtered to a single state
-    df = df.sort_values(["state", "date"], ascending=True)
-    df_lagged = df.groupby("state")[columns_to_check] \
-        .shift(1) \
-        .rename(columns=lambda c: c+"_lag")
-
-    df_comparison = df.merge(df_lagged, left_index=True, right_index=True, how="left")
-
-    # check that all the counts are >= the previous day
+    # oldest first, compare each day to the last day that wasn't blank
+    dates = history.ascending("date")
     for col in columns_to_check:
-        if (df_comparison[f"{col}_lag"] > df_comparison[col]).any():
-            error_dates = df_comparison.loc[(df_comparison[f"{col}_lag"] > df_comparison[col])]["date"]
-            error_dates_str = error_dates.astype(str).str.cat(sep=", ")
-
-            log.data_quality(state, f"{col} values decreased from the previous day (on {error_dates_str})")
+        vals = history.ascending(col)
+        reported = vals != BLANK_COUNT
+        vals, col_dates = vals[reported], dates[reported]
+        decreased = vals[:-1] > vals[1:]
+        if decreased.any():
+            error_dates_str = ", ".join(str(x) for x in col_dates[1:][decreased])
+            log.data_quality(history.state, f"{col} values decreased from the previous day (on {error_dates_str})")
 
 # ----------------------------------------------------------------
 
 FIT_THRESHOLDS = [0.9, 1.2]
 
-def expected_positive_increase( row, history: pd.DataFrame,
-                                log: ResultLog, context: str, config: QCConfig=None):
+@check(kinds=[WORKING, CURRENT], inputs=["row", "history", "log", "context", "config", "forecasts", "forecast_params"],
+       depends="increasing_values", order=110)
+def expected_positive_increase( row, history: StateHistory,
+                                log: ResultLog, context: str, config: QCConfig=None,
+                                forecasts: BatchForecast = None,
+                                forecast_params: ForecastParamStore = None):
     """
     Fit state-level daily positives data to an exponential and a linear curve.
     Get expected vs actual case increase to determine if current positives
@@ -568,6 +561,9 @@ def expected_positive_increase( row, history: pd.DataFrame,
 
     The exponential is used as the upper bound. The linear is used as the lower bound.
 
+    forecasts has the models for all states fit at once, states that are
+    not in it are fit here (starting from forecast_params if available).
+
     TODO: Eventually these curves will NOT be exp (perhaps logistic?)
           Useful to know which curves have been "leveled" but from a
           data quality perspective, this check would become annoying
@@ -577,13 +573,30 @@ def expected_positive_increase( row, history: pd.DataFrame,
 
     current = row # this is an iterrows() record, not a data frame
 
-    forecast = Forecast()
-    forecast.date = current.targetDate
+    def history_frame() -> pd.DataFrame:
+        df = history.to_frame()
+        return df.loc[df["date"] != current.targetDate]
+
+    forecast = None
+    if forecasts != None:
+        forecast = forecasts.forecast(current.state, current.positive)
+        if forecast != None and (config.save_results or config.plot_models):
+            forecast.set_history(history_frame(), config.fit_window_days)
+
+    if forecast is None:
+        forecast = Forecast()
+        forecast.date = current.targetDate
 
-    history = history.loc[history["date"] != forecast.date]
+        forecast.set_history(history_frame(), config.fit_window_days)
+        p0 = None
+        if forecast_params != None:
+            p0 = forecast_params.warm_start(forecast.state, forecast.date, forecast.origin_date)
 
-    forecast.fit(history)
-    forecast.project(current)
+        forecast.fit(p0=p0, cache=get_forecast_cache())
+        forecast.project(current)
+        if forecast_params != None:
+            forecast_params.update(forecast.state, forecast.date, forecast.origin_date,
+                forecast.fitted_linear_params, forecast.fitted_exp_params)
 
     if config.save_results:
         save_forecast_hd5(forecast, config.results_dir)
@@ -614,10 +627,10 @@ def expected_positive_increase( row, history: pd.DataFrame,
         is_bad = True
 
     if is_bad:
-        logger.error(f"{forecast.state}: fit\n{history[['date', 'positive','total']]}")
+        logger.error(f"{forecast.state}: fit\n{history_frame()[['date', 'positive','total']]}")
         logger.error(f"{forecast.state}: project {current.targetDate} positive={current.positive:,}, total={current.total:,}")
     elif debug:
-        logger.debug(f"{forecast.state}: fit\n{history[['date', 'positive','total']]}")
+        logger.debug(f"{forecast.state}: fit\n{history_frame()[['date', 'positive','total']]}")
         logger.debug(f"{forecast.state}: project {current.targetDate} positive={current.positive:,}, total={current.total:,}")
 
     if is_bad: return
@@ -8,38 +8,108 @@
 # This module is responsible for type conversion and renaming the fields for consistency.
 #
 
-from typing import List, Dict
+from typing import List, Dict, Callable, Tuple
+from datetime import datetime
 from loguru import logger
 import pandas as pd
-from urllib.request import urlopen
 import json
 import numpy as np
-import re
 import requests
 import socket
 import io
+from concurrent.futures import ThreadPoolExecutor
 
 from app.util import state_abbrevs
 import app.util.udatetime as udatetime
+import app.util.http_session as http_session
 from app.data.worksheet_wrapper import WorksheetWrapper
 from app.log.error_log import ErrorLog
+from app.data.http_cache import HttpCache
+from app.data.snapshot_store import SnapshotStore
+from app.data.latest_date_reader import LatestDateReader
+from app.data.history_index import HistoryIndex
+from app.data.rollup_index import RollupIndex
+from app.data.schema import HISTORY_SCHEMA, CURRENT_SCHEMA, COUNTY_SCHEMA, CDS_COLUMNS, \
+    BLANK_COUNT, INVALID_COUNT
 
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 KEY_PATH = "credentials-scanner.json"
 
-def get_remote_csv(xurl: str) -> pd.DataFrame:
-    r = requests.get(xurl, timeout=1)
+# errors that mean a source could not be fetched in time.  once the retries
+# are used up requests raises ConnectionError (not Timeout) for read timeouts
+TIMEOUT_ERRORS = (socket.timeout, requests.exceptions.Timeout, requests.exceptions.ConnectionError)
+
+# names of the lazy-loaded properties that can be prefetched
+ALL_SOURCES = ["working", "history", "current", "cds_counties", "csbs_counties", "nyt_counties"]
+
+# the NYT county file covers every day, stream it and only keep the newest date.
+# the reader is shared so later fetches only read the new tail of the file.
+g_nyt_reader = LatestDateReader(
+    "https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv",
+    "date", incremental=True)
+
+# optional on-disk cache for get_remote_csv, see enable_http_cache
+g_http_cache: HttpCache = None
+
+def enable_http_cache(cache_dir: str, max_mb: int = 500) -> HttpCache:
+    " cache remote csv files in cache_dir and only download them when they change "
+    global g_http_cache
+    if g_http_cache is None or g_http_cache.cache_dir != cache_dir:
+        g_http_cache = HttpCache(cache_dir, max_bytes=max_mb * 1024 * 1024)
+    else:
+        g_http_cache.max_bytes = max_mb * 1024 * 1024
+    return g_http_cache
+
+def http_cache_stats() -> Dict:
+    " hit/miss statistics for the remote csv cache (empty if not enabled) "
+    if g_http_cache is None: return {}
+    return g_http_cache.stats()
+
+def get_remote_csv(xurl: str, usecols: List[str] = None) -> pd.DataFrame:
+    " read a remote csv, optionally only the columns in usecols (missing columns are ignored) "
+
+    def parse(text: str) -> pd.DataFrame:
+        f = io.StringIO(text)
+        if usecols is None: return pd.read_csv(f)
+        return pd.read_csv(f, usecols=lambda c: c in usecols)
+
+    if g_http_cache != None:
+        parse_key = ",".join(usecols) if usecols != None else ""
+        return g_http_cache.get_frame(xurl, parse, parse_key=parse_key)
+
+    r = http_session.get(xurl)
     if r.status_code >= 300: 
         raise Exception(f"Could not get {xurl}, status={r.status_code}")
-    f = io.StringIO(r.text)
-    df = pd.read_csv(f)
-    return df
+    return parse(r.text)
 
 
+def coerce_to_int(s: pd.Series) -> Tuple[pd.Series, np.ndarray]:
+    """ convert a column of count strings (with optional commas) to int
+
+    blank cells become BLANK_COUNT and anything that isn't a whole,
+    non-negative number becomes INVALID_COUNT.
+
+    returns the int column and a mask of the invalid cells
+    """
+    s = s.fillna("").astype(str).str.strip().str.replace(",", "", regex=False)
+
+    is_blank = (s == "").values
+    is_bad = (~is_blank) & (~s.str.match("^[0-9]+$").values.astype(bool))
+
+    values = pd.to_numeric(s.where(~(is_blank | is_bad), "0"), errors="coerce").values
+    values = np.where(is_blank, BLANK_COUNT, np.where(is_bad, INVALID_COUNT, values))
+    return pd.Series(values.astype(np.int64), index=s.index), is_bad
+
 
 class DataSource:
 
-    def __init__(self):
+    def __init__(self, snapshot_dir: str = None, as_of: datetime = None,
+                 snapshot_keep: int = 0, snapshot_max_age_days: float = 0):
+        """
+        snapshot_dir: save a snapshot of every loaded source to this directory
+        as_of: replay the snapshots from snapshot_dir as-of this time instead of fetching
+        snapshot_keep/snapshot_max_age_days: retention for the saved snapshots (0 for no limit)
+        """
 
         self._target_date = None
         self.log = ErrorLog()
@@ -62,14 +132,47 @@ class DataSource:
         self._nyt_counties: pd.DataFrame = None
         self._county_rollup: pd.DataFrame = None
 
+        # indexes
+        self._history_index: HistoryIndex = None
+        self._county_rollup_index: RollupIndex = None
+
+        # snapshots
+        self.snapshots = SnapshotStore(snapshot_dir, snapshot_keep, snapshot_max_age_days) if snapshot_dir else None
+        self.as_of = as_of
+        if as_of != None and self.snapshots is None:
+            raise Exception("as_of requires a snapshot_dir")
+
+    def _load(self, name: str, loader: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        " run a loader, or load its snapshot when replaying "
+
+        if self.as_of != None:
+            df, attrs = self.snapshots.load(name, self.as_of)
+            if name == "working":
+                self.last_publish_time = attrs.get("last_publish_time", "")
+                self.last_push_time = attrs.get("last_push_time", "")
+                self.current_time = attrs.get("current_time", "")
+            return df
+
+        df = loader()
+        if self.snapshots != None:
+            attrs = None
+            if name == "working":
+                attrs = {
+                    "last_publish_time": self.last_publish_time,
+                    "last_push_time": self.last_push_time,
+                    "current_time": self.current_time
+                }
+            self.snapshots.save(name, df, attrs=attrs)
+        return df
+
     @property
     def working(self) -> pd.DataFrame:
         " the working dataset"
         if self._working is None:
             if self.failed.get("working"): return None
             try:
-                self._working = self.load_working()
-            except socket.timeout:
+                self._working = self._load("working", self.load_working)
+            except TIMEOUT_ERRORS:
                 self.failed["working"] = True
                 self.log.error(f"Could not fetch working")
             except Exception as ex:
@@ -84,8 +187,8 @@ class DataSource:
         if self._history is None:
             if self.failed.get("history"): return None
             try:
-                self._history = self.load_history()
-            except socket.timeout:
+                self._history = self._load("history", self.load_history)
+            except TIMEOUT_ERRORS:
                 self.failed["history"] = True
                 self.log.error(f"Could not fetch history")
             except Exception as ex:
@@ -99,8 +202,8 @@ class DataSource:
         if self._current is None:
             if self.failed.get("current"): return None
             try:
-                self._current = self.load_current()
-            except socket.timeout:
+                self._current = self._load("current", self.load_current)
+            except TIMEOUT_ERRORS:
                 self.failed["current"] = True
                 self.log.error(f"Could not fetch current")
             except Exception as ex:
@@ -114,8 +217,8 @@ class DataSource:
         if self._cds_counties is None:
             if self.failed.get("CDS"): return None
             try:
-                self._cds_counties = self.load_cds_counties()
-            except socket.timeout:
+                self._cds_counties = self._load("cds_counties", self.load_cds_counties)
+            except TIMEOUT_ERRORS:
                 self.failed["CDS"] = True
                 self.log.warning(f"Could not fetch CDS counties")
             except Exception as ex:
@@ -129,8 +232,8 @@ class DataSource:
         if self._csbs_counties is None:
             if self.failed.get("CSBS"): return None
             try:
-                self._csbs_counties = self.load_csbs_counties()
-            except socket.timeout:
+                self._csbs_counties = self._load("csbs_counties", self.load_csbs_counties)
+            except TIMEOUT_ERRORS:
                 self.failed["CSBS"] = True
                 self.log.warning(f"Could not fetch CSBS counties")
             except Exception as ex:
@@ -144,8 +247,8 @@ class DataSource:
         if self._nyt_counties is None:
             if self.failed.get("NYT"): return None
             try:
-                self._nyt_counties = self.load_nyt_counties()
-            except socket.timeout:
+                self._nyt_counties = self._load("nyt_counties", self.load_nyt_counties)
+            except TIMEOUT_ERRORS:
                 self.failed["NYT"] = True
                 self.log.warning(f"Could not fetch NYT counties")
             except Exception as ex:
@@ -153,6 +256,15 @@ class DataSource:
                 self.log.warning(f"Could not load NYT counties", exception=ex)
         return self._nyt_counties
 
+    @property
+    def history_index(self) -> HistoryIndex:
+        " per-state index of the history (None if history is not available) "
+        if self._history_index is None:
+            df = self.history
+            if df is None: return None
+            self._history_index = HistoryIndex(df)
+        return self._history_index
+
     @property
     def county_rollup(self) -> pd.DataFrame:
         """ return a single county dataset of select metrics """
@@ -172,7 +284,7 @@ class DataSource:
                 long_df = pd.concat(frames, axis=0, sort=False)
 
                 self._county_rollup = long_df \
-                    .groupby(["state", "source"])[metrics] \
+                    .groupby(["state", "source"], observed=True)[metrics] \
                     .sum() \
                     .fillna(0) \
                     .astype(int) \
@@ -182,27 +294,42 @@ class DataSource:
 
         return self._county_rollup
 
+    @property
+    def county_rollup_index(self) -> RollupIndex:
+        " per-state lookup of the county rollup (None if the rollup is not available) "
+        if self._county_rollup_index is None:
+            df = self.county_rollup
+            if df is None: return None
+            self._county_rollup_index = RollupIndex(df, key="state")
+        return self._county_rollup_index
+
+    def prefetch(self, sources: List[str] = None, max_workers: int = 6) -> None:
+        """ load several datasources at the same time
+
+        each source is loaded through its property on a thread pool so the
+        failed/log bookkeeping is the same as a lazy load.  sources that are
+        already loaded (or already failed) are not fetched again.
+        """
+        if sources is None: sources = ALL_SOURCES
+        for n in sources:
+            if not n in ALL_SOURCES:
+                raise Exception(f"Invalid source {n}, should be one of " + ", ".join(ALL_SOURCES))
+
+        n_workers = max(1, min(max_workers, len(sources)))
+        with ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="prefetch") as executor:
+            futures = [executor.submit(getattr, self, n) for n in sources]
+            for f in futures: f.result()
+
     def safe_convert_to_int(self, df: pd.DataFrame, col_name: str) -> pd.Series:
         " convert a series to int even if it contains bad data"
-        s = df[col_name].str.strip().replace(re.compile(","), "")
-
-        is_blank = (s == "")
-        is_bad = (~s.str.isnumeric()) & (~is_blank)
+        s, is_bad = coerce_to_int(df[col_name])
+        if not is_bad.any(): return s
 
-        df.loc[is_blank, col_name] = "-1000"
-        s = df[col_name]
-
-        df_errs = df[is_bad]
-        if df_errs.shape[0] == 0: return s.astype(np.int)
-
-        df_errs = df_errs[["state", col_name]]
+        df_errs = df.loc[is_bad, ["state", col_name]]
         logger.error(f"invalid input values for {col_name}:\n{df_errs}")
-        for _, e_row in df_errs.iterrows():
-            v = e_row[col_name]
-            self.log.error(f"Invalid {col_name} value ({v}) for {e_row.state}")
-
-        s = s.where(is_bad, other="-1001")
-        return s.astype(np.int)
+        self.log.errors([f"Invalid {col_name} value ({v}) for {state}"
+            for state, v in zip(df_errs["state"].values, df_errs[col_name].values)])
+        return s
 
     def parse_dates(self, dates: List):
         if len(dates) != 5:
@@ -321,25 +448,14 @@ class DataSource:
         for c in df.columns[idx+1:eidx]:
             df[c] = self.safe_convert_to_int(df, c)
 
-        def standardize(d: str) -> str:
-            sd, err_num = udatetime.standardize_date(d)
-            return str(err_num) + sd
-
         def convert_date(df: pd.DataFrame, name: str, as_eastern: bool):
-            s = df[name]
-            s_date = s.apply(standardize)
-
-            s_idx = s_date.str[0].astype(np.int)
-            names = ["", "changed", "blank", "missing date", "missing time", "bad date", "bad time"]
-            s_msg = s_idx.map(lambda x: names[x])
-
-            s_date = s_date.str[1:]
+            s_date, s_idx = udatetime.standardize_dates(df[name])
 
-            #print(pd.DataFrame({ "before": s, "after": s_date, "changed": s_changed}))
+            names = np.array(["", "changed", "blank", "missing date", "missing time", "bad date", "bad time"], dtype=object)
+            s_msg = pd.Series(names[s_idx.values], index=s_idx.index)
 
-            s_date = pd.to_datetime(s_date, format="%m/%d/%Y %H:%M")
             if as_eastern:
-                s_date = s_date.apply(udatetime.pandas_timestamp_as_eastern)
+                s_date = udatetime.series_from_naive_eastern(s_date)
 
             df[name] = s_date
             df[name + "_msg"] = s_msg
@@ -358,44 +474,23 @@ class DataSource:
     def load_current(self) -> pd.DataFrame:
         """ load the current values from the API """
 
-        df = get_remote_csv("https://covidtracking.com/api/states.csv")
+        df = get_remote_csv("https://covidtracking.com/api/states.csv", usecols=CURRENT_SCHEMA.columns)
+        df = CURRENT_SCHEMA.apply(df)
 
-        df = df.fillna(0)
-        df["lastUpdateEt"] = pd.to_datetime(df["lastUpdateEt"].str.replace(" ", "/2020 "), format="%m/%d/%Y %H:%M") \
-            .apply(udatetime.pandas_timestamp_as_eastern)
-        df["checkTimeEt"] = pd.to_datetime(df["checkTimeEt"].str.replace(" ", "/2020 "), format="%m/%d/%Y %H:%M") \
-            .apply(udatetime.pandas_timestamp_as_eastern)
+        df["lastUpdateEt"] = udatetime.series_from_naive_eastern(
+            pd.to_datetime(df["lastUpdateEt"].str.replace(" ", "/2020 "), format="%m/%d/%Y %H:%M"))
+        df["checkTimeEt"] = udatetime.series_from_naive_eastern(
+            pd.to_datetime(df["checkTimeEt"].str.replace(" ", "/2020 "), format="%m/%d/%Y %H:%M"))
         df["dateModified"] = pd.to_datetime(df["dateModified"])
         df["dateChecked"] = pd.to_datetime(df["dateChecked"])
-
-        df.fillna(0.0, inplace=True)
-
-        # counts
-        for c in ["positive", "negative", "pending", "hospitalized", "death", "recovered", "total", "totalTestResults"]:
-            df[c] = df[c].astype(np.int)
-        for c in ['hospitalizedCumulative', 'inIcuCumulative', 'onVentilatorCumulative']:
-            df[c] = df[c].astype(np.int)
-
-        # 0 or 1.  score = sum of others so it is 0-4
-        for c in ["positiveScore", "negativeScore", "negativeRegularScore", "commercialScore", "score"]:
-            df[c] = df[c].astype(np.int)
         return df
 
 
     def load_history(self) -> pd.DataFrame:
         """ load daily values over time from the API """
 
-        df = get_remote_csv("https://covidtracking.com/api/states/daily.csv")
-        df.fillna(0.0, inplace=True)
-
-        # counts
-        for c in ["positive", "negative", "pending", "hospitalized", "death", "recovered", "total", "totalTestResults"]:
-            df[c] = df[c].astype(np.int)
-        for c in ["positiveIncrease", "negativeIncrease", "hospitalizedIncrease", "deathIncrease", "totalTestResultsIncrease"]:
-            df[c] = df[c].astype(np.int)
-        for c in ['hospitalizedCumulative', 'inIcuCumulative', 'onVentilatorCumulative']:
-            df[c] = df[c].astype(np.int)
-
+        df = get_remote_csv("https://covidtracking.com/api/states/daily.csv", usecols=HISTORY_SCHEMA.columns)
+        df = HISTORY_SCHEMA.apply(df)
 
         df["dateChecked"] = pd.to_datetime(df["dateChecked"])
         return df
@@ -403,21 +498,23 @@ class DataSource:
     def load_cds_counties(self) -> pd.DataFrame:
         """ load the CDS county dataset """
 
-        cds = get_remote_csv("https://coronadatascraper.com/data.csv")
+        cds = get_remote_csv("https://coronadatascraper.com/data.csv", usecols=CDS_COLUMNS)
 
         cds = cds \
             .loc[(cds["country"] == "USA") & (~cds["county"].isnull())]
 
         cds["county"] = cds["county"].apply(lambda x: x.replace("County", "").strip())
         cds["source"] = "cds"
-        return cds
+        return COUNTY_SCHEMA.apply(cds)
 
     def load_csbs_counties(self) -> pd.DataFrame:
         """ load the CSBS county dataset """
 
         xurl = "http://coronavirus-tracker-api.herokuapp.com/v2/locations?source=csbs"
-        response = urlopen(xurl, timeout=1)
-        json_data = response.read().decode('utf-8', 'replace')
+        r = http_session.get(xurl)
+        if r.status_code >= 300:
+            raise Exception(f"Could not get {xurl}, status={r.status_code}")
+        json_data = r.content.decode('utf-8', 'replace')
         d = json.loads(json_data)
         csbs = pd.json_normalize(d['locations'])
 
@@ -433,20 +530,19 @@ class DataSource:
                 "coordinates.longitude":"long"})
         csbs["state"] = csbs["state"].map(state_abbrevs)
         csbs["source"] = "csbs"
-        return csbs
+        return COUNTY_SCHEMA.apply(csbs)
 
     def load_nyt_counties(self) -> pd.DataFrame:
+        """ load the NYT county dataset (latest date only) """
 
-        df = get_remote_csv("https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv")
+        df = g_nyt_reader.read()
 
-        """ load the NYT county dataset """
         nyt = df.rename(columns={
                 "date":"last_updated"
             })
-        nyt = nyt.loc[nyt["last_updated"] == nyt["last_updated"].max()]
         nyt["state"] = nyt["state"].map(state_abbrevs)
         nyt["source"] = "nyt"
-        return nyt
+        return COUNTY_SCHEMA.apply(nyt)
 
 # ------------------------------------------------------------
 
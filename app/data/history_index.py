@@ -0,0 +1,166 @@
+#
+# HistoryIndex -- per-state access to the history without scanning it
+#
+#   Built once per history load:  the rows are sorted by (state, date) and every
+#   numeric column is stored as one contiguous, read-only numpy array.  Each
+#   state is an offset range into those arrays, so getting a state's history is
+#   a dict lookup and a slice (no copy), and "before a date" is a binary search.
+#
+#   Every column also has a run-length index: for each row, the position of the
+#   first row of the run of equal values it belongs to.  "When did this value
+#   last change" is then a lookup instead of a scan.
+#
+from typing import List, Dict, Tuple
+from datetime import datetime
+import pandas as pd
+import numpy as np
+
+from app.util import udatetime
+
+
+class StateHistory:
+    """ read-only view of one state's history
+
+    values are returned newest first (the same order as the API)
+    """
+
+    __slots__ = ("state", "_index", "_start", "_end")
+
+    def __init__(self, state: str, index: "HistoryIndex", start: int, end: int):
+        self.state = state
+        self._index = index
+        self._start = start
+        self._end = end
+
+    @property
+    def columns(self) -> List[str]:
+        return self._index.columns
+
+    @property
+    def empty(self) -> bool:
+        return self._end <= self._start
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def ascending(self, name: str) -> np.ndarray:
+        " a column oldest first "
+        return self._index.arrays[name][self._start:self._end]
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        " a column newest first "
+        return self.ascending(name)[::-1]
+
+    def last_change(self, name: str) -> Tuple[int, datetime]:
+        """ the newest value that differs from the newest value, and its date (as eastern)
+
+        returns (0, None) if the value never changed
+        """
+
+        if self.empty: return 0, None
+
+        first = self._index.run_starts[name][self._end - 1]
+        if first <= self._start: return 0, None
+
+        val = self._index.arrays[name][first - 1]
+        sdate = str(self._index.arrays["date"][first - 1])
+        d = datetime(int(sdate[0:4]), int(sdate[4:6]), int(sdate[6:8]))
+        return val, udatetime.naivedatetime_as_eastern(d)
+
+    def days_since_change(self, name: str) -> np.ndarray:
+        " days since the value last changed, newest first "
+        return self._index.days_since_change(name)[self._start:self._end][::-1]
+
+    def before(self, date: int) -> "StateHistory":
+        " the rows with date < date "
+        dates = self.ascending("date")
+        n = int(np.searchsorted(dates, date, side="left"))
+        return StateHistory(self.state, self._index, self._start, self._start + n)
+
+    def to_frame(self) -> pd.DataFrame:
+        " copy the rows into a data frame, newest first "
+        xdict = { "state": np.full(len(self), self.state, dtype=object) }
+        for c in self._index.columns:
+            xdict[c] = self[c]
+        return pd.DataFrame(xdict)
+
+
+class HistoryIndex:
+    """ history sorted by (key, date)
+
+    key is usually the state but can be any column (e.g. county fips)
+    """
+
+    def __init__(self, df: pd.DataFrame, key: str = "state"):
+
+        self.key = key
+
+        states = df[key].astype(str).values
+        dates = df["date"].values
+        order = np.lexsort((dates, states))
+
+        self.columns: List[str] = [c for c in df.columns
+            if c != key and pd.api.types.is_numeric_dtype(df[c].dtype)]
+
+        self.arrays: Dict[str, np.ndarray] = {}
+        for c in self.columns:
+            arr = np.ascontiguousarray(df[c].values[order])
+            arr.flags.writeable = False
+            self.arrays[c] = arr
+
+        sorted_states = states[order]
+        names, starts = np.unique(sorted_states, return_index=True)
+        ends = np.append(starts[1:], len(sorted_states))
+
+        self.states: List[str] = list(names)
+        self.starts: np.ndarray = starts
+        self._offsets: Dict[str, Tuple[int, int]] = {
+            s: (int(b), int(e)) for s, b, e in zip(names, starts, ends)
+        }
+
+        # first row of the state, for each row
+        self._row_starts = np.repeat(starts, ends - starts)
+
+        self.run_starts: Dict[str, np.ndarray] = {}
+        for c in self.columns:
+            if c == "date": continue
+            arr = self._run_starts(self.arrays[c])
+            arr.flags.writeable = False
+            self.run_starts[c] = arr
+
+        self._days_since_change: Dict[str, np.ndarray] = {}
+
+    def _run_starts(self, vals: np.ndarray) -> np.ndarray:
+        " position of the first row of each row's run (runs don't cross states) "
+
+        n = len(vals)
+        is_start = np.ones(n, dtype=bool)
+        is_start[1:] = vals[1:] != vals[:-1]
+        is_start[self.starts] = True
+
+        positions = np.where(is_start, np.arange(n), 0)
+        return np.maximum.accumulate(positions) if n > 0 else positions
+
+    def days_since_change(self, name: str) -> np.ndarray:
+        """ for each row (oldest first), days since the value last differed
+
+        -1 if it has been the same since the first row of the state
+        """
+
+        result = self._days_since_change.get(name)
+        if result is None:
+            days = pd.to_datetime(self.arrays["date"].astype(str), format="%Y%m%d").values \
+                .astype("datetime64[D]").astype(np.int64)
+
+            # the row before the run only counts if it is the same state
+            first = self.run_starts[name]
+            has_prev = first > self._row_starts
+            result = np.where(has_prev, days - days[np.maximum(first - 1, 0)], -1)
+            result.flags.writeable = False
+            self._days_since_change[name] = result
+        return result
+
+    def get(self, state: str) -> StateHistory:
+        " history for a state (empty if the state isn't in the history) "
+        start, end = self._offsets.get(state, (0, 0))
+        return StateHistory(state, self, start, end)
@@ -0,0 +1,184 @@
+#
+# HttpCache -- on-disk cache of remote files using conditional GET
+#
+#   Each url is stored as two files in the cache directory:
+#
+#      <key>.body  -- the raw response
+#      <key>.json  -- url, ETag/Last-Modified validators, encoding, size and last use
+#
+#   Requests send If-None-Match/If-Modified-Since when a copy is on disk.  On a
+#   304 the last parsed frame is reused (or the body is re-parsed after a restart).
+#
+#   The directory is bounded by max_bytes; the least recently used entries are
+#   evicted first.
+#
+import os
+import io
+import json
+import hashlib
+import threading
+import time
+from typing import Dict, Tuple, Callable
+from loguru import logger
+import pandas as pd
+
+import app.util.http_session as http_session
+
+
+class HttpCache:
+
+    def __init__(self, cache_dir: str, max_bytes: int = 500 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # key -> (validator, parse_key, frame)
+        self._frames: Dict[str, Tuple[str, str, pd.DataFrame]] = {}
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(cache_dir): os.makedirs(cache_dir)
+
+    def _key(self, url: str) -> str:
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def _body_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".body")
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def _read_meta(self, key: str) -> Dict:
+        p = self._meta_path(key)
+        if not os.path.exists(p) or not os.path.exists(self._body_path(key)): return None
+        try:
+            with open(p, "r") as f:
+                return json.load(f)
+        except Exception as ex:
+            logger.warning(f"  [http cache] ignore unreadable entry {p}: {ex}")
+            return None
+
+    def _write_meta(self, key: str, meta: Dict):
+        p = self._meta_path(key)
+        tmp_path = p + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, p)
+
+    def _write_body(self, key: str, content: bytes):
+        p = self._body_path(key)
+        tmp_path = p + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, p)
+
+    def get_frame(self, url: str, parse: Callable[[str], pd.DataFrame], parse_key: str = "") -> pd.DataFrame:
+        """ get a url as a data frame, only downloading/parsing it if it changed
+
+        parse converts the response text to a frame.  parse_key identifies the
+        parser so a frame parsed with different options is not reused.
+
+        returns a copy so callers can modify the frame in-place.
+        """
+
+        key = self._key(url)
+        meta = self._read_meta(key)
+
+        headers = {}
+        if meta != None:
+            if meta.get("etag"): headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"): headers["If-Modified-Since"] = meta["last_modified"]
+
+        r = http_session.get(url, headers=headers)
+        if r.status_code == 304 and meta != None:
+            with self._lock:
+                self.hits += 1
+            meta["used_at"] = time.time()
+            self._write_meta(key, meta)
+
+            validator = meta.get("etag") or meta.get("last_modified") or ""
+            item = self._frames.get(key)
+            if item != None and item[0] == validator and item[1] == parse_key:
+                logger.debug(f"  [http cache] {url} not modified -> reuse frame")
+                return item[2].copy()
+
+            logger.debug(f"  [http cache] {url} not modified -> parse cached body")
+            with open(self._body_path(key), "rb") as f:
+                text = f.read().decode(meta.get("encoding") or "utf-8", "replace")
+            df = parse(text)
+            self._frames[key] = (validator, parse_key, df)
+            return df.copy()
+
+        if r.status_code >= 300:
+            raise Exception(f"Could not get {url}, status={r.status_code}")
+
+        with self._lock:
+            self.misses += 1
+        logger.debug(f"  [http cache] {url} changed -> download {len(r.content):,} bytes")
+
+        meta = {
+            "url": url,
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "encoding": r.encoding,
+            "size": len(r.content),
+            "used_at": time.time(),
+        }
+        validator = meta["etag"] or meta["last_modified"] or ""
+        if validator != "":
+            self._write_body(key, r.content)
+            self._write_meta(key, meta)
+
+        df = parse(r.text)
+        if validator != "":
+            self._frames[key] = (validator, parse_key, df)
+            self.evict(keep=key)
+        return df.copy()
+
+    def evict(self, keep: str = None):
+        " remove least recently used entries until the cache fits in max_bytes "
+
+        with self._lock:
+            entries = []
+            total = 0
+            for fn in os.listdir(self.cache_dir):
+                if not fn.endswith(".json"): continue
+                key = fn[:-5]
+                meta = self._read_meta(key)
+                if meta is None: continue
+                size = meta.get("size", 0)
+                total += size
+                entries.append((meta.get("used_at", 0), key, size))
+
+            entries.sort()
+            for _, key, size in entries:
+                if total <= self.max_bytes: break
+                if key == keep: continue
+                for p in [self._body_path(key), self._meta_path(key)]:
+                    if os.path.exists(p): os.remove(p)
+                if key in self._frames: del self._frames[key]
+                total -= size
+                self.evictions += 1
+
+    def stats(self) -> Dict:
+        " hit/miss statistics and current size of the cache "
+
+        n_entries, n_bytes = 0, 0
+        for fn in os.listdir(self.cache_dir):
+            if fn.endswith(".body"):
+                n_entries += 1
+                n_bytes += os.path.getsize(os.path.join(self.cache_dir, fn))
+
+        n_requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / n_requests if n_requests > 0 else 0.0,
+            "evictions": self.evictions,
+            "entries": n_entries,
+            "bytes": n_bytes,
+            "max_bytes": self.max_bytes,
+        }
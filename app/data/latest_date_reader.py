@@ -0,0 +1,190 @@
+#
+# LatestDateReader -- stream a csv that grows by date, keep only the newest date
+#
+#   The response is read in blocks.  Each block of complete lines is parsed and
+#   filtered right away, so peak memory is one block plus one day of rows
+#   instead of the whole file.
+#
+#   With incremental=True the reader remembers the byte offset of the last
+#   complete line and later fetches only request the new tail (HTTP Range).  The
+#   tail is only used if the file's validator (ETag, else Last-Modified) is the
+#   one seen on the last read: it is sent as If-Range, so the server answers
+#   with the full file if it changed, and checked again on the 206 in case the
+#   server ignores If-Range.  Without a validator the last few KB before the
+#   offset are requested again and compared so a file that was rewritten (not
+#   just appended to) is detected and fully re-read.
+#
+import io
+import threading
+from typing import Tuple
+from loguru import logger
+import pandas as pd
+import requests
+
+import app.util.http_session as http_session
+
+# bytes before the offset that must match on an incremental fetch
+OVERLAP_BYTES = 4096
+
+
+def get_validator(r: requests.Response) -> str:
+    " the strong ETag or Last-Modified of a response (None if it has neither) "
+    etag = r.headers.get("ETag")
+    if etag != None and not etag.startswith("W/"): return etag
+    return r.headers.get("Last-Modified")
+
+
+def merge_latest(latest: pd.DataFrame, max_date: str, df: pd.DataFrame, date_column: str) \
+        -> Tuple[pd.DataFrame, str]:
+    " fold a block of rows into the rows for the newest date "
+
+    if df.shape[0] == 0: return latest, max_date
+
+    block_max = df[date_column].max()
+    if max_date is None or block_max > max_date:
+        return df.loc[df[date_column] == block_max], block_max
+    if block_max == max_date:
+        return pd.concat([latest, df.loc[df[date_column] == max_date]], axis=0, sort=False), max_date
+    return latest, max_date
+
+
+class LatestDateReader:
+
+    def __init__(self, url: str, date_column: str, incremental: bool = False,
+                 block_size: int = 1024 * 1024):
+        self.url = url
+        self.date_column = date_column
+        self.incremental = incremental
+        self.block_size = block_size
+
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        " forget everything read so far "
+        self.header: bytes = None
+        self.offset = 0
+        self.tail = b""
+        self.max_date: str = None
+        self.latest: pd.DataFrame = None
+        self.validator: str = None
+
+    def read(self) -> pd.DataFrame:
+        " get the rows for the newest date "
+
+        with self._lock:
+            if self.incremental and self.offset > 0:
+                df = self._read_tail()
+                if df is not None: return df.copy()
+            return self._read_all().copy()
+
+    # ---
+
+    def _parse(self, data: bytes) -> pd.DataFrame:
+        return pd.read_csv(io.BytesIO(self.header + data), dtype={self.date_column: str})
+
+    def _read_all(self) -> pd.DataFrame:
+        self.reset()
+
+        r = http_session.get(self.url, stream=True, headers={"Accept-Encoding": "identity"})
+        if r.status_code >= 300:
+            raise Exception(f"Could not get {self.url}, status={r.status_code}")
+
+        self.validator = get_validator(r)
+        df = self._consume(r)
+        logger.debug(f"  [stream] read {self.offset:,} bytes from {self.url}, latest date {self.max_date}")
+        return df
+
+    def _read_tail(self) -> pd.DataFrame:
+        " read only the new rows, returns None if a full read is needed "
+
+        start = self.offset - len(self.tail)
+        headers = {"Range": f"bytes={start}-", "Accept-Encoding": "identity"}
+        if self.validator != None: headers["If-Range"] = self.validator
+        r = http_session.get(self.url, stream=True, headers=headers)
+        if r.status_code == 416:
+            logger.info(f"  [stream] {self.url} shrank -> full read")
+            return None
+        if r.status_code != 206:
+            if r.status_code >= 300:
+                raise Exception(f"Could not get {self.url}, status={r.status_code}")
+            if self.validator != None:
+                logger.info(f"  [stream] {self.url} changed -> full read")
+            else:
+                logger.info(f"  [stream] {self.url} does not support ranges -> full read")
+            self.reset()
+            self.validator = get_validator(r)
+            return self._consume(r)
+
+        validator = get_validator(r)
+        if self.validator != None and validator != self.validator:
+            r.close()
+            logger.info(f"  [stream] {self.url} changed ({self.validator} -> {validator}) -> full read")
+            return None
+        self.validator = validator
+
+        expected = self.tail
+        prefix = b""
+        blocks = r.iter_content(self.block_size)
+        for block in blocks:
+            prefix += block
+            if len(prefix) >= len(expected): break
+        if prefix[:len(expected)] != expected:
+            r.close()
+            logger.info(f"  [stream] {self.url} was rewritten -> full read")
+            return None
+
+        n_before = self.offset
+        df = self._consume(r, first=prefix[len(expected):], blocks=blocks)
+        logger.debug(f"  [stream] read {self.offset - n_before:,} new bytes from {self.url}, latest date {self.max_date}")
+        return df
+
+    def _consume(self, r: requests.Response, first: bytes = b"", blocks=None) -> pd.DataFrame:
+        """ parse a response block-by-block
+
+        complete lines are committed (offset/latest are updated), a trailing
+        partial line is only included in the result.
+        """
+
+        if blocks is None: blocks = r.iter_content(self.block_size)
+
+        def all_blocks():
+            if len(first) > 0: yield first
+            for b in blocks: yield b
+
+        pending = b""
+        for block in all_blocks():
+            data = pending + block
+
+            if self.header is None:
+                idx = data.find(b"\n")
+                if idx < 0:
+                    pending = data
+                    continue
+                self.header = data[:idx+1]
+                self.offset += idx + 1
+                data = data[idx+1:]
+
+            idx = data.rfind(b"\n")
+            if idx < 0:
+                pending = data
+                continue
+
+            complete, pending = data[:idx+1], data[idx+1:]
+            self._commit(complete)
+
+        if self.header is None:
+            raise Exception(f"{self.url} is empty")
+
+        latest, max_date = self.latest, self.max_date
+        if pending.strip() != b"":
+            latest, max_date = merge_latest(latest, max_date, self._parse(pending), self.date_column)
+        if latest is None:
+            latest = self._parse(b"")
+        return latest.reset_index(drop=True)
+
+    def _commit(self, complete: bytes):
+        self.latest, self.max_date = merge_latest(self.latest, self.max_date,
+            self._parse(complete), self.date_column)
+        self.offset += len(complete)
+        self.tail = (self.tail + complete)[-OVERLAP_BYTES:]
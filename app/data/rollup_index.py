@@ -0,0 +1,76 @@
+#
+# RollupIndex -- aggregated county values keyed by state (or metro, ...)
+#
+#   Built once per rollup load:  for each key the per-source cases/deaths are
+#   kept as small arrays and the median source for cases and for deaths is
+#   picked up-front, so a check is a dict lookup instead of filtering,
+#   copying and sorting a frame for every row.
+#
+from typing import List, Dict
+import pandas as pd
+import numpy as np
+
+
+class Rollup:
+    """ the aggregated values for one key
+
+    sources/cases/deaths are parallel arrays (one entry per source).
+    the median source for cases and for deaths is the one at n // 2 when
+    sorted by that value (ties keep the source order).
+    """
+
+    __slots__ = ("key", "sources", "cases", "deaths",
+                 "median_cases", "median_cases_source",
+                 "median_deaths", "median_deaths_source")
+
+    def __init__(self, key: str, sources: np.ndarray, cases: np.ndarray, deaths: np.ndarray):
+        self.key = key
+        self.sources = sources
+        self.cases = cases
+        self.deaths = deaths
+
+        mid = len(sources) // 2
+
+        # stable sort so ties resolve like sort_values on the source-ordered frame
+        by_cases = np.argsort(cases, kind="stable")
+        self.median_cases = int(cases[by_cases[mid]])
+        self.median_cases_source = str(sources[by_cases[mid]])
+
+        # ties in deaths fall back to cases
+        by_deaths = np.lexsort((cases, deaths))
+        self.median_deaths = int(deaths[by_deaths[mid]])
+        self.median_deaths_source = str(sources[by_deaths[mid]])
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+
+class RollupIndex:
+
+    def __init__(self, df: pd.DataFrame, key: str = "state"):
+
+        self.key = key
+
+        keys = df[key].astype(str).values
+        sources = df["source"].astype(str).values
+        order = np.lexsort((sources, keys))
+
+        keys, sources = keys[order], sources[order]
+        cases = df["cases"].values[order]
+        deaths = df["deaths"].values[order]
+
+        names, starts = np.unique(keys, return_index=True)
+        ends = np.append(starts[1:], len(keys))
+
+        self._rollups: Dict[str, Rollup] = {
+            k: Rollup(k, sources[b:e], cases[b:e], deaths[b:e])
+            for k, b, e in zip(names, starts, ends)
+        }
+
+    @property
+    def keys(self) -> List[str]:
+        return list(self._rollups.keys())
+
+    def get(self, key: str) -> Rollup:
+        " the rollup for a key (None if there is no data for it) "
+        return self._rollups.get(key)
@@ -0,0 +1,82 @@
+#
+# Declared columns and dtypes for each datasource
+#
+#   Only the declared columns are read (usecols) so the cached frames stay small:
+#
+#      counts -- int32, blank values become BLANK_COUNT (or the schema's blank)
+#      dates  -- yyyymmdd as int32
+#      state  -- categorical over the known abbreviations
+#
+#   Anything else that is declared is kept as-is.
+#
+from typing import List
+import pandas as pd
+import numpy as np
+
+from app.util import state_abbrevs
+
+# ordered so min/max/sort work on the categorical
+STATE_DTYPE = pd.CategoricalDtype(sorted(set(state_abbrevs.values())), ordered=True)
+
+# markers for counts that are blank or not a number.  the working sheet and
+# the API use the same ones so a blank is never mistaken for a real 0.
+BLANK_COUNT = -1000
+INVALID_COUNT = -1001
+
+
+class FrameSchema:
+
+    def __init__(self, counts: List[str], dates: List[str] = None, others: List[str] = None,
+                 blank: int = BLANK_COUNT):
+        self.counts = counts
+        self.dates = dates or []
+        self.others = others or []
+        self.blank = blank
+
+    @property
+    def columns(self) -> List[str]:
+        " all declared columns "
+        return ["state"] + self.dates + self.counts + self.others
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        " drop undeclared columns and convert types "
+
+        df = df[[c for c in self.columns if c in df.columns]].copy()
+        for c in self.counts:
+            if c in df.columns:
+                df[c] = df[c].fillna(self.blank).astype(np.int32)
+        for c in self.dates:
+            if c in df.columns:
+                df[c] = df[c].astype(np.int32)
+        if "state" in df.columns:
+            df["state"] = df["state"].astype(STATE_DTYPE)
+        return df
+
+
+HISTORY_SCHEMA = FrameSchema(
+    dates=["date"],
+    counts=[
+        "positive", "negative", "pending", "hospitalized", "death", "recovered", "total", "totalTestResults",
+        "positiveIncrease", "negativeIncrease", "hospitalizedIncrease", "deathIncrease", "totalTestResultsIncrease",
+        "hospitalizedCumulative", "inIcuCumulative", "onVentilatorCumulative"
+    ],
+    others=["dateChecked"])
+
+CURRENT_SCHEMA = FrameSchema(
+    counts=[
+        "positive", "negative", "pending", "hospitalized", "death", "recovered", "total", "totalTestResults",
+        "hospitalizedCumulative", "inIcuCumulative", "onVentilatorCumulative",
+        # 0 or 1.  score = sum of others so it is 0-4
+        "positiveScore", "negativeScore", "negativeRegularScore", "commercialScore", "score"
+    ],
+    others=["lastUpdateEt", "checkTimeEt", "dateModified", "dateChecked"])
+
+# the county feeds only need enough to roll up to the state.  the rollup sums
+# the counties, so a blank county counts as 0 instead of the marker.
+COUNTY_SCHEMA = FrameSchema(
+    counts=["cases", "deaths", "recovered"],
+    others=["county", "source", "last_updated"],
+    blank=0)
+
+# raw CDS columns needed to filter to US counties
+CDS_COLUMNS = ["country", "state", "county", "cases", "deaths", "recovered"]
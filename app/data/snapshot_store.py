@@ -0,0 +1,135 @@
+#
+# SnapshotStore -- columnar copies of the loaded datasources
+#
+#   Every frame is written as feather after type conversion, named by source
+#   and fetch time (UTC):
+#
+#      <source>_<yyyymmdd-hhmmssZ>.feather
+#      <source>_<yyyymmdd-hhmmssZ>.json      -- optional attributes (e.g. sheet dates)
+#
+#   Loading with an as-of time picks the newest snapshot fetched at or before
+#   that time so a run can be replayed against the exact inputs of an incident.
+#
+#   keep and max_age_days bound the directory: after each save, snapshots of
+#   that source beyond the newest keep, or fetched more than max_age_days ago,
+#   are removed (0 disables either limit).
+#
+import os
+import re
+import json
+from datetime import datetime, timedelta
+from typing import Dict, Tuple, List
+from loguru import logger
+import pandas as pd
+import pytz
+
+import app.util.udatetime as udatetime
+
+SNAPSHOT_PATTERN = re.compile("^(?P<source>.+)_(?P<stamp>[0-9]{8}-[0-9]{6}Z)\\.feather$")
+
+def parse_as_of(s: str) -> datetime:
+    """ convert an as-of string into a tz-UTC datetime
+
+    accepts the snapshot file format (20200401-213000Z) or an ISO date,
+    naive ISO dates are treated as eastern time
+    """
+    if s == None: return None
+    if re.match("^[0-9]{8}-[0-9]{6}Z$", s):
+        return pytz.UTC.localize(datetime.strptime(s, '%Y%m%d-%H%M%SZ'))
+    dt = datetime.fromisoformat(s)
+    if dt.tzinfo == None:
+        dt = udatetime.eastern_tz.localize(dt)
+    return dt.astimezone(pytz.UTC)
+
+
+class SnapshotStore:
+
+    def __init__(self, snapshot_dir: str, keep: int = 0, max_age_days: float = 0):
+        self.snapshot_dir = snapshot_dir
+        self.keep = keep
+        self.max_age_days = max_age_days
+
+    def list(self, source: str) -> List[Tuple[str, str]]:
+        " list (stamp, path) of all snapshots for a source, oldest first "
+        if not os.path.isdir(self.snapshot_dir): return []
+
+        result = []
+        for fn in os.listdir(self.snapshot_dir):
+            m = SNAPSHOT_PATTERN.match(fn)
+            if m == None or m.group("source") != source: continue
+            result.append((m.group("stamp"), os.path.join(self.snapshot_dir, fn)))
+        result.sort()
+        return result
+
+    def save(self, source: str, df: pd.DataFrame, fetched_at: datetime = None, attrs: Dict = None) -> str:
+        " write a snapshot of a frame, returns the path (or None if it could not be written) "
+
+        if df is None: return None
+        if fetched_at is None: fetched_at = udatetime.now_as_utc()
+
+        if not os.path.isdir(self.snapshot_dir): os.makedirs(self.snapshot_dir)
+
+        stamp = udatetime.to_filenameformat(fetched_at)
+        out_path = os.path.join(self.snapshot_dir, f"{source}_{stamp}.feather")
+        tmp_path = out_path + ".tmp"
+        try:
+            df.reset_index(drop=True).to_feather(tmp_path)
+            if attrs != None:
+                with open(out_path[:-len(".feather")] + ".json", "w") as f:
+                    json.dump(attrs, f)
+            os.replace(tmp_path, out_path)
+        except Exception as ex:
+            logger.warning(f"  [snapshot] could not save {source}: {ex}")
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            return None
+
+        logger.debug(f"  [snapshot] saved {source} to {out_path}")
+        self.prune(source, fetched_at)
+        return out_path
+
+    def prune(self, source: str, now: datetime = None):
+        " remove the snapshots of a source that are past the retention limits "
+
+        if self.keep <= 0 and self.max_age_days <= 0: return
+        if now is None: now = udatetime.now_as_utc()
+
+        items = self.list(source)
+        expired = []
+        if self.keep > 0 and len(items) > self.keep:
+            expired, items = items[:-self.keep], items[-self.keep:]
+        if self.max_age_days > 0:
+            limit = udatetime.to_filenameformat(now.astimezone(pytz.UTC) - timedelta(days=self.max_age_days))
+            # never remove the newest one
+            expired += [x for x in items[:-1] if x[0] < limit]
+
+        for _, path in expired:
+            attrs_path = path[:-len(".feather")] + ".json"
+            for p in [path, attrs_path]:
+                try:
+                    if os.path.exists(p): os.remove(p)
+                except OSError as ex:
+                    logger.warning(f"  [snapshot] could not remove {p}: {ex}")
+        if len(expired) > 0:
+            logger.debug(f"  [snapshot] pruned {len(expired)} old snapshots of {source}")
+
+    def load(self, source: str, as_of: datetime = None) -> Tuple[pd.DataFrame, Dict]:
+        " load the newest snapshot of a source fetched at or before as_of "
+
+        items = self.list(source)
+        if as_of != None:
+            as_of = as_of.astimezone(pytz.UTC)
+            limit = udatetime.to_filenameformat(as_of)
+            items = [x for x in items if x[0] <= limit]
+        if len(items) == 0:
+            raise Exception(f"No snapshot of {source} in {self.snapshot_dir} as-of {udatetime.to_logformat(as_of)}")
+
+        stamp, path = items[-1]
+        logger.info(f"  [snapshot] load {source} from {path}")
+        df = pd.read_feather(path)
+
+        attrs = {}
+        attrs_path = path[:-len(".feather")] + ".json"
+        if os.path.exists(attrs_path):
+            with open(attrs_path, "r") as f:
+                attrs = json.load(f)
+        return df, attrs
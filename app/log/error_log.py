@@ -1,7 +1,9 @@
 # General Error Log
 #    To handle if external sources fail
 from loguru import logger
+from typing import List
 import html
+import json
 
 class ErrorLog:
 
@@ -17,6 +19,13 @@ class ErrorLog:
         logger.error(msg)
         self.messages.append(("ERROR", msg, exception))
 
+    def errors(self, msgs: List[str]):
+        " record several errors at once (a single log entry) "
+        if len(msgs) == 0: return
+        self.has_error = True
+        logger.error("\n".join(msgs))
+        self.messages.extend([("ERROR", msg, None) for msg in msgs])
+
     def warning(self, msg: str, exception: Exception = None):
         logger.warning(msg)
         if exception != None:
@@ -53,10 +62,10 @@ class ErrorLog:
         return "\n".join(lines)
 
     def to_json(self) -> str:
-        return {
+        return json.dumps({
             "error": self.has_error,
             "message": [{ "level": lev, "message": self.format_message(msg, ex) } for lev, msg, ex in self.messages]
-        }
+        }, indent=2)
 
 
     def to_html(self, as_fragment=False) -> str:
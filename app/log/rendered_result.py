@@ -0,0 +1,113 @@
+#
+# RenderedResult -- the json/csv/html output for a finished run, rendered once
+#
+#   Each format is kept as immutable bytes along with gzip (and brotli, when
+#   the brotli package is installed) variants and an ETag (hash of the
+#   uncompressed bytes), so serving a request is a lookup instead of
+#   re-serializing the log.
+#
+import gzip
+import hashlib
+from typing import Dict, Tuple
+from datetime import datetime
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIMETYPES = {
+    "json": "text/json",
+    "csv": "text/csv",
+    "html": "text/html",
+}
+
+# smaller bodies aren't worth compressing
+MIN_COMPRESS_BYTES = 512
+
+
+def parse_accept_encoding(accept_encoding: str) -> Dict[str, float]:
+    " encoding -> q value from an Accept-Encoding header "
+
+    result = {}
+    for part in (accept_encoding or "").split(","):
+        items = part.strip().split(";")
+        name = items[0].strip().lower()
+        if name == "": continue
+        q = 1.0
+        for x in items[1:]:
+            x = x.strip()
+            if x.startswith("q="):
+                try:
+                    q = float(x[2:])
+                except ValueError:
+                    q = 0.0
+        result[name] = q
+    return result
+
+
+class RenderedOutput:
+    " one format of a result "
+
+    __slots__ = ("body", "etag", "mimetype", "_encoded")
+
+    def __init__(self, text: str, mimetype: str):
+        self.body = text.encode("utf-8")
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+        self.mimetype = mimetype
+
+        # content-encoding -> bytes
+        self._encoded: Dict[str, bytes] = {}
+        if len(self.body) >= MIN_COMPRESS_BYTES:
+            self._encoded["gzip"] = gzip.compress(self.body, compresslevel=6, mtime=0)
+            if brotli != None:
+                self._encoded["br"] = brotli.compress(self.body, quality=9)
+
+    @property
+    def text(self) -> str:
+        return self.body.decode("utf-8")
+
+    def encoded(self, accept_encoding: str = "") -> Tuple[bytes, str]:
+        " the smallest variant the client accepts, returns (bytes, content-encoding or '') "
+
+        accepted = parse_accept_encoding(accept_encoding)
+        best, best_encoding = self.body, ""
+        for encoding, data in self._encoded.items():
+            q = accepted.get(encoding, accepted.get("*", 0.0))
+            if q > 0 and len(data) < len(best):
+                best, best_encoding = data, encoding
+        return best, best_encoding
+
+
+class RenderedResult:
+    """ the outputs of a log (a ResultLog or an ErrorLog) at the time it was rendered
+
+    html is the same as log.to_html()
+    """
+
+    def __init__(self, log):
+        self.loaded_at: datetime = getattr(log, "loaded_at", None)
+        self.outputs: Dict[str, RenderedOutput] = {
+            "json": RenderedOutput(log.to_json(), MIMETYPES["json"]),
+            "csv": RenderedOutput(log.to_csv(), MIMETYPES["csv"]),
+            "html": RenderedOutput(log.to_html(), MIMETYPES["html"]),
+        }
+
+    def get(self, fmt: str) -> RenderedOutput:
+        output = self.outputs.get(fmt)
+        if output is None: raise Exception(f"Unknown format {fmt}")
+        return output
+
+    def response(self, fmt: str, accept_encoding: str = "", if_none_match: str = "") -> Dict:
+        """ what a request handler needs to answer a request
+
+        body is None if if_none_match already has the current ETag
+        """
+
+        output = self.get(fmt)
+        result = { "etag": output.etag, "mimetype": output.mimetype, "encoding": "", "body": None }
+        if if_none_match != "" and output.etag in [x.strip() for x in if_none_match.split(",")]:
+            return result
+
+        result["body"], result["encoding"] = output.encoded(accept_encoding)
+        return result
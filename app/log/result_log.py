@@ -3,13 +3,15 @@
 # Each message is assigned a category
 #
 #   message_id is optional.  if set, the messages are consolidated into single line if than 10 of them.
+#   the limit can be changed per message_id or per category.  with incremental=True the messages are
+#   consolidated as they are added instead of by consolidate() at the end.
 #
 from enum import Enum
 import json
 import io
 import pandas as pd
 import numpy as np
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Union, Iterator
 import time
 import html
 
@@ -44,20 +46,130 @@ class ResultMessage:
             "message_id": self.message_id
         }
 
+# markup around the rows of a category table
+TABLE_HEAD = """<table border="0" class="dataframe">
+  <thead>
+    <tr style="text-align: left;">
+      <th>Location</th>
+      <th>Message</th>
+    </tr>
+  </thead>
+  <tbody>
+"""
+TABLE_TAIL = """  </tbody>
+</table>"""
+
+# collapse a message_id when there are more than this many
+CONSOLIDATE_THRESHOLD = 10
+
+# category <-> code
+_CATEGORIES = list(ResultCategory)
+_CATEGORY_CODES = { c: i for i, c in enumerate(_CATEGORIES) }
+_CATEGORY_LABELS = np.array([c.value.upper() for c in _CATEGORIES], dtype=object)
+
+def _check_threshold(n: int):
+    " a message_id needs at least 1 message before it can be collapsed "
+    if n < 1: raise Exception(f"Invalid consolidate threshold {n}, should be at least 1")
+
+
 class ResultLog():
+    """ the messages for a run, stored by column
+
+    categories and locations are interned as small integer codes and the rows
+    for each category are indexed as they are added, so the exports walk
+    each category once without rescanning the log.
+    """
 
-    def __init__(self):
+    def __init__(self, consolidate_threshold: int = CONSOLIDATE_THRESHOLD,
+                 thresholds: Dict[Union[str, ResultCategory], int] = None, incremental: bool = False):
         self.loaded_at = udatetime.now_as_eastern()
         self.start = time.process_time_ns()
 
-        self._messages: List[ResultLog] = []
+        # consolidate settings, thresholds is by message_id or category (message_id wins)
+        self.consolidate_threshold = consolidate_threshold
+        self.thresholds = thresholds if thresholds != None else {}
+        self.incremental = incremental
+        for n in [consolidate_threshold] + list(self.thresholds.values()):
+            _check_threshold(n)
+
+        # one entry per message
+        self._category_codes: List[int] = []
+        self._location_codes: List[int] = []
+        self._text: List[str] = []
+        self._ms: List[int] = []
+        self._message_ids: List[str] = []
+
+        # location <-> code
+        self._locations: List[str] = []
+        self._location_ids: Dict[str, int] = {}
+
+        # category code -> rows, in the order they were added
+        self._by_category: List[List[int]] = [[] for _ in _CATEGORIES]
+
+        # incremental consolidate:
+        #   message_id -> [first row, count, other rows (None once collapsed), first text]
+        self._groups: Dict[str, List] = {}
+        self._dead: List[int] = []
+
+    def __len__(self) -> int:
+        self._compact()
+        return len(self._text)
+
+    def threshold(self, message_id: str, category: ResultCategory) -> int:
+        " the most messages for a message_id before they are collapsed "
+        n = self.thresholds.get(message_id)
+        if n is None: n = self.thresholds.get(category)
+        if n is None: n = self.consolidate_threshold
+        _check_threshold(n)
+        return n
+
+    def _message(self, i: int) -> ResultMessage:
+        return ResultMessage(_CATEGORIES[self._category_codes[i]], self._locations[self._location_codes[i]],
+            self._text[i], self._ms[i], message_id=self._message_ids[i])
 
     @property
     def messages(self) -> List[ResultMessage]:
-        return self._messages
+        self._compact()
+        return [self._message(i) for i in range(len(self._text))]
 
     def by_category(self, category: ResultCategory) -> List[ResultMessage]:
-        return [x for x in self._messages if x.category == category]
+        self._compact()
+        return [self._message(i) for i in self._by_category[_CATEGORY_CODES[category]]]
+
+    def _append(self, category_code: int, location: str, message: str, ms: int, message_id: str):
+
+        group = None
+        if self.incremental and message_id != "":
+            group = self._groups.get(message_id)
+            if group != None:
+                group[1] += 1
+                if group[2] is None:
+                    # already collapsed, just count it
+                    self._text[group[0]] = f"{group[3]} and {group[1]-1} more"
+                    return
+
+        loc = self._location_ids.get(location)
+        if loc is None:
+            loc = self._location_ids[location] = len(self._locations)
+            self._locations.append(location)
+
+        self._by_category[category_code].append(len(self._text))
+        self._category_codes.append(category_code)
+        self._location_codes.append(loc)
+        self._text.append(message)
+        self._ms.append(ms)
+        self._message_ids.append(message_id)
+
+        if self.incremental and message_id != "":
+            row = len(self._text) - 1
+            if group is None:
+                self._groups[message_id] = [row, 1, [], message]
+            else:
+                group[2].append(row)
+                if group[1] > self.threshold(message_id, _CATEGORIES[self._category_codes[group[0]]]):
+                    self._dead.extend(group[2])
+                    group[2] = None
+                    self._text[group[0]] = f"{group[3]} and {group[1]-1} more"
 
     def add(self, category: ResultCategory, location: str, message: str,
             message_id: str = "") -> None:
@@ -67,8 +179,43 @@ class ResultLog():
         delta_ms = int((end - self.start) * 1e-6)
         self.start = end
 
-        msg = ResultMessage(category, location, message, delta_ms, message_id=message_id)
-        self._messages.append(msg)
+        self._append(_CATEGORY_CODES[category], location, message, delta_ms, message_id)
+
+    def merge(self, other: "ResultLog") -> None:
+        " append the messages from another log (e.g. one from a worker process) "
+        other._compact()
+        for i in range(len(other._text)):
+            self._append(other._category_codes[i], other._locations[other._location_codes[i]],
+                other._text[i], other._ms[i], other._message_ids[i])
+
+    def _keep(self, keep: List[bool]) -> None:
+        " drop the rows that are not kept, in one pass "
+
+        rows = [i for i, k in enumerate(keep) if k]
+        self._category_codes = [self._category_codes[i] for i in rows]
+        self._location_codes = [self._location_codes[i] for i in rows]
+        self._text = [self._text[i] for i in rows]
+        self._ms = [self._ms[i] for i in rows]
+        self._message_ids = [self._message_ids[i] for i in rows]
+
+        self._by_category = [[] for _ in _CATEGORIES]
+        for i, c in enumerate(self._category_codes):
+            self._by_category[c].append(i)
+
+        # renumber the rows of the incremental groups
+        if len(self._groups) > 0:
+            new_row = {old: new for new, old in enumerate(rows)}
+            for group in self._groups.values():
+                group[0] = new_row[group[0]]
+                if group[2] != None: group[2] = [new_row[i] for i in group[2]]
+
+    def _compact(self) -> None:
+        " drop the rows collapsed by an incremental consolidate "
+        if len(self._dead) == 0: return
+        keep = [True] * len(self._text)
+        for i in self._dead: keep[i] = False
+        self._dead = []
+        self._keep(keep)
 
     #def error(self, location: str, message: str) -> None:
     #    self.add(ResultCategory.ERROR, location, message)
@@ -89,72 +236,85 @@ class ResultLog():
     # -----
 
     def consolidate(self):
-
-        # build a list by ids
-        ids = {}
-        for i in range(len(self._messages)):
-            x = self._messages[i]
-            if x.message_id == "": continue
-            items = ids.get(x.message_id)
-            if items == None:
-                ids[x.message_id] = items = []
-            items.append(i)
-        
-        # delete anything with 10+ repeats
-        to_delete = []
-        for k in ids:
-            items = ids[k]
-            if len(items) > 10:
-                idx = items[0]
-                self._messages[idx].message += f" and {len(items)-1} more"
-                for i in items[1:]: to_delete.append(i)
-
-        to_delete.sort(reverse=True)
-        for i in to_delete:
-            del self._messages[i]
+        """ collapse the messages for a message_id into the first one if there are
+        more than threshold() of them
+
+        one pass to count, one to build the new sequence.  with incremental=True
+        this was already done as the messages were added.
+        """
+
+        if self.incremental:
+            self._compact()
+            return
+
+        # count by ids, remember the first row and its category
+        counts: Dict[str, List[int]] = {}
+        for i, message_id in enumerate(self._message_ids):
+            if message_id == "": continue
+            item = counts.get(message_id)
+            if item is None:
+                counts[message_id] = [i, 1]
+            else:
+                item[1] += 1
+
+        collapse = set()
+        for message_id, (first, n) in counts.items():
+            if n > self.threshold(message_id, _CATEGORIES[self._category_codes[first]]):
+                collapse.add(message_id)
+                self._text[first] += f" and {n-1} more"
+        if len(collapse) == 0: return
+
+        # keep the first message for each collapsed id
+        keep = [True] * len(self._text)
+        for i, message_id in enumerate(self._message_ids):
+            if message_id in collapse and counts[message_id][0] != i: keep[i] = False
+        self._keep(keep)
 
     def print(self):
 
+        self._compact()
         print("")
 
-        if len(self._messages) == 0:
+        if len(self._text) == 0:
             print("[No Messages]")
 
         for cat in ResultCategory:
-            messages = self.by_category(cat)
-            if len(messages) == 0: continue
+            rows = self._by_category[_CATEGORY_CODES[cat]]
+            if len(rows) == 0: continue
 
             print(f"=====| {cat.value.upper()} |===========")
-            for x in messages:
-                print(f"{x.location}: {x.message}")
+            for i in rows:
+                print(f"{self._locations[self._location_codes[i]]}: {self._text[i]}")
 
         print("")
 
 
     def to_json(self) -> str:
+        self._compact()
         result = {}
         for cat in ResultCategory:
-            result[cat.name] = [ x.to_dict() for x in self._messages if x.category == cat ]
+            result[cat.name] = [
+                { "category": cat.value, "location": self._locations[self._location_codes[i]],
+                  "message": self._text[i], "ms": self._ms[i], "message_id": self._message_ids[i] }
+                for i in self._by_category[_CATEGORY_CODES[cat]] ]
         return json.dumps(result, indent=2)
 
+    def _rows_by_category(self) -> np.ndarray:
+        " every row, grouped by category (in ResultCategory order) "
+        return np.fromiter((i for rows in self._by_category for i in rows), dtype=np.int64, count=len(self._text))
 
     def to_frame(self) -> pd.DataFrame:
 
-        n_total = len(self._messages)
-        category = np.zeros(n_total, dtype=object)
-        location = np.zeros(n_total, dtype=object)
-        message = np.zeros(n_total, dtype=object)
-        time_ms = np.zeros(n_total, dtype=np.int)
-
-        idx = 0
-        for cat in ResultCategory:
-            messages = self.by_category(cat)
-            for x in messages:
-                category[idx], location[idx], message[idx], time_ms[idx] = cat.value.upper(), x.location, x.message, x.ms
-                idx += 1
+        self._compact()
+        order = self._rows_by_category()
+        category_codes = np.asarray(self._category_codes, dtype=np.int64)
+        location_codes = np.asarray(self._location_codes, dtype=np.int64)
 
         df = pd.DataFrame({
-            "category": category, "location": location, "message": message, "ms": time_ms
+            "category": _CATEGORY_LABELS[category_codes[order]],
+            "location": np.asarray(self._locations, dtype=object)[location_codes[order]],
+            "message": np.asarray(self._text, dtype=object)[order],
+            "ms": np.asarray(self._ms, dtype=np.int64)[order],
         })
         return df
 
@@ -165,39 +325,60 @@ class ResultLog():
         return dest.getvalue()
 
     def format_table(self, cat: ResultCategory) -> List[str]:
-        
+
+        self._compact()
+        rows = self._by_category[_CATEGORY_CODES[cat]]
+        if len(rows) == 0: return []
+
         caption = f"  <h5>{cat.value.upper()}</h5>"
-        df = pd.DataFrame(columns=["Location", "Message"])
+        return [caption, "".join(self._iter_table(rows, len(rows)))]
 
-        cnt = 0
-        for x in self.by_category(cat):
-            df.loc[df.shape[0]] = [x.location, x.message]
-            cnt = cnt + 1
+    def _iter_table(self, rows: List[int], rows_per_chunk: int) -> Iterator[str]:
+        " a category's messages as an html table (same markup as DataFrame.to_html) "
 
-        if cnt == 0: return []
-        
-        return  [caption, df.to_html(justify='left', index=False, border=0)]
+        yield TABLE_HEAD
+        buf = []
+        for i in rows:
+            location = html.escape(str(self._locations[self._location_codes[i]]), quote=False)
+            message = html.escape(str(self._text[i]), quote=False)
+            buf.append(f"    <tr>\n      <td>{location}</td>\n      <td>{message}</td>\n    </tr>\n")
+            if len(buf) >= rows_per_chunk:
+                yield "".join(buf)
+                buf = []
+        buf.append(TABLE_TAIL)
+        yield "".join(buf)
 
-    def to_html(self, as_fragment=False) -> str:
-        lines = []
+    def iter_html(self, as_fragment=False, rows_per_chunk: int = 500) -> Iterator[str]:
+        """ to_html() as a series of chunks (about rows_per_chunk messages each)
+
+        written directly instead of through pandas, so memory doesn't grow
+        with the size of the log
+        """
+
+        self._compact()
 
         if not as_fragment:
-            lines.append('  <body>')
+            yield '  <body>\n'
 
-        lines.append('    <div class="container working-results">')
+        yield '    <div class="container working-results">\n'
         for cat in ResultCategory:
-            lines.append('    <div class="row">')
-            lines.extend(self.format_table(cat))
-            lines.append('    </div>')
-        lines.append('    </div>')
+            yield '    <div class="row">\n'
+            rows = self._by_category[_CATEGORY_CODES[cat]]
+            if len(rows) > 0:
+                yield f"  <h5>{cat.value.upper()}</h5>\n"
+                yield from self._iter_table(rows, rows_per_chunk)
+                yield "\n"
+            yield '    </div>\n'
+        yield '    </div>\n'
 
         sdate = udatetime.to_displayformat(self.loaded_at)
-        lines.append(f'    <div class="timestamp">run against source at {sdate}</div>')
+        yield f'    <div class="timestamp">run against source at {sdate}</div>'
 
         if not as_fragment:
-            lines.append('  </body>')
+            yield '\n  </body>'
 
-        return '\n'.join(lines)
+    def to_html(self, as_fragment=False) -> str:
+        return "".join(self.iter_html(as_fragment))
 
 
 # -----------------------------
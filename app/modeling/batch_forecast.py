@@ -0,0 +1,226 @@
+#
+# BatchForecast -- fit the Forecast models for all states at once
+#
+#   Same models as Forecast (linear over the last 4 days, exponential over the
+#   whole history) but every state is fit together on a padded (states x days)
+#   array:
+#
+#      linear -- closed-form least squares
+#      exp    -- log-linear least squares for a starting point, then damped
+#                Gauss-Newton (Levenberg-Marquardt) steps on the original
+#                scale, which is the sum of squares curve_fit minimizes
+#
+#   window limits the fit to the newest days of each state.  With a
+#   ForecastParamStore the previous day's parameters are also tried as the
+#   starting point for the exponential.  With a ForecastCache, states whose
+#   history was fit before reuse those parameters and only the rest are fit.
+#
+#   Days with a blank positive are skipped, as in Forecast.  States that can't
+#   be fit this way (fewer than 2 days) are left out so the caller can fall
+#   back to Forecast.
+#
+from datetime import datetime
+from typing import Dict, List
+import numpy as np
+
+from app.data.schema import BLANK_COUNT
+from app.data.history_index import HistoryIndex
+from .forecast import Forecast
+from .forecast_params import ForecastParamStore
+from .forecast_cache import ForecastCache, forecast_key
+
+LINEAR_DAYS = 4
+
+# LM settings
+MAX_ITERATIONS = 100
+TOLERANCE = 1e-10
+
+
+def _linear_lsq(x: np.ndarray, y: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    " y = m*x + b for each row of x/y (masked), returns (states x 2) of [m, b] "
+
+    n = mask.sum(axis=1)
+    n_safe = np.maximum(n, 1)
+    mx = np.where(mask, x, 0.0).sum(axis=1) / n_safe
+    my = np.where(mask, y, 0.0).sum(axis=1) / n_safe
+    dx = np.where(mask, x - mx[:, None], 0.0)
+    dy = np.where(mask, y - my[:, None], 0.0)
+    sxx = (dx * dx).sum(axis=1)
+    sxy = (dx * dy).sum(axis=1)
+
+    m = np.divide(sxy, sxx, out=np.zeros_like(sxy), where=sxx > 0)
+    return np.stack([m, my - m * mx], axis=1)
+
+
+def _exp_lsq(x: np.ndarray, y: np.ndarray, mask: np.ndarray, start: np.ndarray = None) -> np.ndarray:
+    """ y = a*exp(b*x) for each row of x/y (masked), returns (states x 2) of [a, b]
+
+    start is an optional (states x 2) starting point (nan for none), it is
+    used where it fits better than the log-linear starting point.
+    """
+
+    # starting point from a log-linear fit of the positive values
+    positive = mask & (y > 0)
+    log_fit = _linear_lsq(x, np.log(np.where(positive, y, 1.0)), positive)
+    a = np.exp(log_fit[:, 1])
+    b = log_fit[:, 0]
+
+    # rows without any positive values start where curve_fit starts
+    no_start = positive.sum(axis=1) < 2
+    a[no_start], b[no_start] = 4.0, 0.1
+
+    def sse(a, b):
+        with np.errstate(over="ignore", invalid="ignore"):
+            r = np.where(mask, y - a[:, None] * np.exp(b[:, None] * x), 0.0)
+            return (r * r).sum(axis=1)
+
+    err = sse(a, b)
+
+    if start is not None:
+        has_start = np.isfinite(start).all(axis=1)
+        start_err = sse(np.where(has_start, start[:, 0], a), np.where(has_start, start[:, 1], b))
+        use_start = has_start & np.isfinite(start_err) & (start_err < err)
+        a = np.where(use_start, start[:, 0], a)
+        b = np.where(use_start, start[:, 1], b)
+        err = np.where(use_start, start_err, err)
+
+    lam = np.full(len(a), 1e-3)
+    active = np.ones(len(a), dtype=bool)
+
+    with np.errstate(over="ignore", invalid="ignore"):
+        for _ in range(MAX_ITERATIONS):
+            if not active.any(): break
+
+            e = np.exp(b[:, None] * x)
+            r = np.where(mask, y - a[:, None] * e, 0.0)
+            ja = np.where(mask, e, 0.0)
+            jb = np.where(mask, a[:, None] * x * e, 0.0)
+
+            # 2x2 normal equations, damped on the diagonal
+            saa, sab, sbb = (ja * ja).sum(axis=1), (ja * jb).sum(axis=1), (jb * jb).sum(axis=1)
+            ga, gb = (ja * r).sum(axis=1), (jb * r).sum(axis=1)
+            daa, dbb = saa * (1 + lam), sbb * (1 + lam)
+            det = daa * dbb - sab * sab
+            ok = active & np.isfinite(det) & (det != 0)
+            det = np.where(ok, det, 1.0)
+            step_a = np.where(ok, (dbb * ga - sab * gb) / det, 0.0)
+            step_b = np.where(ok, (daa * gb - sab * ga) / det, 0.0)
+
+            new_a, new_b = a + step_a, b + step_b
+            new_err = sse(new_a, new_b)
+            better = ok & np.isfinite(new_err) & (new_err <= err)
+
+            converged = better & (np.abs(err - new_err) <= TOLERANCE * np.maximum(err, 1.0))
+            a = np.where(better, new_a, a)
+            b = np.where(better, new_b, b)
+            err = np.where(better, new_err, err)
+            lam = np.where(better, lam / 10, lam * 10)
+            active &= ~converged & ~(lam > 1e12) & ok
+
+    return np.stack([a, b], axis=1)
+
+
+class BatchForecast:
+    " Forecast models for every state in a history for one target date "
+
+    def __init__(self, index: HistoryIndex, target_date: int, window: int = 0,
+                 params: ForecastParamStore = None, cache: ForecastCache = None):
+
+        self.date = target_date
+
+        # the history for each state without the target date, oldest first
+        states, series, fit_dates, first_dates, last_dates = [], [], [], [], []
+        for state in index.states:
+            h = index.get(state)
+            dates, values = h.ascending("date"), h.ascending("positive")
+            keep = (dates != target_date) & (values != BLANK_COUNT)
+            if keep.sum() < 2: continue
+            values, dates = values[keep], dates[keep]
+            if window > 0:
+                values, dates = values[-window:], dates[-window:]
+            states.append(state)
+            series.append(values.astype(float))
+            fit_dates.append(dates)
+            first_dates.append(int(dates[0]))
+            last_dates.append(int(dates[-1]))
+
+        self.states = states
+        self._rows: Dict[str, int] = { s: i for i, s in enumerate(states) }
+        self._n = np.array([len(s) for s in series], dtype=int)
+        self._first_dates = first_dates
+        self._last_dates = last_dates
+
+        start = np.full((len(states), 2), np.nan)
+        if params != None:
+            for i, state in enumerate(states):
+                p = params.warm_start(state, target_date, first_dates[i])
+                if p != None: start[i] = p
+
+        self.linear_params = np.full((len(states), 2), np.nan)
+        self.exp_params = np.full((len(states), 2), np.nan)
+
+        # reuse the fits for histories that haven't changed
+        to_fit = list(range(len(states)))
+        keys = []
+        if cache != None:
+            for i in range(len(states)):
+                keys.append(forecast_key("batch", fit_dates[i], series[i],
+                    start[i] if np.isfinite(start[i]).all() else None))
+                item = cache.get(keys[i])
+                if item != None:
+                    self.linear_params[i], self.exp_params[i] = item
+            to_fit = [i for i in to_fit if not np.isfinite(self.exp_params[i]).all()]
+        self.n_fit = len(to_fit)
+        if len(to_fit) == 0: return
+
+        # padded (states x days), left-aligned so column i is curve_fit's index i
+        n = self._n[to_fit]
+        width = n.max()
+        y = np.zeros((len(to_fit), width))
+        mask = np.zeros((len(to_fit), width), dtype=bool)
+        for j, i in enumerate(to_fit):
+            y[j, :n[j]] = series[i]
+            mask[j, :n[j]] = True
+        x = np.broadcast_to(np.arange(width, dtype=float), y.shape)
+
+        # linear only uses the last LINEAR_DAYS days of each state
+        linear_mask = mask & (x >= (n - LINEAR_DAYS)[:, None])
+
+        self.linear_params[to_fit] = _linear_lsq(x, y, linear_mask)
+        self.exp_params[to_fit] = _exp_lsq(x, y, mask, start[to_fit] if params != None else None)
+
+        if cache != None:
+            for i in to_fit:
+                if np.isfinite(self.exp_params[i]).all():
+                    cache.put(keys[i], self.linear_params[i], self.exp_params[i])
+
+    def save_params(self, params: ForecastParamStore):
+        " record the fitted parameters for warm-starting later runs "
+        for i, state in enumerate(self.states):
+            if not np.isfinite(self.exp_params[i]).all(): continue
+            params.update(state, self.date, self._first_dates[i], self.linear_params[i], self.exp_params[i])
+
+    def forecast(self, state: str, actual_value: int) -> Forecast:
+        " the projection for a state (None if the state could not be fit) "
+
+        i = self._rows.get(state)
+        if i is None: return None
+
+        m, b = self.linear_params[i]
+        ea, eb = self.exp_params[i]
+        if not np.isfinite([m, b, ea, eb]).all(): return None
+
+        prev_datetime = datetime.strptime(str(self._last_dates[i]), '%Y%m%d')
+        projection_datetime = datetime.strptime(str(self.date), '%Y%m%d')
+        days_forward = (projection_datetime - prev_datetime).days
+
+        forecast = Forecast()
+        forecast.state = state
+        forecast.date = self.date
+        forecast.actual_value = actual_value
+        forecast.fitted_linear_params = self.linear_params[i].copy()
+        forecast.fitted_exp_params = self.exp_params[i].copy()
+        forecast.projection_index = self._n[i] - 1 + days_forward
+        forecast.expected_exp = np.round(ea * np.exp(eb * forecast.projection_index)).astype(int)
+        forecast.expected_linear = np.round(m * forecast.projection_index + b).astype(int)
+        return forecast
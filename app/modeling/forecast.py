@@ -8,6 +8,9 @@ import numpy as np
 from scipy.optimize import curve_fit
 from typing import Tuple
 
+from app.data.schema import BLANK_COUNT
+from .forecast_cache import ForecastCache, forecast_key
+
 
 def _exp_fit(x: float, a: float, b: float) -> float:
     return a * np.exp(b * x)
@@ -15,14 +18,16 @@ def _exp_fit(x: float, a: float, b: float) -> float:
 def _linear_fit(x: float, m: float, b: float) -> float:
     return m*x + b
 
-def _get_distribution_fit(x: pd.Series, y: pd.Series, dist_func) -> np.array:
+DEFAULT_P0 = (4, 0.1)
+
+def _get_distribution_fit(x: pd.Series, y: pd.Series, dist_func, p0: Tuple[float, float] = DEFAULT_P0) -> np.array:
 
     np.random.seed(1729)
 
     x = np.array(x.values, dtype=float)
     y = np.array(y.values, dtype=float)
 
-    popt, pcov = curve_fit(dist_func, x, y, p0=(4, 0.1))
+    popt, pcov = curve_fit(dist_func, x, y, p0=p0)
     return popt
 
 
@@ -52,23 +57,55 @@ class Forecast():
         return self.actual_value, self.expected_linear, self.expected_exp
 
 
-    def fit(self, df: pd.DataFrame):
-        "Fit an exponential and linear model to the history"
+    def set_history(self, df: pd.DataFrame, window: int = 0):
+        "Keep the history the model is fit to (the newest window days, 0 for all, blank days are skipped)"
 
         self.df = df
         self.state = df["state"].values[0]
 
-        self.cases_df = self.df \
-            .sort_values("date", ascending=True) \
+        cases_df = self.df.loc[self.df["positive"] != BLANK_COUNT].sort_values("date", ascending=True)
+        if window > 0: cases_df = cases_df[-window:]
+
+        self.cases_df = cases_df \
             .reset_index(drop=True) \
             .rename_axis('index') \
             .reset_index()
 
+    def fit(self, df: pd.DataFrame = None, window: int = 0, p0: Tuple[float, float] = None,
+            cache: ForecastCache = None):
+        """Fit an exponential and linear model to the history
+
+        window limits the fit to the newest days, p0 is the starting point
+        for the exponential (e.g. the previous day's parameters).  with a cache,
+        a history that was fit before reuses the earlier parameters.
+        df None fits the history from an earlier set_history.
+        """
+
+        if df is not None: self.set_history(df, window)
+
+        key = None
+        if cache != None:
+            key = forecast_key("curve_fit", self.cases_df["date"].values,
+                self.cases_df["positive"].values, p0)
+            item = cache.get(key)
+            if item != None:
+                self.fitted_linear_params, self.fitted_exp_params = item
+                return
+
         to_fit_exp = self.cases_df
         to_fit_linear = self.cases_df[-4:]
 
         self.fitted_linear_params = _get_distribution_fit(to_fit_linear["index"], to_fit_linear["positive"], _linear_fit)
-        self.fitted_exp_params = _get_distribution_fit(to_fit_exp["index"], to_fit_exp["positive"], _exp_fit)
+        self.fitted_exp_params = _get_distribution_fit(to_fit_exp["index"], to_fit_exp["positive"], _exp_fit,
+            p0=p0 if p0 != None else DEFAULT_P0)
+
+        if cache != None:
+            cache.put(key, self.fitted_linear_params, self.fitted_exp_params)
+
+    @property
+    def origin_date(self) -> int:
+        "date at index 0 of the fit"
+        return int(self.cases_df["date"].iloc[0])
 
     def project(self, row: tuple) -> None:
         "Get forecasted positives value for current day"
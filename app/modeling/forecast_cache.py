@@ -0,0 +1,177 @@
+#
+# ForecastCache -- reuse fitted forecast parameters when the history hasn't changed
+#
+#   Entries are keyed by a hash of what the fit depends on:
+#
+#      method  -- "batch" or "curve_fit" (they can differ in the last digit)
+#      dates/values of the slice that is fit, oldest first
+#      start   -- the starting point for the exponential (warm start or none)
+#
+#   so a hit can skip the fit and only the projection for the new value is
+#   redone.  The most recently used max_entries are kept in memory.  With a
+#   cache_dir the entries are also written there as small json files, so a
+#   restarted service (or the next CLI run) starts warm; the directory is
+#   bounded by max_disk_entries, least recently used first.
+#
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple
+from loguru import logger
+import numpy as np
+
+# bump when the models change so old entries are not reused
+MODEL_VERSION = 1
+
+Params = Tuple[np.ndarray, np.ndarray]
+
+
+def forecast_key(method: str, dates: np.ndarray, values: np.ndarray, start=None) -> str:
+    " hash of a fit's inputs "
+
+    h = hashlib.sha1()
+    h.update(f"{MODEL_VERSION}|{method}|".encode("utf-8"))
+    h.update(np.ascontiguousarray(dates, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    if start is not None:
+        h.update(np.ascontiguousarray(start, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+class ForecastCache:
+
+    def __init__(self, max_entries: int = 1000, cache_dir: str = None,
+                 max_disk_entries: int = 10000):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir if cache_dir != "" else None
+        self.max_disk_entries = max_disk_entries
+
+        # statistics
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        # key -> (linear, exp), oldest first
+        self._entries: "OrderedDict[str, Params]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.cache_dir != None and not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def get(self, key: str) -> Params:
+        " the (linear, exp) parameters for a key or None "
+
+        with self._lock:
+            item = self._entries.get(key)
+            if item != None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return item[0].copy(), item[1].copy()
+
+        item = self._read(key)
+        with self._lock:
+            if item is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, item)
+        return item[0].copy(), item[1].copy()
+
+    def put(self, key: str, linear: np.ndarray, exp: np.ndarray):
+        item = (np.array(linear, dtype=float), np.array(exp, dtype=float))
+        with self._lock:
+            self._remember(key, item)
+        if self.cache_dir != None:
+            self._write(key, item)
+
+    def _remember(self, key: str, item: Params):
+        " add to the memory tier (caller holds the lock) "
+        self._entries[key] = item
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _read(self, key: str) -> Params:
+        if self.cache_dir is None: return None
+        p = self._path(key)
+        if not os.path.exists(p): return None
+        try:
+            with open(p, "r") as f:
+                x = json.load(f)
+            os.utime(p)
+            return np.array(x["linear"], dtype=float), np.array(x["exp"], dtype=float)
+        except Exception as ex:
+            logger.warning(f"  [forecast cache] ignore unreadable entry {p}: {ex}")
+            return None
+
+    def _write(self, key: str, item: Params):
+        p = self._path(key)
+        tmp_path = f"{p}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({ "linear": item[0].tolist(), "exp": item[1].tolist() }, f)
+            os.replace(tmp_path, p)
+        except Exception as ex:
+            logger.warning(f"  [forecast cache] could not write {p}: {ex}")
+
+    def evict(self):
+        " remove least recently used files until the directory fits in max_disk_entries "
+
+        if self.cache_dir is None: return
+        entries = []
+        for fn in os.listdir(self.cache_dir):
+            if not fn.endswith(".json"): continue
+            p = os.path.join(self.cache_dir, fn)
+            try:
+                entries.append((os.path.getmtime(p), p))
+            except OSError:
+                continue
+        if len(entries) <= self.max_disk_entries: return
+
+        entries.sort()
+        for _, p in entries[:len(entries) - self.max_disk_entries]:
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict:
+        " hit/miss statistics and current size of the cache "
+
+        n_requests = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / n_requests if n_requests > 0 else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+        }
+
+
+# optional cache shared by every fit in the process, see enable_forecast_cache
+g_forecast_cache: ForecastCache = None
+
+def enable_forecast_cache(max_entries: int = 1000, cache_dir: str = None) -> ForecastCache:
+    " reuse forecast fits for unchanged histories (cache_dir adds an on-disk tier) "
+    global g_forecast_cache
+    if cache_dir == "": cache_dir = None
+    if g_forecast_cache is None or g_forecast_cache.cache_dir != cache_dir:
+        g_forecast_cache = ForecastCache(max_entries, cache_dir)
+    else:
+        g_forecast_cache.max_entries = max_entries
+    return g_forecast_cache
+
+def get_forecast_cache() -> ForecastCache:
+    " the shared cache (None if not enabled) "
+    return g_forecast_cache
+
+def forecast_cache_stats() -> Dict:
+    " hit/miss statistics for the forecast cache (empty if not enabled) "
+    if g_forecast_cache is None: return {}
+    return g_forecast_cache.stats()
@@ -6,6 +6,12 @@ from loguru import logger
 
 from .forecast_plot import Forecast
 
+def _without_categories(df: pd.DataFrame) -> pd.DataFrame:
+    " hdf5 (fixed format) can't store categoricals so save them as strings "
+    cols = df.select_dtypes("category").columns
+    if len(cols) == 0: return df
+    return df.astype({c: str for c in cols})
+
 def save_forecast_hd5(forecast: Forecast, data_dir: str):
 
     fn = f"predicted_positives_{forecast.state}_{forecast.date}.hd5"
@@ -24,8 +30,8 @@ def save_forecast_hd5(forecast: Forecast, data_dir: str):
     hf.attrs["projection_index"] = forecast.projection_index
     hf.close()
 
-    forecast.df.to_hdf(tmp_path, "df")
-    forecast.cases_df.to_hdf(tmp_path, "cases_df")
+    _without_categories(forecast.df).to_hdf(tmp_path, "df")
+    _without_categories(forecast.cases_df).to_hdf(tmp_path, "cases_df")
 
     df_pars = pd.DataFrame({
         "linear": forecast.fitted_linear_params,
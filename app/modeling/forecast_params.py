@@ -0,0 +1,117 @@
+#
+# ForecastParamStore -- fitted forecast parameters from earlier runs
+#
+#   Used to warm-start the exponential fit with the previous day's parameters
+#   for the same state.  Stored as json (config.forecast_params_path):
+#
+#      { state: [ { "date": yyyymmdd, "origin": yyyymmdd, "linear": [m, b], "exp": [a, b] }, ... ] }
+#
+#   date is the target date of the run, origin is the date at x=0 for the fit.
+#   Only the newest KEEP_ENTRIES entries per state are kept.
+#
+#   A store can't be sent to worker processes (it holds a lock), so workers get
+#   snapshot() and build their own store from it; the parent merges the
+#   entries each worker added (updates()) back into its store.
+#
+import os
+import json
+import threading
+from datetime import datetime
+from typing import Dict, List, Tuple
+from loguru import logger
+import numpy as np
+
+KEEP_ENTRIES = 7
+
+def _days_between(d1: int, d2: int) -> int:
+    " d2 - d1 in days, both yyyymmdd "
+    return (datetime.strptime(str(d2), "%Y%m%d") - datetime.strptime(str(d1), "%Y%m%d")).days
+
+
+class ForecastParamStore:
+
+    def __init__(self, path: str = None, entries: Dict[str, List[Dict]] = None):
+        """
+        path: json file to load from and save to (None for a store that is only in memory)
+        entries: start from a snapshot() of another store instead of loading path
+        """
+        self.path = path
+        self._entries: Dict[str, List[Dict]] = {}
+        self._updates: List[Tuple[str, Dict]] = []
+        self._lock = threading.Lock()
+        if entries != None:
+            self._entries = { state: [dict(x) for x in items] for state, items in entries.items() }
+        else:
+            self.load()
+
+    def load(self):
+        " read the file, a missing or unreadable file starts empty "
+        if self.path is None or not os.path.exists(self.path): return
+        try:
+            with open(self.path, "r") as f:
+                self._entries = json.load(f)
+        except Exception as ex:
+            logger.warning(f"  [forecast params] ignore unreadable {self.path}: {ex}")
+            self._entries = {}
+
+    def save(self):
+        if self.path is None: return
+        dir_name = os.path.dirname(self.path)
+        if dir_name != "" and not os.path.isdir(dir_name): os.makedirs(dir_name)
+
+        tmp_path = self.path + ".tmp"
+        with self._lock:
+            with open(tmp_path, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+
+    def update(self, state: str, date: int, origin: int, linear: np.ndarray, exp: np.ndarray):
+        " record the parameters fit for a target date (replaces an earlier fit for the same date) "
+
+        entry = { "date": int(date), "origin": int(origin),
+                  "linear": [float(x) for x in linear], "exp": [float(x) for x in exp] }
+        with self._lock:
+            self._add(state, entry)
+            self._updates.append((state, entry))
+
+    def _add(self, state: str, entry: Dict):
+        " (caller holds the lock) "
+        items = [x for x in self._entries.get(state, []) if x["date"] != entry["date"]]
+        items.append(entry)
+        items.sort(key=lambda x: x["date"])
+        self._entries[state] = items[-KEEP_ENTRIES:]
+
+    def snapshot(self) -> Dict[str, List[Dict]]:
+        " a plain copy of the entries (can be pickled) "
+        with self._lock:
+            return { state: [dict(x) for x in items] for state, items in self._entries.items() }
+
+    def updates(self) -> List[Tuple[str, Dict]]:
+        " the (state, entry) pairs added with update(), oldest first "
+        with self._lock:
+            return list(self._updates)
+
+    def merge(self, updates: List[Tuple[str, Dict]]):
+        " add the updates() of another store "
+        with self._lock:
+            for state, entry in updates:
+                self._add(state, entry)
+                self._updates.append((state, entry))
+
+    def warm_start(self, state: str, date: int, origin: int) -> Tuple[float, float]:
+        """ exp parameters from the newest fit before date, shifted to origin
+
+        a*exp(b*x) is the same curve as a*exp(b*shift)*exp(b*(x-shift)), so
+        moving the origin only changes a.  returns None if there is no earlier fit.
+        """
+
+        with self._lock:
+            items = [x for x in self._entries.get(state, []) if x["date"] < date]
+        if len(items) == 0: return None
+
+        prev = items[-1]
+        a, b = prev["exp"]
+        shift = _days_between(prev["origin"], origin)
+        a = a * np.exp(b * shift)
+        if not np.isfinite(a): return None
+        return a, b
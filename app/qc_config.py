@@ -13,6 +13,13 @@ class QCConfig():
         images_dir = "images", 
         save_results = False,
         plot_models = False,
+        batch_forecast = True,
+        fit_window_days = 14,
+        warm_start_forecast = True,
+        forecast_params_path = "./resources/cache/forecast_params.json",
+        vectorize_checks = True,
+        check_workers = 1,
+        consolidate_threshold = 10,
         ):
 
         # checks
@@ -20,10 +27,17 @@ class QCConfig():
         self.save_results = save_results # save results to an hdf5 file
         self.enable_experimental = enable_experimental # rerun stuff still in development
         self.enable_debug = enable_debug # turn on tracing
+        self.vectorize_checks = vectorize_checks # run the simple row checks over the whole frame at once
+        self.check_workers = check_workers # processes for the per-state checks (1 = in-process)
+        self.consolidate_threshold = consolidate_threshold # collapse a message_id with more than N messages
 
         # forecast
         self.images_dir = images_dir # place to store images
         self.plot_models = plot_models # generate model curves for forecast
+        self.batch_forecast = batch_forecast # fit the forecasts for all states at once
+        self.fit_window_days = fit_window_days # fit the exponential to the newest N days (0 = all)
+        self.warm_start_forecast = warm_start_forecast # start from the previous day's parameters
+        self.forecast_params_path = forecast_params_path # where the parameters for warm starts are kept
 
         # format
         self.show_dates = False # request more date context in messages 
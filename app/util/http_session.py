@@ -0,0 +1,145 @@
+#
+# Shared HTTP session for all remote sources
+#
+#   One requests.Session with keep-alive connection pools (per host) so the
+#   periodic refreshes don't pay TCP/TLS setup every time.  Failed connects,
+#   read timeouts and 5xx responses are retried with jittered exponential backoff.
+#   Retrying stops once total_timeout seconds have passed since the first
+#   failure, so retries x timeouts x backoff can't outlast a refresh cadence.
+#
+#   Call configure() once at startup to change the defaults.
+#
+import time
+import random
+import threading
+from typing import Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# defaults
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10.0
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+TOTAL_TIMEOUT = 30.0
+CONNECTIONS_PER_HOST = 4
+
+RETRY_STATUS = (500, 502, 503, 504)
+
+_settings = {
+    "connect_timeout": CONNECT_TIMEOUT,
+    "read_timeout": READ_TIMEOUT,
+    "retries": RETRIES,
+    "backoff_factor": BACKOFF_FACTOR,
+    "total_timeout": TOTAL_TIMEOUT,
+    "connections_per_host": CONNECTIONS_PER_HOST,
+}
+
+_session: requests.Session = None
+_lock = threading.Lock()
+
+
+class JitteredRetry(Retry):
+    """ Retry that randomizes each backoff between 50% and 150% so callers don't retry in lock-step
+
+    with max_total_seconds > 0, no retry (or backoff) goes past that many seconds after the first failure
+    """
+
+    def __init__(self, *args, max_total_seconds: float = 0, started: float = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_total_seconds = max_total_seconds
+        self.started = started
+
+    def new(self, **kw):
+        kw.setdefault("max_total_seconds", self.max_total_seconds)
+        kw.setdefault("started", self.started)
+        return super().new(**kw)
+
+    def remaining(self) -> float:
+        " seconds left before retrying stops (None if there is no limit) "
+        if self.max_total_seconds <= 0 or self.started is None: return None
+        return self.started + self.max_total_seconds - time.monotonic()
+
+    def increment(self, *args, **kwargs):
+        retry = self
+        if self.started is None:
+            retry = self.new(started=time.monotonic())
+        elif self.remaining() != None and self.remaining() <= 0:
+            # out of time, exhaust the retries so the error is raised
+            retry = self.new(total=0)
+        return super(JitteredRetry, retry).increment(*args, **kwargs)
+
+    def get_backoff_time(self) -> float:
+        t = super().get_backoff_time()
+        if t <= 0: return t
+        t = t * (0.5 + random.random())
+        remaining = self.remaining()
+        if remaining != None: t = max(0.0, min(t, remaining))
+        return t
+
+
+def configure(connect_timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT,
+              retries: int = RETRIES, backoff_factor: float = BACKOFF_FACTOR,
+              connections_per_host: int = CONNECTIONS_PER_HOST, total_timeout: float = TOTAL_TIMEOUT):
+    " change the settings, the session is rebuilt on next use "
+    global _session
+
+    with _lock:
+        _settings["connect_timeout"] = connect_timeout
+        _settings["read_timeout"] = read_timeout
+        _settings["retries"] = retries
+        _settings["backoff_factor"] = backoff_factor
+        _settings["connections_per_host"] = connections_per_host
+        _settings["total_timeout"] = total_timeout
+        if _session != None:
+            _session.close()
+            _session = None
+
+def configure_from_ini(section):
+    " configure from the [HTTP] section of quality-control.ini "
+    configure(
+        connect_timeout=float(section["connect_timeout"]),
+        read_timeout=float(section["read_timeout"]),
+        retries=int(section["retries"]),
+        backoff_factor=float(section["backoff_factor"]),
+        connections_per_host=int(section["connections_per_host"]),
+        total_timeout=float(section["total_timeout"]))
+
+def timeout() -> Tuple[float, float]:
+    " default (connect, read) timeout "
+    return _settings["connect_timeout"], _settings["read_timeout"]
+
+def get_session() -> requests.Session:
+    " the shared session "
+    global _session
+
+    with _lock:
+        if _session is None:
+            retry = JitteredRetry(
+                total=_settings["retries"],
+                connect=_settings["retries"],
+                read=_settings["retries"],
+                status=_settings["retries"],
+                status_forcelist=RETRY_STATUS,
+                backoff_factor=_settings["backoff_factor"],
+                raise_on_status=False,
+                max_total_seconds=_settings["total_timeout"])
+
+            # pool_maxsize/pool_block limit the open connections per host
+            adapter = HTTPAdapter(
+                pool_connections=16,
+                pool_maxsize=_settings["connections_per_host"],
+                pool_block=True,
+                max_retries=retry)
+
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+def get(url: str, **kwargs) -> requests.Response:
+    " GET using the shared session and the default timeout "
+    if not "timeout" in kwargs: kwargs["timeout"] = timeout()
+    return get_session().get(url, **kwargs)
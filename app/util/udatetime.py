@@ -12,6 +12,7 @@ import re
 from typing import Tuple
 import os
 import pandas as pd
+import numpy as np
 
 eastern_tz = pytz.timezone("US/Eastern")
 
@@ -104,6 +105,85 @@ def standardize_date(s: str) -> Tuple[str,int]:
     return s, error_num
 
 
+def standardize_dates(s: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """vectorized standardize_date for a column of strings
+
+    the formats are classified with regex extraction instead of per-cell python:
+       yyyy-mm-dd [hh:mm]     -> changed (1)
+       m/d[/y] [hh:mm]
+       blank                  -> blank (2), 01/01/2020 00:00
+       hh:mm only             -> missing date (3), today in ET
+       hh:mm AM/PM            -> changed (1) unless already flagged
+
+    values that can't be parsed are bad date (5) or bad time (6) and get
+    the blank placeholder date/time instead of failing the whole column.
+
+    return naive datetime64 column, error_num column
+    """
+
+    s = s.fillna("").astype(str).str.strip()
+    n = s.shape[0]
+
+    iso = s.str.extract("^(?P<y>[0-9]{4})-(?P<m>[0-9]{1,2})-(?P<d>[0-9]{1,2})(?:\\s+(?P<t>.*))?$")
+    mdy = s.str.extract("^(?P<m>[0-9]{1,2})/(?P<d>[0-9]{1,2})(?:/(?P<y>[0-9]{2,4}))?(?:\\s+(?P<t>.*))?$")
+
+    is_iso = s.str.contains("-", regex=False).values
+    is_mdy = (~is_iso) & s.str.contains("/", regex=False).values
+    is_blank = (s == "").values
+    is_time_only = ~(is_iso | is_mdy | is_blank)
+
+    error_num = np.zeros(n, dtype=np.int8)
+    error_num[is_iso] = 1 # changed
+    error_num[is_blank] = 2 # blank
+    error_num[is_time_only] = 3 # missing date
+
+    # --- date part
+    dt = now_as_eastern()
+    year = pd.to_numeric(iso["y"].where(is_iso, mdy["y"]), errors="coerce").values
+    month = pd.to_numeric(iso["m"].where(is_iso, mdy["m"]), errors="coerce").values
+    day = pd.to_numeric(iso["d"].where(is_iso, mdy["d"]), errors="coerce").values
+
+    year = np.where(is_mdy & np.isnan(year), 2020, year) # allow missing year
+    year = np.where(year < 100, year + 2000, year)
+    year = np.where(is_time_only, dt.year, np.where(is_blank, 2020, year))
+    month = np.where(is_time_only, dt.month, np.where(is_blank, 1, month))
+    day = np.where(is_time_only, dt.day, np.where(is_blank, 1, day))
+
+    # --- time part
+    stime = iso["t"].where(is_iso, mdy["t"]).where(~is_time_only, s).fillna("00:00")
+    tm = stime.str.extract("^(?P<h>[0-9]{1,2}):(?P<m>[0-9]{1,2})(?::[0-9]{2})?\\s*(?P<ampm>[AaPp][Mm])?$")
+    hour = pd.to_numeric(tm["h"], errors="coerce").values
+    minute = pd.to_numeric(tm["m"], errors="coerce").values
+    ampm = tm["ampm"].fillna("").str.upper().values
+
+    # convert to 24 hour clock (same rules as standardize_date)
+    has_ampm = ampm != ""
+    hour = np.where(ampm == "PM", hour + 12, hour)
+    error_num[has_ampm & (error_num == 0)] = 1 # changed
+
+    bad_hour = has_ampm & ~((0 < hour) & (hour < 24))
+    bad_minute = has_ampm & ~((0 < minute) & (minute < 60))
+    hour = np.where(bad_hour, 23, hour)
+    minute = np.where(bad_minute, 0, minute)
+
+    bad_time = np.isnan(hour) | np.isnan(minute) | (hour > 23) | (minute > 59)
+    error_num[bad_hour | bad_minute | bad_time] = 6 # bad time
+    hour = np.where(bad_time, 0, hour)
+    minute = np.where(bad_time, 0, minute)
+
+    # --- combine
+    parts = pd.DataFrame({"year": year, "month": month, "day": day, "hour": hour, "minute": minute})
+    bad_date = parts[["year", "month", "day"]].isnull().any(axis=1).values
+    parts.loc[bad_date, ["year", "month", "day", "hour", "minute"]] = [2020, 1, 1, 0, 0]
+
+    result = pd.to_datetime(parts, errors="coerce")
+    bad_date = bad_date | result.isnull().values
+    result[bad_date] = pd.Timestamp(2020, 1, 1)
+    error_num[bad_date] = 5 # bad date
+
+    return pd.Series(result.values, index=s.index), pd.Series(error_num, index=s.index)
+
+
 #
 # Do not use utcnow.  It returns a naive date at current time in England.
 #
@@ -141,6 +221,17 @@ def pandas_timestamp_as_eastern(dt: pd.Timestamp) -> pd.Timestamp:
         raise Exception(f"value ({dt}) is not a naive timestamp")
     return dt.tz_localize(eastern_tz)
 
+def series_from_naive_eastern(s: pd.Series) -> pd.Series:
+    """ localize a column of naive eastern wall-clock times (vectorized pandas_timestamp_as_eastern)
+
+    ambiguous times (the repeated hour in November) are taken as standard time and
+    non-existent times (the skipped hour in March) are shifted forward.
+    """
+    if s.dt.tz != None:
+        raise Exception(f"column ({s.name}) is not a naive timestamp")
+    is_dst = np.zeros(s.shape[0], dtype=bool)
+    return s.dt.tz_localize(eastern_tz, ambiguous=is_dst, nonexistent="shift_forward")
+
 def parse_string_as_eastern(s: str) -> datetime:
     """ convert a string into a tz-aware datetime """
     if s == None: return None
@@ -9,6 +9,7 @@ from requests.packages import urllib3
 import configparser
 
 from .udatetime import *
+from .http_session import get_session
 
 urllib3.disable_warnings()
 
@@ -75,7 +76,7 @@ state_abbrevs = {
 def fetch_with_requests(page: str) -> [bytes, int]:
     " check data using requests "
     try:
-        resp = requests.get(page, verify=False, timeout=30)
+        resp = get_session().get(page, verify=False, timeout=30)
         return resp.content, resp.status_code
     except Exception as ex:
         logger.error(f"Exception: {ex}")
@@ -0,0 +1,345 @@
+#
+# Vectorized versions of the simple row checks in checks.py
+#
+#   Each rule is evaluated with column-wise numpy expressions over the whole
+#   frame.  Messages are only formatted for the failing rows and are identical
+#   to the per-row checks.
+#
+#   evaluate() returns a VectorResults that replays the messages into a
+#   ResultLog, either for one row at a time (so they interleave with the other
+#   per-row checks in the same order as before) or for the whole frame.
+#
+#   evaluate_history() does the same for the history checks, one pass over
+#   the (state, date) sorted arrays of a HistoryIndex.
+#
+from typing import List, Dict, Tuple
+from loguru import logger
+import pandas as pd
+import numpy as np
+
+from .log.result_log import ResultLog, ResultCategory
+from .data.schema import BLANK_COUNT
+from .data.history_index import HistoryIndex
+
+# check names, in the order the per-row checks run
+TOTAL = "total"
+POSITIVES_RATE = "positives_rate"
+DEATH_RATE = "death_rate"
+LESS_RECOVERED_THAN_POSITIVE = "less_recovered_than_positive"
+PENDINGS_RATE = "pendings_rate"
+
+RATE_CHECKS = [POSITIVES_RATE, DEATH_RATE, LESS_RECOVERED_THAN_POSITIVE, PENDINGS_RATE]
+ALL_CHECKS = [TOTAL] + RATE_CHECKS
+
+# checks that also need the county rollup
+COUNTIES_ROLLUP_TO_STATE = "counties_rollup_to_state"
+
+ROLLUP_CHECKS = [COUNTIES_ROLLUP_TO_STATE]
+
+# history checks
+MONOTONICALLY_INCREASING = "monotonically_increasing"
+
+HISTORY_CHECKS = [MONOTONICALLY_INCREASING]
+
+# one message: (row position, category, text)
+Message = Tuple[int, ResultCategory, str]
+
+
+def _column(df: pd.DataFrame, name: str) -> np.ndarray:
+    " column as int64 so sums cannot overflow "
+    return df[name].values.astype(np.int64)
+
+def _percent(n: np.ndarray, n_tot: np.ndarray) -> np.ndarray:
+    " 100 * n / n_tot, 0 where n_tot <= 0 "
+    result = np.zeros(len(n), dtype=float)
+    has_tot = n_tot > 0
+    result[has_tot] = 100.0 * n[has_tot] / n_tot[has_tot]
+    return result
+
+def _bad_value_msg(name: str, val: int) -> str:
+    if val == -1000: return f"{name} is blank"
+    if val == -1001: return f"{name} is invalid"
+    return f"{name} is negative ({val})"
+
+
+def total(df: pd.DataFrame) -> List[Message]:
+    """Check that pendings, positive, and negative sum to the reported total"""
+
+    n_pos, n_neg, n_pending, n_death, n_tot = [_column(df, c)
+        for c in ["positive", "negative", "pending", "death", "total"]]
+
+    # allow blanks
+    n_pending = np.where(n_pending == -1000, 0, n_pending)
+
+    result = []
+    is_bad = np.zeros(len(df), dtype=bool)
+    for name, vals in [("positive", n_pos), ("negative", n_neg), ("pending", n_pending), ("death", n_death)]:
+        bad = vals < 0
+        is_bad |= bad
+        for i in np.flatnonzero(bad):
+            result.append((i, ResultCategory.DATA_ENTRY, _bad_value_msg(name, vals[i])))
+
+    n_diff = n_tot - (n_pos + n_neg + n_pending)
+    for i in np.flatnonzero(~is_bad & (n_tot < 0)):
+        result.append((i, ResultCategory.DATA_ENTRY, _bad_value_msg("total", n_tot[i])))
+    for i in np.flatnonzero(~is_bad & (n_tot >= 0) & (n_diff != 0)):
+        result.append((i, ResultCategory.DATA_ENTRY,
+            f"Formula broken -> Positive ({n_pos[i]}) + Negative ({n_neg[i]}) + Pending ({n_pending[i]}) != Total ({n_tot[i]}), delta = {n_diff[i]}"))
+
+    # keep the per-row message order (positive, negative, ...) within each row
+    result.sort(key=lambda x: x[0])
+    return result
+
+
+def positives_rate(df: pd.DataFrame) -> List[Message]:
+    """Check that positives compose <20% test results"""
+
+    n_pos, n_neg = _column(df, "positive"), _column(df, "negative")
+    n_tot = n_pos + n_neg
+    percent_pos = _percent(n_pos, n_tot)
+
+    limit = np.where(n_tot > 100, 40.0, 80.0)
+    failed = (percent_pos > limit) & (n_pos > 20)
+
+    return [(i, ResultCategory.DATA_QUALITY,
+        f"high positives rate {percent_pos[i]:.0f}% (positive={n_pos[i]:,}, total={n_tot[i]:,})")
+        for i in np.flatnonzero(failed)]
+
+
+def death_rate(df: pd.DataFrame) -> List[Message]:
+    """Check that deaths are <5% of test results"""
+
+    n_pos, n_neg, n_deaths = _column(df, "positive"), _column(df, "negative"), _column(df, "death")
+    n_tot = n_pos + n_neg
+    percent_deaths = _percent(n_deaths, n_tot)
+
+    limit = np.where(n_tot > 100, 5.0, 10.0)
+    failed = percent_deaths > limit
+
+    return [(i, ResultCategory.DATA_QUALITY,
+        f"high death rate {percent_deaths[i]:.0f}% (positive={n_deaths[i]:,}, total={n_tot[i]:,})")
+        for i in np.flatnonzero(failed)]
+
+
+def less_recovered_than_positive(df: pd.DataFrame) -> List[Message]:
+    """Check that we don't have more recovered than positive"""
+
+    n_recovered, n_pos = _column(df, "recovered"), _column(df, "positive")
+    failed = n_recovered > n_pos
+
+    return [(i, ResultCategory.DATA_QUALITY,
+        f"More recovered than positive (recovered={n_recovered[i]:,}, positive={n_pos[i]:,})")
+        for i in np.flatnonzero(failed)]
+
+
+def pendings_rate(df: pd.DataFrame) -> List[Message]:
+    """Check that pendings are not more than 20% of total"""
+
+    n_pos, n_neg, n_pending = _column(df, "positive"), _column(df, "negative"), _column(df, "pending")
+    n_tot = n_pos + n_neg
+    percent_pending = _percent(n_pending, n_tot)
+
+    limit = np.where(n_tot > 1000, 20.0, 80.0)
+    failed = percent_pending > limit
+
+    return [(i, ResultCategory.DATA_QUALITY,
+        f"high pending rate {percent_pending[i]:.0f}% (pending={n_pending[i]:,}, total={n_tot[i]:,})")
+        for i in np.flatnonzero(failed)]
+
+
+COUNTY_ERROR_THRESHOLDS = {
+    "positive-small": (.5, 1.5),
+    "positive-large": (.75, 1.25),
+    "death-small": (.5, 1.5),
+    "death-large": (.75, 1.25),
+}
+
+def _median_source(rollup: pd.DataFrame, by: List[str]) -> pd.DataFrame:
+    """ the median source for each state when sorted by the columns in by
+
+    the row at n // 2 in each state, indexed by state.  source is the
+    last tie-breaker so the pick matches Rollup.
+    """
+
+    df = rollup.sort_values(["state"] + by + ["source"], kind="mergesort")
+    pos = df.groupby("state", sort=False).cumcount().values
+    n = df.groupby("state", sort=False)["state"].transform("size").values
+    return df[pos == n // 2].set_index("state")
+
+def _limits(small: np.ndarray, aggregate: np.ndarray,
+            t_small: Tuple[float, float], t_large: Tuple[float, float]) -> Tuple[np.ndarray, np.ndarray]:
+    " the allowed (min, max) around the county aggregate, truncated like int() "
+
+    lo = np.where(small, t_small[0], t_large[0])
+    hi = np.where(small, t_small[1], t_large[1])
+    return np.trunc(lo * aggregate).astype(np.int64), np.trunc(hi * aggregate + 10).astype(np.int64)
+
+def counties_rollup_to_state(df: pd.DataFrame, rollup: pd.DataFrame) -> List[Message]:
+    """Check that county totals from NYT, CSBS, CDS datasets are
+    about equal to the reported state totals.
+
+    rollup is the county rollup (state, source, cases, deaths), states
+    without county data are skipped.
+    """
+
+    if rollup is None or rollup.shape[0] == 0: return []
+
+    rollup = pd.DataFrame({
+        "state": rollup["state"].astype(str).values,
+        "source": rollup["source"].astype(str).values,
+        "cases": rollup["cases"].values.astype(np.int64),
+        "deaths": rollup["deaths"].values.astype(np.int64),
+    })
+
+    # ties in deaths fall back to cases
+    by_cases = _median_source(rollup, ["cases"])
+    by_deaths = _median_source(rollup, ["deaths", "cases"])
+
+    # join the state rows with the medians once
+    states = df["state"].astype(str).values
+    has_rollup = pd.Index(by_cases.index).get_indexer(states) >= 0
+    by_cases = by_cases.reindex(states)
+    by_deaths = by_deaths.reindex(states)
+
+    n_pos, n_death = _column(df, "positive"), _column(df, "death")
+    cases = np.where(has_rollup, by_cases["cases"].values, 0).astype(np.int64)
+    deaths = np.where(has_rollup, by_deaths["deaths"].values, 0).astype(np.int64)
+
+    t = COUNTY_ERROR_THRESHOLDS
+    c_min, c_max = _limits(n_pos < 500, cases, t["positive-small"], t["positive-large"])
+    d_min, d_max = _limits(n_death < 50, deaths, t["death-small"], t["death-large"])
+
+    bad_cases = has_rollup & (n_pos > 1000) & ~((c_min <= n_pos) & (n_pos <= c_max))
+    bad_deaths = has_rollup & (n_death > 200) & ~((d_min <= n_death) & (n_death <= d_max))
+
+    result = []
+    for i in np.flatnonzero(bad_cases | bad_deaths):
+        if bad_cases[i]:
+            logger.warning(f"  {states[i]}: positive ({n_pos[i]:,}) does not match county aggregate ({c_min[i]:,} to {c_max[i]:,})")
+            result.append((i, ResultCategory.DATA_QUALITY,
+                f"positive ({n_pos[i]:,}) does not match {by_cases['source'].values[i]} county aggregate ({cases[i]:,}, allow {c_min[i]:,} to {c_max[i]:,})"))
+        if bad_deaths[i]:
+            logger.warning(f"  {states[i]}:   death ({n_death[i]:,}) does not match county aggregate ({d_min[i]:,} to {d_max[i]:,})")
+            result.append((i, ResultCategory.DATA_QUALITY,
+                f"death ({n_death[i]:,}) does not match {by_deaths['source'].values[i]} county aggregate ({deaths[i]:,}, allow {d_min[i]:,} to {d_max[i]:,})"))
+    return result
+
+
+def decreasing_dates(index: HistoryIndex, column: str) -> Dict[str, np.ndarray]:
+    " the dates where column is less than the day before, by state "
+
+    vals = index.arrays[column]
+    dates = index.arrays["date"]
+
+    # skip blank days, then compare each row with the row before it when
+    # both belong to the same state
+    reported = np.flatnonzero(vals != BLANK_COUNT)
+    vals = vals[reported]
+    owners = np.searchsorted(index.starts, reported, side="right") - 1
+    decreased = (vals[:-1] > vals[1:]) & (owners[:-1] == owners[1:])
+
+    rows = reported[1:][decreased]
+    if len(rows) == 0: return {}
+
+    owners = owners[1:][decreased]
+    result = {}
+    for k in np.unique(owners):
+        result[index.states[k]] = dates[rows[owners == k]]
+    return result
+
+
+MONOTONIC_COLUMNS = ["positive", "negative", "hospitalized", "death"]
+
+def monotonically_increasing(index: HistoryIndex, states: List[str]) -> List[Message]:
+    """Check that timeseries values are monotonically increasing
+
+    positions are the positions in states
+    """
+
+    by_column = { c: decreasing_dates(index, c) for c in MONOTONIC_COLUMNS }
+
+    result = []
+    for i, state in enumerate(states):
+        for c in MONOTONIC_COLUMNS:
+            dates = by_column[c].get(state)
+            if dates is None: continue
+            error_dates_str = ", ".join(str(x) for x in dates)
+            result.append((i, ResultCategory.DATA_QUALITY, f"{c} values decreased from the previous day (on {error_dates_str})"))
+    return result
+
+
+CHECKS = {
+    TOTAL: total,
+    POSITIVES_RATE: positives_rate,
+    DEATH_RATE: death_rate,
+    LESS_RECOVERED_THAN_POSITIVE: less_recovered_than_positive,
+    PENDINGS_RATE: pendings_rate,
+}
+
+ROLLUP_CHECK_FUNCS = {
+    COUNTIES_ROLLUP_TO_STATE: counties_rollup_to_state,
+}
+
+HISTORY_CHECK_FUNCS = {
+    MONOTONICALLY_INCREASING: monotonically_increasing,
+}
+
+
+class VectorResults:
+    " messages from evaluate(), grouped by row "
+
+    def __init__(self, states: np.ndarray, by_check: Dict[str, List[Message]]):
+        self.states = states
+        self.names = list(by_check.keys())
+
+        # row position -> check name -> [(category, text)]
+        self._by_row: Dict[int, Dict[str, List[Tuple[ResultCategory, str]]]] = {}
+        for name, messages in by_check.items():
+            for i, category, text in messages:
+                checks = self._by_row.setdefault(int(i), {})
+                checks.setdefault(name, []).append((category, text))
+
+    @property
+    def failed_rows(self) -> List[int]:
+        return sorted(self._by_row.keys())
+
+    def emit(self, log: ResultLog, pos: int, names: List[str]):
+        " add the messages for one row (position in the frame), in check order "
+
+        checks = self._by_row.get(pos)
+        if checks is None: return
+
+        state = self.states[pos]
+        for name in names:
+            for category, text in checks.get(name, []):
+                log.add(category, state, text)
+
+    def emit_all(self, log: ResultLog, names: List[str] = None):
+        " add the messages for all rows, in row order "
+        if names is None: names = self.names
+        for pos in self.failed_rows:
+            self.emit(log, pos, names)
+
+
+def evaluate(df: pd.DataFrame, names: List[str] = None, rollup: pd.DataFrame = None) -> VectorResults:
+    """ run the checks over every row of df
+
+    rollup is the county rollup for the ROLLUP_CHECKS (no messages without it)
+    """
+
+    if names is None: names = ALL_CHECKS
+    by_check = {}
+    for name in names:
+        if name in ROLLUP_CHECK_FUNCS:
+            by_check[name] = ROLLUP_CHECK_FUNCS[name](df, rollup)
+        else:
+            by_check[name] = CHECKS[name](df)
+    return VectorResults(df["state"].values, by_check)
+
+
+def evaluate_history(index: HistoryIndex, states: List[str], names: List[str] = None) -> VectorResults:
+    " run the history checks over every state in the index "
+
+    if names is None: names = HISTORY_CHECKS
+    by_check = { name: HISTORY_CHECK_FUNCS[name](index, states) for name in names }
+    return VectorResults(np.array(states, dtype=object), by_check)
@@ -1,21 +1,125 @@
 #
 # A Flask Blueprint to support embedding checks as a library
 #
+#   The service renders each result once (json/csv/html plus gzip/brotli
+#   variants and an ETag); the routes just pass the bytes along.  The html
+#   page around the results is kept here until the result changes, or
+#   streamed straight from the service when the results are large.
+#
 
 import os
-from flask import Blueprint, request, jsonify, Response, render_template
+from flask import Blueprint, request, jsonify, Response, render_template, stream_with_context
 import json
-from typing import Tuple
+import hashlib
+import serpent
+from typing import Tuple, Dict
 from datetime import datetime
 from loguru import logger
 
 from run_quality_service import get_proxy
+from app.log.rendered_result import RenderedOutput
 import app.util.udatetime as udatetime
 
 checks = Blueprint("checks", __name__, url_prefix='/checks')
 
 load_date = udatetime.now_as_eastern()
 
+# pages with larger results are streamed from the service instead of being
+# kept (and compressed) here
+STREAM_MIN_BYTES = 2 * 1024 * 1024
+
+# times to re-read the result info when the result changes before it is streamed
+STREAM_ATTEMPTS = 3
+
+# stands in for the results when the page template is split around them
+RESULT_MARKER = "<!-- check results -->"
+
+# name -> (etag of the results, page head, page tail, rendered page)
+g_pages: Dict[str, Tuple[str, str, str, RenderedOutput]] = {}
+
+def make_response(body: bytes, etag: str, mimetype: str, encoding: str, age: float) -> Response:
+    " a 200 with the bytes, or a 304 if body is None.  age is how old the result is (secs) "
+
+    if body is None:
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype=mimetype, status=200)
+        if encoding != "": response.headers["Content-Encoding"] = encoding
+    response.headers["ETag"] = etag
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Age"] = str(int(age))
+    return response
+
+def is_not_modified(etag: str) -> bool:
+    return etag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]
+
+def send_result(name: str, fmt: str) -> Response:
+    " send the pre-rendered json/csv for a result "
+
+    service = get_proxy()
+    x = service.response(name, fmt,
+        request.headers.get("Accept-Encoding", ""), request.headers.get("If-None-Match", ""))
+    body = serpent.tobytes(x["body"]) if x["body"] != None else None
+    return make_response(body, x["etag"], x["mimetype"], x["encoding"], x["age"])
+
+def send_page(name: str) -> Response:
+    """ send check_results.html for a result
+
+    the template is rendered for every request (it uses url_for) but the
+    page is only rebuilt and compressed when the result or the template
+    output changes.  large results are streamed without being kept here.
+    """
+
+    service = get_proxy()
+    head, tail = render_template("check_results.html", result=RESULT_MARKER).split(RESULT_MARKER, 1)
+
+    info = service.result_info(name, "html")
+    if info["size"] >= STREAM_MIN_BYTES:
+        return stream_page(name, head, tail, info)
+
+    cached = g_pages.get(name)
+    if cached != None and (cached[1], cached[2]) != (head, tail): cached = None
+    x = service.response(name, "html", "identity", cached[0] if cached != None else "")
+    if x["body"] != None:
+        result = serpent.tobytes(x["body"]).decode("utf-8")
+        cached = (x["etag"], head, tail, RenderedOutput(head + result + tail, "text/html"))
+        g_pages[name] = cached
+
+    page = cached[3]
+    if is_not_modified(page.etag):
+        return make_response(None, page.etag, page.mimetype, "", x["age"])
+    body, encoding = page.encoded(request.headers.get("Accept-Encoding", ""))
+    return make_response(body, page.etag, page.mimetype, encoding, x["age"])
+
+def stream_page(name: str, head: str, tail: str, info: Dict) -> Response:
+    """ send check_results.html with the results streamed in as they arrive
+
+    the chunks are requested for the etag in info, if the result was
+    swapped in between the service returns None and info is read again.
+    """
+
+    service = get_proxy()
+    for _ in range(STREAM_ATTEMPTS):
+        etag = '"' + hashlib.sha1((head + info["etag"] + tail).encode("utf-8")).hexdigest() + '"'
+        if is_not_modified(etag):
+            return make_response(None, etag, "text/html", "", info["age"])
+
+        chunks = getattr(service, f"{name}_html_chunks")(info["etag"])
+        if chunks != None: break
+        info = service.result_info(name, "html")
+    else:
+        raise Exception(f"{name} changed while it was being streamed")
+
+    def generate():
+        yield head
+        for x in chunks: yield x
+        yield tail
+
+    response = Response(stream_with_context(generate()), mimetype="text/html", status=200)
+    response.headers["ETag"] = etag
+    response.headers["Age"] = str(int(info["age"]))
+    return response
+
 def service_load_dates() -> Tuple[datetime, datetime, datetime]:
     " returns flask app start time, Pyro4 service start time, and current time (all ET)"
     try:
@@ -30,9 +134,7 @@ def service_load_dates() -> Tuple[datetime, datetime, datetime]:
 @checks.route("/working.json", methods=["GET"])
 def working_json():
     try:
-        service = get_proxy()
-        result = service.working_json
-        return Response(result, mimetype="text/json", status=200)
+        return send_result("working", "json")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
@@ -41,9 +143,7 @@ def working_json():
 @checks.route("/working.html", methods=["GET"])
 def working_html():
     try:
-        service = get_proxy()
-        result = service.working_html
-        return render_template("check_results.html", result=result)
+        return send_page("working")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
@@ -52,19 +152,16 @@ def working_html():
 @checks.route("/working.csv", methods=["GET"])
 def working_csv():
     try:
-        service = get_proxy()
-        result = service.working_csv
-        return Response(result, mimetype="text/csv", status=200)
+        return send_result("working", "csv")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
 
+
 @checks.route("/current.json", methods=["GET"])
 def current_json():
     try:
-        service = get_proxy()
-        result = service.current_json
-        return Response(result, mimetype="text/json", status=200)
+        return send_result("current", "json")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
@@ -73,9 +170,7 @@ def current_json():
 @checks.route("/current.html", methods=["GET"])
 def current_html():
     try:
-        service = get_proxy()
-        result = service.current_html
-        return render_template("check_results.html", result=result)
+        return send_page("current")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
@@ -84,9 +179,7 @@ def current_html():
 @checks.route("/current.csv", methods=["GET"])
 def current_csv():
     try:
-        service = get_proxy()
-        result = service.current_csv
-        return Response(result, mimetype="text/csv", status=200)
+        return send_result("current", "csv")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
@@ -95,9 +188,7 @@ def current_csv():
 @checks.route("/history.json", methods=["GET"])
 def history_json():
     try:
-        service = get_proxy()
-        result = service.history_json
-        return Response(result, mimetype="text/json", status=200)
+        return send_result("history", "json")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
@@ -106,9 +197,7 @@ def history_json():
 @checks.route("/history.html", methods=["GET"])
 def history_html():
     try:
-        service = get_proxy()
-        result = service.history_html
-        return render_template("check_results.html", result=result)
+        return send_page("history")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
@@ -117,9 +206,7 @@ def history_html():
 @checks.route("/history.csv", methods=["GET"])
 def history_csv():
     try:
-        service = get_proxy()
-        result = service.history_csv
-        return Response(result, mimetype="text/csv", status=200)
+        return send_result("history", "csv")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
@@ -5,8 +5,11 @@ from loguru import logger
 from argparse import ArgumentParser, Namespace, RawDescriptionHelpFormatter
 
 from app.util import read_config_file
+import app.util.http_session as http_session
 from app.qc_config import QCConfig
-from app.data.data_source import DataSource
+from app.data.data_source import DataSource, enable_http_cache, http_cache_stats
+from app.modeling.forecast_cache import enable_forecast_cache, forecast_cache_stats
+from app.data.snapshot_store import parse_as_of
 from app.check_dataset import check_current, check_working, check_history
 
 
@@ -35,7 +38,10 @@ def load_args_parser(config) -> ArgumentParser:
     save_results = config["CHECKS"]["save_results"] == "True"
     enable_experimental = config["CHECKS"]["enable_experimental"] == "True"
     enable_debug = config["CHECKS"]["enable_debug"] == "True"
+    vectorize_checks = config["CHECKS"]["vectorize_checks"] == "True"
     plot_models = config["MODEL"]["plot_models"] == "True"
+    batch_forecast = config["MODEL"]["batch_forecast"] == "True"
+    warm_start_forecast = config["MODEL"]["warm_start_forecast"] == "True"
 
     parser.add_argument(
         '--save', dest='save_results', action='store_true', default=save_results,
@@ -49,10 +55,41 @@ def load_args_parser(config) -> ArgumentParser:
         '--debug', dest='enable_debug', action='store_true', default=enable_debug,
         help='enable debug traces')
 
+    parser.add_argument(
+        '--row_checks', dest='vectorize_checks', action='store_false', default=vectorize_checks,
+        help='run the simple checks row-by-row instead of vectorized')
+
+    parser.add_argument(
+        '-j', '--workers', dest='check_workers', type=int,
+        default=int(config["CHECKS"]["check_workers"]),
+        help='number of processes for the per-state checks')
+
+    parser.add_argument(
+        '--consolidate', dest='consolidate_threshold', type=int,
+        default=int(config["CHECKS"]["consolidate_threshold"]),
+        help='collapse repeated messages into one line when there are more than this many')
+
     parser.add_argument(
         '--plot', dest='plot_models', action='store_true', default=plot_models,
         help='plot the model curves')
 
+    parser.add_argument(
+        '--fit_each', dest='batch_forecast', action='store_false', default=batch_forecast,
+        help='fit the forecast for each state separately (curve_fit) instead of all at once')
+
+    parser.add_argument(
+        '--fit_window', dest='fit_window_days', type=int,
+        default=int(config["MODEL"]["fit_window_days"]),
+        help='fit the forecast to the newest N days (0 for the whole history)')
+
+    parser.add_argument(
+        '--cold_start', dest='warm_start_forecast', action='store_false', default=warm_start_forecast,
+        help="don't start the forecast fit from the previous day's parameters")
+    parser.add_argument(
+        '--forecast_params', dest='forecast_params_path',
+        default=config["CACHE"]["forecast_params_path"],
+        help="file for the parameters used to warm start the forecast fit")
+
 
     parser.add_argument(
         '--results_dir',
@@ -62,6 +99,38 @@ def load_args_parser(config) -> ArgumentParser:
         '--images_dir',
         default=config["MODEL"]["images_dir"],
         help='directory for model curves')
+    parser.add_argument(
+        '--cache_dir',
+        default=config["CACHE"]["http_cache_dir"],
+        help='directory for cached remote files (blank to disable)')
+    parser.add_argument(
+        '--cache_max_mb', type=int,
+        default=int(config["CACHE"]["http_cache_max_mb"]),
+        help='size limit for cached remote files')
+    parser.add_argument(
+        '--forecast_cache_size', type=int,
+        default=int(config["CACHE"]["forecast_cache_size"]),
+        help='forecast fits to keep in memory (0 to disable the forecast cache)')
+    parser.add_argument(
+        '--forecast_cache_dir',
+        default=config["CACHE"]["forecast_cache_dir"],
+        help='directory for cached forecast fits (blank for memory only)')
+    parser.add_argument(
+        '--snapshot_dir',
+        default=config["CACHE"]["snapshot_dir"],
+        help='save a snapshot of every source to this directory (blank to disable)')
+    parser.add_argument(
+        '--snapshot_keep', type=int,
+        default=int(config["CACHE"]["snapshot_keep"]),
+        help='snapshots to keep per source (0 for no limit)')
+    parser.add_argument(
+        '--snapshot_max_age_days', type=float,
+        default=float(config["CACHE"]["snapshot_max_age_days"]),
+        help='remove snapshots older than this (0 for no limit)')
+    parser.add_argument(
+        '--as_of',
+        default=None,
+        help='replay the snapshots in snapshot_dir as-of this time (yyyymmdd-hhmmssZ or ISO, ET if no timezone)')
 
     return parser
 
@@ -73,6 +142,8 @@ def main() -> None:
     parser = load_args_parser(config)
     args = parser.parse_args(sys.argv[1:])
 
+    http_session.configure_from_ini(config["HTTP"])
+
     if not args.check_working and not args.check_current and not args.check_history:
         logger.info("  [default to all sources]")
         args.check_working = True
@@ -86,6 +157,13 @@ def main() -> None:
         enable_debug=args.enable_debug,
         images_dir=args.images_dir,
         plot_models=args.plot_models,
+        batch_forecast=args.batch_forecast,
+        fit_window_days=args.fit_window_days,
+        warm_start_forecast=args.warm_start_forecast,
+        forecast_params_path=args.forecast_params_path,
+        vectorize_checks=args.vectorize_checks,
+        check_workers=args.check_workers,
+        consolidate_threshold=args.consolidate_threshold,
     )
     if config.save_results:
         logger.warning(f"  [save results to {args.results_dir}]")
@@ -95,7 +173,21 @@ def main() -> None:
     if len(args.state) != 0:
         logger.error("  [states filter not implemented]")
 
-    ds = DataSource()
+    if args.cache_dir != "":
+        enable_http_cache(args.cache_dir, args.cache_max_mb)
+    if args.forecast_cache_size > 0:
+        enable_forecast_cache(args.forecast_cache_size, args.forecast_cache_dir)
+
+    if args.as_of != None:
+        if args.snapshot_dir == "":
+            logger.error("  [--as_of requires --snapshot_dir]")
+            return
+        logger.warning(f"  [replay snapshots from {args.snapshot_dir} as-of {args.as_of}]")
+    elif args.snapshot_dir != "":
+        logger.warning(f"  [save snapshots to {args.snapshot_dir}]")
+
+    ds = DataSource(snapshot_dir=args.snapshot_dir, as_of=parse_as_of(args.as_of),
+        snapshot_keep=args.snapshot_keep, snapshot_max_age_days=args.snapshot_max_age_days)
 
     if args.check_working:
         logger.info("--| QUALITY CONTROL --- GOOGLE WORKING SHEET |------")
@@ -115,12 +207,17 @@ def main() -> None:
 
     if args.check_history:
         logger.info("--| QUALITY CONTROL --- HISTORY |------")
-        log = check_history(ds)
+        log = check_history(ds, config=config)
         if log is None:
             ds.log.print()
         else:
             log.print()
 
+    if args.cache_dir != "":
+        logger.info(f"  [http cache: {http_cache_stats()}]")
+    if args.forecast_cache_size > 0:
+        logger.info(f"  [forecast cache: {forecast_cache_stats()}]")
+
 
 if __name__ == "__main__":
     main()
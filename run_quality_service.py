@@ -3,17 +3,27 @@
 #
 #  Hold the cache results on a singleton RPC server
 #
+#  With background_refresh the results are recomputed on a background thread
+#  (each on its own cadence) and requests are answered from the last completed
+#  run, so no request waits for a run after the first one.
+#
+import time
+import threading
 import Pyro4
 from loguru import logger
 from datetime import datetime
+from typing import Iterator, Dict, Callable
 
 from app.check_dataset import check_working, check_current, check_history
 
 from app.log.result_log import ResultLog
-from app.data.data_source import DataSource
+from app.log.rendered_result import RenderedResult
+from app.data.data_source import DataSource, enable_http_cache, http_cache_stats
+from app.modeling.forecast_cache import enable_forecast_cache, forecast_cache_stats
 from app.qc_config import QCConfig
 import app.util.util as util
 import app.util.udatetime as udatetime
+import app.util.http_session as http_session
 
 CACHE_DIRECTION = 60
 
@@ -33,11 +43,122 @@ def is_out_of_date(log: ResultLog, cache_seconds: int) -> bool:
     else:
         logger.info(f"last-run at {t:,}s ago -> skip") 
 
+
+RESULT_NAMES = ["working", "current", "history"]
+
+RUNS: Dict[str, Callable[[DataSource, QCConfig], ResultLog]] = {
+    "working": check_working,
+    "current": check_current,
+    "history": check_history,
+}
+
+class CompletedResult:
+    " a finished run: the log (None if the run failed) and its rendered outputs "
+
+    def __init__(self, log: ResultLog, ds: DataSource):
+        self.log = log
+        self.rendered = RenderedResult(log if log != None else ds.log)
+        self.completed_at = time.time()
+
+    @property
+    def age(self) -> float:
+        " seconds since the run finished "
+        return time.time() - self.completed_at
+
+
+class RefreshScheduler:
+    """ refresh each result on its own cadence on a background thread
+
+    the runs are done one at a time (they share the datasource caches).
+    the next run for a result is due cadence seconds after its last one
+    finished; trigger() makes it due now.
+    """
+
+    def __init__(self, refresh: Callable[[str], None], cadences: Dict[str, int]):
+        self._refresh = refresh
+        self._cadences = cadences
+        self._due = { name: 0.0 for name in cadences }
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._loop, name="refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def set_cadences(self, cadences: Dict[str, int]):
+        " change the cadences, the next runs are rescheduled from when the last ones finished "
+        with self._lock:
+            for name, seconds in cadences.items():
+                due = self._due.get(name, 0.0)
+                if 0 < due < float("inf"):
+                    self._due[name] = due - self._cadences.get(name, 0) + seconds
+                elif name not in self._due:
+                    self._due[name] = 0.0
+            self._cadences = dict(cadences)
+        self._wake.set()
+
+    def trigger(self, name: str = None):
+        " refresh a result (or all of them) as soon as possible "
+        with self._lock:
+            for x in self._due:
+                if name is None or x == name: self._due[x] = 0.0
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            with self._lock:
+                name = min(self._due, key=self._due.get)
+                wait = self._due[name] - time.monotonic()
+            if wait > 0:
+                self._wake.wait(wait)
+                self._wake.clear()
+                continue
+
+            # a trigger() during the run makes it due again right away
+            with self._lock:
+                self._due[name] = float("inf")
+
+            start = time.monotonic()
+            try:
+                self._refresh(name)
+            except Exception as ex:
+                logger.exception(ex)
+            logger.info(f"refreshed {name} in {time.monotonic() - start:.1f} secs")
+
+            with self._lock:
+                if self._due[name] == float("inf"):
+                    self._due[name] = time.monotonic() + self._cadences[name]
+
+
 class CheckServer:
-    f"cache the check results for {CACHE_DIRECTION} seconds"
+    f"cache the check results for {CACHE_DIRECTION} seconds (or refresh them in the background)"
 
     def __init__(self):
-        self.reset()
+        # the scheduler runs while start_refresh() was called and the config has background_refresh
+        self._scheduler: RefreshScheduler = None
+        self._refresh_started = False
+
+        # name -> last completed run, replaced as a whole when a new run finishes.
+        # kept across a reset so requests are answered while the new runs are going
+        self._results: Dict[str, CompletedResult] = {}
+        self._ready: Dict[str, threading.Event] = { name: threading.Event() for name in RESULT_NAMES }
+
+        # results to rerun on the next request (without background refresh)
+        self._stale = set(RESULT_NAMES)
+
+        # held for a run or a config reload so the config and the shared caches
+        # never change while checks are running
+        self._run_lock = threading.RLock()
+
+        with self._run_lock:
+            self._load_config()
 
     @Pyro4.expose
     @property
@@ -46,11 +167,19 @@ class CheckServer:
 
     @Pyro4.expose
     def reset(self):
-        self._working = None
-        self._current = None
-        self._history = None
+        " reload the config (also the [SERVICE] refresh settings) and rerun the checks (the last results are served until then) "
 
         logger.info("reset")
+        with self._run_lock:
+            self._load_config()
+            self._stale = set(RESULT_NAMES)
+
+        self._update_refresh()
+        if self._scheduler != None:
+            self._scheduler.trigger()
+
+    def _load_config(self):
+        " read quality-control.ini (caller holds the run lock) "
 
         config = util.read_config_file("quality-control")
         self.config = QCConfig(
@@ -60,117 +189,229 @@ class CheckServer:
             save_results=config["CHECKS"]["save_results"] == "True",
             images_dir=config["MODEL"]["images_dir"],
             plot_models=config["MODEL"]["plot_models"] == "True",
+            batch_forecast=config["MODEL"]["batch_forecast"] == "True",
+            fit_window_days=int(config["MODEL"]["fit_window_days"]),
+            warm_start_forecast=config["MODEL"]["warm_start_forecast"] == "True",
+            forecast_params_path=config["CACHE"]["forecast_params_path"],
+            vectorize_checks=config["CHECKS"]["vectorize_checks"] == "True",
+            check_workers=int(config["CHECKS"]["check_workers"]),
+            consolidate_threshold=int(config["CHECKS"]["consolidate_threshold"]),
         )
 
-        self.ds = DataSource()
+        http_session.configure_from_ini(config["HTTP"])
+        if config["CACHE"]["http_cache_dir"] != "":
+            enable_http_cache(config["CACHE"]["http_cache_dir"], int(config["CACHE"]["http_cache_max_mb"]))
+        if int(config["CACHE"]["forecast_cache_size"]) > 0:
+            enable_forecast_cache(int(config["CACHE"]["forecast_cache_size"]), config["CACHE"]["forecast_cache_dir"])
+        self.snapshot_dir = config["CACHE"]["snapshot_dir"]
+        self.snapshot_keep = int(config["CACHE"]["snapshot_keep"])
+        self.snapshot_max_age_days = float(config["CACHE"]["snapshot_max_age_days"])
+
+        self.background_refresh = config["SERVICE"]["background_refresh"] == "True"
+        self.refresh_seconds = { name: int(config["SERVICE"][f"refresh_{name}"]) for name in RESULT_NAMES }
+        self.ready_timeout = float(config["SERVICE"]["ready_timeout"])
+
+        self.ds = self._new_datasource()
+
+    def _new_datasource(self) -> DataSource:
+        return DataSource(snapshot_dir=self.snapshot_dir,
+            snapshot_keep=self.snapshot_keep, snapshot_max_age_days=self.snapshot_max_age_days)
+
+    def start_refresh(self):
+        " refresh the results in the background instead of when a request finds them out-of-date "
+        self._refresh_started = True
+        if not self.background_refresh or self._scheduler != None: return
+        logger.info(f"background refresh every {self.refresh_seconds}")
+        self._scheduler = RefreshScheduler(self._run, self.refresh_seconds)
+        self._scheduler.start()
+
+    def _update_refresh(self):
+        " apply a reloaded [SERVICE] section to the background refresh "
+        if not self._refresh_started: return
+        if self._scheduler is None:
+            self.start_refresh()
+        elif not self.background_refresh:
+            logger.info("background refresh off")
+            self._scheduler.stop()
+            self._scheduler = None
+        else:
+            logger.info(f"background refresh every {self.refresh_seconds}")
+            self._scheduler.set_cadences(self.refresh_seconds)
+
+    @Pyro4.expose
+    @property
+    def cache_stats(self) -> dict:
+        " hit/miss statistics for the remote csv cache "
+        return http_cache_stats()
+
+    @Pyro4.expose
+    @property
+    def forecast_cache_stats(self) -> dict:
+        " hit/miss statistics for the forecast fits "
+        return forecast_cache_stats()
+
+    # --- results
+
+    def _run(self, name: str) -> CompletedResult:
+        " run the checks for a result and swap it in "
+
+        with self._run_lock:
+            ds = self._new_datasource()
+            try:
+                log = RUNS[name](ds, self.config)
+            except Exception as ex:
+                # still publish a result so requests don't wait on it
+                ds.log.error(f"Could not run the {name} checks", ex)
+                log = None
+            result = CompletedResult(log, ds)
+
+            self.ds = ds
+            self._results[name] = result
+            self._stale.discard(name)
+            self._ready[name].set()
+        return result
+
+    def result(self, name: str) -> CompletedResult:
+        """ the last completed run for working/current/history
+
+        with background refresh this never runs the checks (it only waits, up to
+        ready_timeout, for the first run after a start), otherwise it reruns when
+        out-of-date or after a reset
+        """
+
+        if not name in RESULT_NAMES: raise Exception(f"Unknown result {name}")
+
+        if self._scheduler != None:
+            if not self._ready[name].wait(self.ready_timeout):
+                logger.warning(f"no {name} result after {self.ready_timeout} secs -> send the datasource errors")
+                return CompletedResult(None, self.ds)
+            return self._results[name]
+
+        result = self._results.get(name)
+        if name in self._stale or is_out_of_date(result.log if result != None else None, CACHE_DIRECTION):
+            with self._run_lock:
+                # another request may have rerun it while this one waited
+                result = self._results.get(name)
+                if name in self._stale or is_out_of_date(result.log if result != None else None, CACHE_DIRECTION):
+                    if name == "working": logger.info("rerun because working dataset is out-of-date")
+                    result = self._run(name)
+        return result
+
+    def rendered(self, name: str) -> RenderedResult:
+        " the outputs for working/current/history "
+        return self.result(name).rendered
+
+    @Pyro4.expose
+    def result_age(self, name: str) -> float:
+        " seconds since the result being served was computed "
+        return self.result(name).age
+
+    @Pyro4.expose
+    def response(self, name: str, fmt: str, accept_encoding: str = "", if_none_match: str = "") -> dict:
+        """ the pre-rendered bytes for a result in the best encoding the client accepts
+
+        returns etag, mimetype, encoding, body (None when if_none_match is current)
+        and age (seconds since the result was computed)
+        """
+        result = self.result(name)
+        x = result.rendered.response(fmt, accept_encoding, if_none_match)
+        x["age"] = result.age
+        return x
+
+    @Pyro4.expose
+    def result_info(self, name: str, fmt: str) -> dict:
+        " etag, mimetype, size (uncompressed bytes) and age of a result, without the body "
+        result = self.result(name)
+        output = result.rendered.get(fmt)
+        return { "etag": output.etag, "mimetype": output.mimetype, "size": len(output.body), "age": result.age }
+
+    def _html_chunks(self, name: str, etag: str = None) -> Iterator[str]:
+        " the html of a result as chunks, None if etag is given and the html no longer has it "
+        result = self.result(name)
+        if etag != None and result.rendered.get("html").etag != etag:
+            return None
+        if result.log is None:
+            return iter([result.rendered.get("html").text])
+        else:
+            return result.log.iter_html()
 
-    # --- working data
+# -----------------------------------
+# --- working data
     @property
     def working(self) -> ResultLog:
-        if is_out_of_date(self._working, CACHE_DIRECTION):
-            logger.info("rerun because working dataset is out-of-date")
-            self.ds = DataSource()
-            self._working = check_working(self.ds, self.config)
-        return self._working
+        return self.result("working").log
 
     @Pyro4.expose
     @property
     def working_csv(self) -> str:
-        w =  self.working
-        if w is None:
-            return self.ds.log.to_csv()
-        else:
-            return w.to_csv()
+        return self.rendered("working").get("csv").text
 
     @Pyro4.expose
     @property
     def working_json(self) -> str:
-        w =  self.working
-        if w is None:
-            return self.ds.log.to_json()
-        else:
-            return w.to_json()
+        return self.rendered("working").get("json").text
 
     @Pyro4.expose
     @property
     def working_html(self) -> str:
-        w =  self.working
-        if w is None:
-            return self.ds.log.to_html()
-        else:
-            return w.to_html()
+        return self.rendered("working").get("html").text
+
+    @Pyro4.expose
+    def working_html_chunks(self, etag: str = None) -> Iterator[str]:
+        " working_html as a stream of chunks (None if it is no longer the etag from result_info) "
+        return self._html_chunks("working", etag)
 
 # -----------------------------------
 # --- current data
     @property
     def current(self) -> ResultLog:
-        if is_out_of_date(self._current, CACHE_DIRECTION):
-            self.ds = DataSource()
-            self._current = check_current(self.ds, self.config)
-        return self._current
+        return self.result("current").log
 
     @Pyro4.expose
     @property
     def current_csv(self) -> str:
-        c =  self.current
-        if c is None:
-            return self.ds.log.to_csv()
-        else:
-            return c.to_csv()
+        return self.rendered("current").get("csv").text
 
     @Pyro4.expose
     @property
     def current_json(self) -> str:
-        c =  self.current
-        if c is None:
-            return self.ds.log.to_json()
-        else:
-            return c.to_json()
+        return self.rendered("current").get("json").text
 
     @Pyro4.expose
     @property
     def current_html(self) -> str:
-        c =  self.current
-        if c is None:
-            return self.ds.log.to_html()
-        else:
-            return c.to_html()
+        return self.rendered("current").get("html").text
+
+    @Pyro4.expose
+    def current_html_chunks(self, etag: str = None) -> Iterator[str]:
+        " current_html as a stream of chunks (None if it is no longer the etag from result_info) "
+        return self._html_chunks("current", etag)
 
 # -----------------------------------
 # --- history data
     @property
     def history(self) -> ResultLog:
-        if is_out_of_date(self._history, CACHE_DIRECTION):
-            self.ds = DataSource()
-            self._history = check_history(self.ds)
-        return self._history
+        return self.result("history").log
 
     @Pyro4.expose
     @property
     def history_csv(self) -> str:
-        h =  self.history
-        if h is None:
-            return self.ds.log.to_csv()
-        else:
-            return h.to_csv()
+        return self.rendered("history").get("csv").text
 
     @Pyro4.expose
     @property
     def history_json(self) -> str:
-        h =  self.history
-        if h is None:
-            return self.ds.log.to_json()
-        else:
-            return h.to_json()
+        return self.rendered("history").get("json").text
 
     @Pyro4.expose
     @property
     def history_html(self) -> str:
-        h =  self.history
-        if h is None:
-            return self.ds.log.to_html()
-        else:
-            return h.to_html()
+        return self.rendered("history").get("html").text
+
+    @Pyro4.expose
+    def history_html_chunks(self, etag: str = None) -> Iterator[str]:
+        " history_html as a stream of chunks (None if it is no longer the etag from result_info) "
+        return self._html_chunks("history", etag)
 
 # -----------------------------------
 
@@ -187,6 +428,7 @@ def start_server():
     # singleton instance
     global g_server
     g_server = CheckServer()
+    g_server.start_refresh()
 
     daemon = Pyro4.Daemon(host=HOST, port=PORT)
     daemon._pyroHmacKey = KEY
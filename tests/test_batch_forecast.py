@@ -0,0 +1,62 @@
+#
+# BatchForecast against fitting each state with Forecast (curve_fit)
+#
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.data.history_index import HistoryIndex
+from app.modeling.batch_forecast import BatchForecast
+from app.modeling.forecast import Forecast
+
+STATES = ["AK", "AL", "AR", "CA", "NY", "TX", "WA"]
+TARGET_DATE = 20200410
+
+Row = namedtuple("Row", ["positive"])
+
+
+def make_history(seed: int, days: int = 20) -> pd.DataFrame:
+    " exponential-ish growth with noise, one state with only 3 days "
+    rng = np.random.RandomState(seed)
+    dates = [int(d.strftime("%Y%m%d")) for d in pd.date_range(end="2020-04-10", periods=days)]
+    rows = []
+    for i, st in enumerate(STATES):
+        n = 3 if i == 0 else days
+        a, b = rng.uniform(1, 50), rng.uniform(0.05, 0.3)
+        for t, d in enumerate(dates[-n:]):
+            rows.append({"date": d, "state": st,
+                         "positive": int(a * np.exp(b * t) * rng.uniform(0.9, 1.1))})
+    return pd.DataFrame(rows).sort_values(["date", "state"], ascending=[False, True])
+
+def curve_fit_forecast(df: pd.DataFrame, state: str, window: int) -> Forecast:
+    forecast = Forecast()
+    forecast.date = TARGET_DATE
+    history = df[(df.state == state) & (df.date != TARGET_DATE)]
+    forecast.fit(history, window)
+    forecast.project(Row(0))
+    return forecast
+
+
+@pytest.mark.filterwarnings("ignore:Covariance of the parameters")
+@pytest.mark.parametrize("seed,window", [(0, 0), (1, 0), (2, 0), (3, 14), (4, 7)])
+def test_matches_curve_fit(seed, window):
+    df = make_history(seed)
+    batch = BatchForecast(HistoryIndex(df), TARGET_DATE, window=window)
+
+    assert batch.states == STATES
+    for st in STATES:
+        expected = curve_fit_forecast(df, st, window)
+        forecast = batch.forecast(st, 0)
+        assert forecast.projection_index == expected.projection_index
+        assert abs(forecast.expected_linear - expected.expected_linear) <= 1, st
+        assert abs(forecast.expected_exp - expected.expected_exp) <= 1, st
+
+def test_short_histories_are_left_out():
+    df = make_history(0)
+    df = df[(df.state != "AK") | (df.date == df.date.max())]
+    batch = BatchForecast(HistoryIndex(df), TARGET_DATE - 1)
+
+    assert "AK" not in batch.states
+    assert batch.forecast("AK", 0) is None
@@ -0,0 +1,81 @@
+#
+# blank counts (BLANK_COUNT) in the rollup, monotonic and forecast paths
+#
+import numpy as np
+import pandas as pd
+
+import app.checks as checks
+import app.vector_checks as vector_checks
+from app.data.data_source import DataSource
+from app.data.history_index import HistoryIndex
+from app.data.schema import BLANK_COUNT, COUNTY_SCHEMA, HISTORY_SCHEMA
+from app.log.result_log import ResultLog
+from app.modeling.batch_forecast import BatchForecast
+from app.modeling.forecast import Forecast
+
+DATES = [20200401, 20200402, 20200403, 20200404, 20200405, 20200406]
+
+
+def make_history(values: dict) -> pd.DataFrame:
+    " one row per date and state, None is blank "
+    rows = []
+    for state, vals in values.items():
+        for d, v in zip(DATES, vals):
+            rows.append({"date": d, "state": state, "positive": v, "negative": 0, "hospitalized": 0, "death": 0})
+    return HISTORY_SCHEMA.apply(pd.DataFrame(rows))
+
+def messages(log: ResultLog) -> list:
+    return [(x.location, x.message) for x in log.messages]
+
+
+def test_county_rollup_ignores_blank_counties():
+    def counties(source, deaths):
+        return COUNTY_SCHEMA.apply(pd.DataFrame({
+            "state": "NY", "county": ["a", "b", "c"], "source": source,
+            "cases": [10, 20, 30], "deaths": deaths, "recovered": np.nan}))
+
+    ds = DataSource()
+    ds._cds_counties = counties("cds", [5, np.nan, np.nan])
+    ds._csbs_counties = counties("csbs", [1, 2, 3])
+    ds._nyt_counties = counties("nyt", [np.nan] * 3)
+
+    rollup = ds.county_rollup.set_index("source")
+    assert rollup.loc["cds", "deaths"] == 5
+    assert rollup.loc["csbs", "deaths"] == 6
+    assert rollup.loc["nyt", "deaths"] == 0
+    assert (rollup["recovered"] == 0).all()
+    assert (rollup["cases"] == 60).all()
+
+def test_blank_is_not_a_decrease():
+    df = make_history({
+        "NY": [0, None, 3, None, 5, 6],     # blanks are skipped
+        "TX": [4, None, 2, 2, 3, 3],        # compared with the last reported value
+        "WA": [None, 1, 1, 2, None, None],
+    })
+    index = HistoryIndex(df)
+
+    row_log = ResultLog()
+    for state in index.states:
+        checks.monotonically_increasing(index.get(state), row_log)
+    assert messages(row_log) == [("TX", "positive values decreased from the previous day (on 20200403)")]
+
+    vector_log = ResultLog()
+    for i, category, message in vector_checks.monotonically_increasing(index, index.states):
+        vector_log.add(category, index.states[i], message)
+    assert messages(vector_log) == messages(row_log)
+
+def test_forecast_skips_blank_days():
+    positives = [10, 14, None, 27, 38, 52]
+    with_blank = make_history({"NY": positives})
+    without_blank = with_blank.loc[with_blank["positive"] != BLANK_COUNT]
+
+    target = DATES[-1] + 1
+    batch = BatchForecast(HistoryIndex(with_blank), target)
+    expected = BatchForecast(HistoryIndex(without_blank), target)
+    assert np.allclose(batch.exp_params, expected.exp_params)
+    assert np.allclose(batch.linear_params, expected.linear_params)
+    assert batch.exp_params[0, 0] > 0
+
+    forecast = Forecast()
+    forecast.set_history(with_blank)
+    assert list(forecast.cases_df["positive"]) == [10, 14, 27, 38, 52]
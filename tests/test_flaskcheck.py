@@ -0,0 +1,75 @@
+#
+# streaming a large page while the service swaps in a new result
+#
+import pytest
+from flask import render_template
+
+import flaskcheck
+from flaskapp import create_app
+from app.log.rendered_result import RenderedResult
+from app.log.result_log import ResultLog
+
+
+def make_log(n: int, tag: str) -> ResultLog:
+    log = ResultLog()
+    for i in range(n): log.data_quality(f"S{i % 50}", f"{tag} message {i}")
+    return log
+
+
+class FakeService:
+    " serves the working result, swapping in the next log after each result_info "
+
+    def __init__(self, logs):
+        self.logs = logs
+        self.served = 0
+        self.swaps = 0
+
+    def _current(self) -> ResultLog:
+        return self.logs[min(self.swaps, len(self.logs) - 1)]
+
+    def result_info(self, name: str, fmt: str) -> dict:
+        output = RenderedResult(self._current()).get(fmt)
+        x = { "etag": output.etag, "mimetype": output.mimetype, "size": len(output.body), "age": 0 }
+        if self.swaps < len(self.logs) - 1: self.swaps += 1
+        return x
+
+    def working_html_chunks(self, etag: str = None):
+        log = self._current()
+        if etag != None and RenderedResult(log).get("html").etag != etag: return None
+        self.served += 1
+        return log.iter_html()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(flaskcheck, "STREAM_MIN_BYTES", 0)
+    monkeypatch.setattr(flaskcheck, "g_pages", {})
+    app = create_app()
+    def get(service, headers=None):
+        monkeypatch.setattr(flaskcheck, "get_proxy", lambda: service)
+        r = app.test_client().get("/checks/working.html", headers=headers or {})
+        with app.test_request_context():
+            return r, [render_template("check_results.html", result=x.to_html()) for x in service.logs]
+    return get
+
+def test_streamed_page_etag_matches_body(client):
+    service = FakeService([make_log(200, "old"), make_log(300, "new")])
+    r, expected = client(service)
+
+    # the info for the old log was stale by the time the chunks were requested
+    assert r.status_code == 200 and r.is_streamed
+    assert r.get_data(as_text=True) == expected[1]
+    assert service.served == 1
+
+    # the etag is the one of the page that was sent
+    r2, _ = client(FakeService([service.logs[1]]), headers={"If-None-Match": r.headers["ETag"]})
+    assert r2.status_code == 304
+
+    r3, _ = client(FakeService([service.logs[0]]), headers={"If-None-Match": r.headers["ETag"]})
+    assert r3.status_code == 200
+    assert r3.get_data(as_text=True) == expected[0]
+
+def test_stream_gives_up_when_result_keeps_changing(client):
+    logs = [make_log(10 + i, str(i)) for i in range(flaskcheck.STREAM_ATTEMPTS + 2)]
+    r, _ = client(FakeService(logs))
+    assert r.status_code == 500
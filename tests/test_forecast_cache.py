@@ -0,0 +1,105 @@
+#
+# ForecastCache keyed on forecast_key, in memory and on disk
+#
+import os
+
+import numpy as np
+import pandas as pd
+
+import app.modeling.forecast as forecast_module
+from app.data.history_index import HistoryIndex
+from app.modeling.batch_forecast import BatchForecast
+from app.modeling.forecast import Forecast
+from app.modeling.forecast_cache import ForecastCache, forecast_key
+
+DATES = np.array([20200401, 20200402, 20200403, 20200404])
+VALUES = np.array([10, 13, 18, 24])
+
+
+def make_history() -> pd.DataFrame:
+    return pd.DataFrame({"state": "NY", "date": DATES, "positive": VALUES})
+
+
+def test_key_depends_on_every_input():
+    key = forecast_key("batch", DATES, VALUES)
+    assert key == forecast_key("batch", list(DATES), VALUES.astype(float))
+    assert key != forecast_key("curve_fit", DATES, VALUES)
+    assert key != forecast_key("batch", DATES, VALUES + [0, 0, 0, 1])
+    assert key != forecast_key("batch", DATES + 1, VALUES)
+    assert key != forecast_key("batch", DATES, VALUES, (4.0, 0.1))
+
+def test_hit_miss_and_lru():
+    cache = ForecastCache(max_entries=2)
+    keys = [forecast_key("batch", DATES, VALUES + i) for i in range(3)]
+
+    assert cache.get(keys[0]) is None
+    for i, k in enumerate(keys[:2]):
+        cache.put(k, [1.0, float(i)], [2.0, 0.1])
+    linear, exp = cache.get(keys[0])
+    assert list(linear) == [1.0, 0.0]
+
+    # callers get copies
+    linear[0] = 100
+    assert cache.get(keys[0])[0][0] == 1.0
+
+    # keys[1] is the least recently used
+    cache.put(keys[2], [1.0, 2.0], [2.0, 0.1])
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (3, 2, 2)
+
+def test_disk_tier_survives_restart(tmp_path):
+    key = forecast_key("batch", DATES, VALUES)
+    ForecastCache(cache_dir=str(tmp_path)).put(key, [1.0, 2.0], [3.0, 0.1])
+
+    cache = ForecastCache(cache_dir=str(tmp_path))
+    linear, exp = cache.get(key)
+    assert list(exp) == [3.0, 0.1]
+    assert (cache.hits, cache.disk_hits, cache.misses) == (0, 1, 0)
+    cache.get(key)
+    assert cache.hits == 1
+
+def test_evict_removes_oldest_files(tmp_path):
+    cache = ForecastCache(cache_dir=str(tmp_path), max_disk_entries=2)
+    keys = [forecast_key("batch", DATES, VALUES + i) for i in range(4)]
+    for i, k in enumerate(keys):
+        cache.put(k, [1.0, 2.0], [3.0, 0.1])
+        os.utime(os.path.join(tmp_path, k + ".json"), (1000 + i, 1000 + i))
+
+    cache.evict()
+    assert sorted(os.listdir(tmp_path)) == sorted(k + ".json" for k in keys[2:])
+
+def test_forecast_fit_reuses_cached_params(monkeypatch):
+    calls = []
+    fit = forecast_module._get_distribution_fit
+    def counting_fit(*args, **kwargs):
+        calls.append(1)
+        return fit(*args, **kwargs)
+    monkeypatch.setattr(forecast_module, "_get_distribution_fit", counting_fit)
+
+    cache = ForecastCache()
+    first = Forecast()
+    first.fit(make_history(), cache=cache)
+    assert len(calls) == 2
+
+    second = Forecast()
+    second.fit(make_history(), cache=cache)
+    assert len(calls) == 2
+    assert np.array_equal(second.fitted_exp_params, first.fitted_exp_params)
+
+    # a changed history or starting point is fit again
+    Forecast().fit(make_history(), p0=(4.0, 0.1), cache=cache)
+    assert len(calls) == 4
+
+def test_batch_forecast_reuses_cached_params():
+    cache = ForecastCache()
+    index = HistoryIndex(make_history())
+
+    first = BatchForecast(index, 20200405, cache=cache)
+    second = BatchForecast(index, 20200405, cache=cache)
+    assert (first.n_fit, second.n_fit) == (1, 0)
+    assert np.array_equal(first.exp_params, second.exp_params)
+
+    # the target date is left out of the fit, so a new target day refits
+    assert BatchForecast(index, 20200404, cache=cache).n_fit == 1
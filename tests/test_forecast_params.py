@@ -0,0 +1,60 @@
+#
+# ForecastParamStore warm starts and merging worker updates
+#
+import numpy as np
+import pytest
+
+from app.modeling.forecast_params import ForecastParamStore, KEEP_ENTRIES
+
+
+def test_warm_start_uses_newest_earlier_fit_shifted_to_origin():
+    store = ForecastParamStore()
+    store.update("NY", 20200408, 20200301, [1.0, 2.0], [3.0, 0.1])
+    store.update("NY", 20200409, 20200302, [1.0, 2.0], [5.0, 0.2])
+
+    # same curve, so the value at any date is unchanged by the shift
+    a, b = store.warm_start("NY", 20200410, 20200305)
+    assert b == 0.2
+    assert a == pytest.approx(5.0 * np.exp(0.2 * 3))
+    assert a * np.exp(b * 10) == pytest.approx(5.0 * np.exp(0.2 * 13))
+
+    # only fits before the target date count
+    assert store.warm_start("NY", 20200409, 20200301) == pytest.approx((3.0, 0.1))
+    assert store.warm_start("NY", 20200408, 20200301) is None
+    assert store.warm_start("TX", 20200410, 20200301) is None
+
+def test_update_replaces_same_date_and_keeps_newest():
+    store = ForecastParamStore()
+    for day in range(1, KEEP_ENTRIES + 4):
+        store.update("NY", 20200400 + day, 20200301, [0, 0], [1.0, 0.1])
+    store.update("NY", 20200400 + KEEP_ENTRIES + 3, 20200301, [0, 0], [2.0, 0.1])
+
+    entries = store.snapshot()["NY"]
+    assert [x["date"] for x in entries] == [20200400 + d for d in range(4, KEEP_ENTRIES + 4)]
+    assert entries[-1]["exp"] == [2.0, 0.1]
+
+def test_worker_updates_merge_back(tmp_path):
+    path = str(tmp_path / "params.json")
+    parent = ForecastParamStore(path)
+    parent.update("NY", 20200409, 20200301, [1.0, 2.0], [3.0, 0.1])
+
+    # a worker starts from a snapshot and only reports what it added
+    worker = ForecastParamStore(entries=parent.snapshot())
+    assert worker.warm_start("NY", 20200410, 20200301) == pytest.approx((3.0, 0.1))
+    worker.update("NY", 20200410, 20200301, [1.0, 2.0], [4.0, 0.1])
+    worker.update("TX", 20200410, 20200302, [1.0, 2.0], [6.0, 0.3])
+    assert [s for s, _ in worker.updates()] == ["NY", "TX"]
+    assert parent.warm_start("NY", 20200411, 20200301) == pytest.approx((3.0, 0.1))
+
+    parent.merge(worker.updates())
+    parent.save()
+    assert parent.warm_start("NY", 20200411, 20200301) == pytest.approx((4.0, 0.1))
+
+    reloaded = ForecastParamStore(path)
+    assert reloaded.snapshot() == parent.snapshot()
+    assert reloaded.warm_start("TX", 20200411, 20200302) == pytest.approx((6.0, 0.3))
+
+def test_unreadable_file_starts_empty(tmp_path):
+    path = tmp_path / "params.json"
+    path.write_text("{not json")
+    assert ForecastParamStore(str(path)).snapshot() == {}
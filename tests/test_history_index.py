@@ -0,0 +1,101 @@
+#
+# HistoryIndex against filtering the history frame for every state
+#
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.data.history_index import HistoryIndex
+from app.util import udatetime
+
+STATES = ["AK", "AL", "AR", "NY", "TX"]
+
+
+def make_history(seed: int) -> pd.DataFrame:
+    " API order (newest first), with runs of unchanged values "
+    rng = np.random.RandomState(seed)
+    dates = [int(d.strftime("%Y%m%d")) for d in pd.date_range("2020-03-01", "2020-04-09")]
+    rows = []
+    for st in STATES[:-1]:
+        positive = 0
+        for d in dates:
+            if rng.rand() < 0.6: positive += rng.randint(0, 50)
+            rows.append({"date": d, "state": st, "positive": positive,
+                         "death": int(positive * 0.02), "pending": rng.choice([0, 0, 5])})
+    rows.append({"date": dates[-1], "state": STATES[-1], "positive": 7, "death": 0, "pending": 0})
+    df = pd.DataFrame(rows).sort_values(["date", "state"], ascending=[False, True])
+    return df.reset_index(drop=True)
+
+def reference_last_change(val, vals: np.ndarray, dates: np.ndarray):
+    " the original scan: newest value that differs from val (newest first) "
+    for i in range(len(vals)):
+        if vals[i] != val:
+            sdate = str(dates[i])
+            d = datetime(int(sdate[0:4]), int(sdate[4:6]), int(sdate[6:8]))
+            return vals[i], udatetime.naivedatetime_as_eastern(d)
+    return 0, None
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_history_matches_frame(seed):
+    df = make_history(seed)
+    index = HistoryIndex(df)
+
+    assert index.states == sorted(STATES)
+    for st in STATES + ["ZZ"]:
+        expected = df[df.state == st]
+        history = index.get(st)
+
+        assert len(history) == expected.shape[0]
+        for c in ["date", "positive", "death", "pending"]:
+            assert list(history[c]) == list(expected[c].values)
+
+        frame = history.to_frame()
+        if not expected.empty:
+            pd.testing.assert_frame_equal(frame[expected.columns].reset_index(drop=True),
+                expected.reset_index(drop=True), check_dtype=False)
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_before_matches_filter(seed):
+    df = make_history(seed)
+    index = HistoryIndex(df)
+
+    for st in STATES:
+        for target in [20200301, 20200315, 20200409, 20200410]:
+            expected = df[(df.state == st) & (df.date < target)]
+            history = index.get(st).before(target)
+            assert list(history["date"]) == list(expected["date"].values)
+            assert list(history["positive"]) == list(expected["positive"].values)
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_last_change_matches_scan(seed):
+    df = make_history(seed)
+    index = HistoryIndex(df)
+
+    for st in STATES:
+        for target in [20200301, 20200315, 20200409, 20200410]:
+            expected = df[(df.state == st) & (df.date < target)]
+            history = index.get(st).before(target)
+            for c in ["positive", "death", "pending"]:
+                vals = expected[c].values
+                if len(vals) == 0:
+                    assert history.last_change(c) == (0, None)
+                    continue
+                assert history.last_change(c) == reference_last_change(vals[0], vals, expected["date"].values)
+
+def test_days_since_change_matches_scan():
+    df = make_history(3)
+    index = HistoryIndex(df)
+
+    for st in STATES:
+        expected = df[df.state == st].iloc[::-1]
+        dates = pd.to_datetime(expected["date"].astype(str), format="%Y%m%d").values
+        vals = expected["positive"].values
+        result = index.get(st).days_since_change("positive")[::-1]
+        for i in range(len(vals)):
+            j = i
+            while j >= 0 and vals[j] == vals[i]: j -= 1
+            days = -1 if j < 0 else int((dates[i] - dates[j]) / np.timedelta64(1, "D"))
+            assert result[i] == days
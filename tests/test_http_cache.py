@@ -0,0 +1,114 @@
+#
+# HttpCache conditional GETs against a fake server
+#
+import io
+import os
+
+import pandas as pd
+import pytest
+
+import app.util.http_session as http_session
+from app.data.http_cache import HttpCache
+
+
+class FakeResponse:
+
+    def __init__(self, status_code: int, text: str = "", headers: dict = None):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode("utf-8")
+        self.encoding = "utf-8"
+        self.headers = headers or {}
+
+
+class FakeServer:
+    " serves one body per url with an ETag, answers 304 to a matching If-None-Match "
+
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+
+    def get(self, url: str, headers: dict = None, **kwargs) -> FakeResponse:
+        headers = headers or {}
+        self.requests.append((url, headers))
+        text, etag = self.files[url]
+        if headers.get("If-None-Match") == etag:
+            return FakeResponse(304)
+        return FakeResponse(200, text, {"ETag": etag})
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer()
+    monkeypatch.setattr(http_session, "get", server.get)
+    return server
+
+def counting_parser(calls: list, **kwargs):
+    def parse(text: str) -> pd.DataFrame:
+        calls.append(kwargs)
+        return pd.read_csv(io.StringIO(text), **kwargs)
+    return parse
+
+
+def test_not_modified_reuses_parsed_frame(server, tmp_path):
+    url = "http://example.com/a.csv"
+    server.files[url] = ("state,positive\nNY,1\nTX,2\n", '"v1"')
+    cache = HttpCache(str(tmp_path))
+    calls = []
+
+    df1 = cache.get_frame(url, counting_parser(calls))
+    df1.loc[0, "positive"] = 100    # callers get a copy
+    df2 = cache.get_frame(url, counting_parser(calls))
+
+    assert len(calls) == 1
+    assert server.requests[1][1]["If-None-Match"] == '"v1"'
+    assert list(df2["positive"]) == [1, 2]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # a changed file is downloaded and parsed again
+    server.files[url] = ("state,positive\nNY,3\n", '"v2"')
+    df3 = cache.get_frame(url, counting_parser(calls))
+    assert len(calls) == 2
+    assert list(df3["positive"]) == [3]
+
+def test_different_parse_key_reparses(server, tmp_path):
+    url = "http://example.com/b.csv"
+    server.files[url] = ("state,positive,negative\nNY,1,5\n", '"v1"')
+    cache = HttpCache(str(tmp_path))
+    calls = []
+
+    cache.get_frame(url, counting_parser(calls), parse_key="")
+    df = cache.get_frame(url, counting_parser(calls, usecols=["state", "positive"]), parse_key="state,positive")
+
+    assert len(calls) == 2
+    assert server.requests[1][1]["If-None-Match"] == '"v1"'
+    assert list(df.columns) == ["state", "positive"]
+
+def test_body_is_reparsed_after_restart(server, tmp_path):
+    url = "http://example.com/c.csv"
+    server.files[url] = ("state,positive\nNY,1\n", '"v1"')
+    HttpCache(str(tmp_path)).get_frame(url, counting_parser([]))
+
+    calls = []
+    df = HttpCache(str(tmp_path)).get_frame(url, counting_parser(calls))
+    assert len(calls) == 1
+    assert list(df["positive"]) == [1]
+
+def test_evict_removes_least_recently_used(server, tmp_path):
+    body = "state,positive\n" + "NY,1\n" * 200
+    cache = HttpCache(str(tmp_path), max_bytes=int(2.5 * len(body)))
+
+    urls = [f"http://example.com/{i}.csv" for i in range(4)]
+    for i, url in enumerate(urls):
+        server.files[url] = (body, f'"{i}"')
+    for url in urls[:3]:
+        cache.get_frame(url, counting_parser([]))
+    assert cache.evictions == 1
+
+    # touch 1, then adding 3 evicts 2 (0 is already gone)
+    cache.get_frame(urls[1], counting_parser([]))
+    cache.get_frame(urls[3], counting_parser([]))
+
+    kept = sorted(fn for fn in os.listdir(tmp_path) if fn.endswith(".body"))
+    assert kept == sorted(cache._key(urls[i]) + ".body" for i in [1, 3])
+    assert cache.evictions == 2
@@ -0,0 +1,140 @@
+#
+# LatestDateReader full and incremental (Range) reads against a fake server
+#
+import pytest
+
+import app.util.http_session as http_session
+from app.data.latest_date_reader import LatestDateReader
+
+URL = "http://example.com/daily.csv"
+
+
+class FakeResponse:
+
+    def __init__(self, status_code: int, data: bytes = b"", headers: dict = None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+        self.closed = False
+
+    def iter_content(self, n: int):
+        for i in range(0, len(self.data), n):
+            yield self.data[i:i+n]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeServer:
+    " serves one file, with optional Range/If-Range support and ETag "
+
+    def __init__(self, data: bytes, etag: str = None, ranges: bool = True):
+        self.data = data
+        self.etag = etag
+        self.ranges = ranges
+        self.requests = []
+
+    def get(self, url: str, headers: dict = None, **kwargs) -> FakeResponse:
+        headers = headers or {}
+        self.requests.append(headers)
+        out_headers = {"ETag": self.etag} if self.etag else {}
+
+        rng = headers.get("Range")
+        if_range = headers.get("If-Range")
+        if rng is None or not self.ranges or (if_range != None and if_range != self.etag):
+            return FakeResponse(200, self.data, out_headers)
+        start = int(rng[len("bytes="):-1])
+        if start >= len(self.data):
+            return FakeResponse(416)
+        return FakeResponse(206, self.data[start:], out_headers)
+
+
+def rows(*lines: str) -> bytes:
+    return ("".join(x + "\n" for x in lines)).encode("utf-8")
+
+HEADER = "date,state,positive"
+DAY1 = ["20200401,NY,1", "20200401,TX,2"]
+DAY2 = ["20200402,NY,3", "20200402,TX,4"]
+DAY3 = ["20200403,NY,5"]
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    def serve(*args, **kwargs) -> FakeServer:
+        server = FakeServer(*args, **kwargs)
+        monkeypatch.setattr(http_session, "get", server.get)
+        return server
+    return serve
+
+def read(reader: LatestDateReader):
+    df = reader.read()
+    return list(df["date"].unique()), list(df["positive"])
+
+
+@pytest.mark.parametrize("etag", ['"v1"', None])
+def test_append_reads_only_the_tail(serve, etag):
+    server = serve(rows(HEADER, *DAY1), etag=etag)
+    reader = LatestDateReader(URL, "date", incremental=True, block_size=16)
+    assert read(reader) == (["20200401"], [1, 2])
+    full_size = len(server.data)
+
+    server.data += rows(*DAY2)
+    assert read(reader) == (["20200402"], [3, 4])
+    assert "Range" in server.requests[-1]
+    assert server.requests[-1].get("If-Range") == etag
+    assert reader.offset == len(server.data)
+    assert int(server.requests[-1]["Range"][len("bytes="):-1]) < full_size
+
+    server.data += rows(*DAY3)
+    assert read(reader) == (["20200403"], [5])
+
+def test_unchanged_file_keeps_latest_rows(serve):
+    serve(rows(HEADER, *DAY1, *DAY2), etag='"v1"')
+    reader = LatestDateReader(URL, "date", incremental=True)
+    read(reader)
+    assert read(reader) == (["20200402"], [3, 4])
+
+def test_changed_etag_falls_back_to_full_read(serve):
+    server = serve(rows(HEADER, *DAY1, *DAY2), etag='"v1"')
+    reader = LatestDateReader(URL, "date", incremental=True)
+    read(reader)
+
+    server.data = rows(HEADER, *DAY1)
+    server.etag = '"v2"'
+    assert read(reader) == (["20200401"], [1, 2])
+    assert reader.validator == '"v2"'
+    assert reader.offset == len(server.data)
+
+def test_rewrite_without_validator_falls_back_to_full_read(serve):
+    server = serve(rows(HEADER, *DAY1), etag=None)
+    reader = LatestDateReader(URL, "date", incremental=True)
+    read(reader)
+
+    # same length prefix, different content
+    server.data = rows(HEADER, "20200401,NY,7", "20200401,TX,8", *DAY2)
+    assert read(reader) == (["20200402"], [3, 4])
+    assert server.requests[-1].get("Range") is None
+    assert reader.offset == len(server.data)
+
+    # a shorter file answers 416 and is read in full
+    server.data = rows(HEADER, "20200401,NY,9")
+    assert read(reader) == (["20200401"], [9])
+
+def test_server_without_ranges_gets_full_read(serve):
+    server = serve(rows(HEADER, *DAY1), etag=None, ranges=False)
+    reader = LatestDateReader(URL, "date", incremental=True)
+    read(reader)
+
+    server.data += rows(*DAY2)
+    assert read(reader) == (["20200402"], [3, 4])
+    assert len(server.requests) == 2
+    assert reader.offset == len(server.data)
+
+def test_partial_last_line_is_not_committed(serve):
+    server = serve(rows(HEADER, *DAY1) + b"20200402,NY,3", etag=None)
+    reader = LatestDateReader(URL, "date", incremental=True)
+    assert read(reader) == (["20200402"], [3])
+    assert reader.offset == len(rows(HEADER, *DAY1))
+
+    server.data += b"\n" + rows(DAY2[1])
+    assert read(reader) == (["20200402"], [3, 4])
@@ -0,0 +1,144 @@
+#
+# background refresh: RefreshScheduler and swapping in completed results
+#
+import threading
+import time
+
+import pytest
+
+import run_quality_service as service
+from app.data.data_source import DataSource
+from app.log.result_log import ResultLog
+from app.qc_config import QCConfig
+
+
+def wait_for(cond, timeout: float = 5.0) -> bool:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if cond(): return True
+        time.sleep(0.01)
+    return False
+
+
+def test_scheduler_runs_each_result_on_its_cadence():
+    runs = []
+    scheduler = service.RefreshScheduler(runs.append, {"fast": 0.05, "slow": 60})
+    scheduler.start()
+    try:
+        assert wait_for(lambda: runs.count("fast") >= 3)
+        assert runs.count("slow") == 1
+
+        scheduler.trigger("slow")
+        assert wait_for(lambda: runs.count("slow") == 2)
+
+        # a shorter cadence applies to the run that is already scheduled
+        scheduler.set_cadences({"fast": 60, "slow": 0.05})
+        n_fast = runs.count("fast")
+        assert wait_for(lambda: runs.count("slow") >= 4)
+        assert runs.count("fast") <= n_fast + 1
+    finally:
+        scheduler.stop()
+
+    n = len(runs)
+    time.sleep(0.2)
+    assert len(runs) <= n + 1
+
+def test_scheduler_survives_a_failed_refresh():
+    runs = []
+    def refresh(name):
+        runs.append(name)
+        if len(runs) == 1: raise Exception("boom")
+
+    scheduler = service.RefreshScheduler(refresh, {"working": 0.01})
+    scheduler.start()
+    try:
+        assert wait_for(lambda: len(runs) >= 2)
+    finally:
+        scheduler.stop()
+
+
+class Runs:
+    " stand-in for the checks, each run of a result waits for release() after the first "
+
+    def __init__(self):
+        self.count = { name: 0 for name in service.RESULT_NAMES }
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, name: str):
+        def run(ds: DataSource, config: QCConfig) -> ResultLog:
+            if self.count[name] > 0: self.gate.wait(5)
+            self.count[name] += 1
+            log = ResultLog()
+            log.internal(name, f"run {self.count[name]}")
+            return log
+        return run
+
+@pytest.fixture
+def server(monkeypatch):
+    settings = { "background_refresh": True, "refresh_seconds": 60 }
+
+    def load_config(self):
+        self.config = QCConfig()
+        self.snapshot_dir, self.snapshot_keep, self.snapshot_max_age_days = None, 0, 0
+        self.background_refresh = settings["background_refresh"]
+        self.refresh_seconds = { name: settings["refresh_seconds"] for name in service.RESULT_NAMES }
+        self.ready_timeout = 5
+        self.ds = self._new_datasource()
+
+    runs = Runs()
+    monkeypatch.setattr(service.CheckServer, "_load_config", load_config)
+    monkeypatch.setattr(service, "RUNS", { name: runs(name) for name in service.RESULT_NAMES })
+
+    srv = service.CheckServer()
+    srv.settings, srv.runs = settings, runs
+    yield srv
+    runs.gate.set()
+    if srv._scheduler != None: srv._scheduler.stop()
+
+def test_results_are_swapped_in_when_complete(server):
+    server.start_refresh()
+    first = server.result("working")
+    assert "run 1" in first.rendered.get("json").text
+
+    # requests get the last completed run while the next one is going
+    server.runs.gate.clear()
+    server._scheduler.trigger("working")
+    assert wait_for(lambda: server._scheduler._due["working"] == float("inf"))
+    assert server.result("working") is first
+
+    server.runs.gate.set()
+    assert wait_for(lambda: server.result("working") is not first)
+    second = server.result("working")
+    assert "run 2" in second.rendered.get("json").text
+    assert "run 1" in first.rendered.get("json").text
+    assert second.rendered.get("json").etag != first.rendered.get("json").etag
+
+def test_reset_pushes_the_service_config(server):
+    server.start_refresh()
+    server.result("working")
+    scheduler = server._scheduler
+
+    server.settings["refresh_seconds"] = 1
+    server.reset()
+    assert server._scheduler is scheduler
+    assert scheduler._cadences == { name: 1 for name in service.RESULT_NAMES }
+    assert wait_for(lambda: server.runs.count["working"] >= 3)
+
+    # without background refresh the results are rerun on request
+    server.settings["background_refresh"] = False
+    server.reset()
+    assert server._scheduler is None
+    scheduler._thread.join(5)
+    server.reset()
+    n = server.runs.count["current"]
+    assert f"run {n + 1}" in server.result("current").rendered.get("json").text
+    assert server.runs.count["current"] == n + 1
+
+    server.settings["background_refresh"] = True
+    server.reset()
+    assert server._scheduler is not None and server._scheduler is not scheduler
+
+def test_reset_does_not_start_refresh_unless_started(server):
+    server.reset()
+    assert server._scheduler is None
@@ -0,0 +1,87 @@
+#
+# RenderedResult against rendering the log for every request
+#
+import gzip
+import hashlib
+import json
+
+import pytest
+
+from app.log.result_log import ResultLog
+from app.log.rendered_result import RenderedResult, RenderedOutput, parse_accept_encoding, brotli
+
+
+def make_log(n: int) -> ResultLog:
+    log = ResultLog()
+    for i in range(n):
+        log.data_quality(["NY", "TX", "FL"][i % 3], f"positive ({i:,}) looks <odd> & needs a check")
+    log.consolidate()
+    return log
+
+
+@pytest.mark.parametrize("n", [0, 3, 500])
+def test_outputs_match_log(n):
+    log = make_log(n)
+    rendered = RenderedResult(log)
+
+    assert rendered.get("json").text == log.to_json()
+    assert rendered.get("csv").text == log.to_csv()
+    assert rendered.get("html").text == log.to_html()
+    json.loads(rendered.get("json").text)
+
+def test_etag_is_hash_of_body():
+    output = RenderedResult(make_log(50)).get("csv")
+    assert output.etag == '"' + hashlib.sha1(output.body).hexdigest() + '"'
+
+    # same content, same etag
+    assert RenderedOutput(output.text, output.mimetype).etag == output.etag
+    assert RenderedOutput(output.text + " ", output.mimetype).etag != output.etag
+
+def test_encoded_variants_decode_to_body():
+    output = RenderedResult(make_log(500)).get("html")
+
+    data, encoding = output.encoded("gzip, deflate")
+    assert encoding == "gzip"
+    assert gzip.decompress(data) == output.body
+    assert len(data) < len(output.body)
+
+    data, encoding = output.encoded("")
+    assert (data, encoding) == (output.body, "")
+
+    data, encoding = output.encoded("gzip;q=0, identity")
+    assert (data, encoding) == (output.body, "")
+
+    if brotli != None:
+        data, encoding = output.encoded("gzip, br")
+        assert encoding == "br"
+        assert brotli.decompress(data) == output.body
+
+def test_gzip_is_deterministic():
+    text = RenderedResult(make_log(500)).get("json").text
+    a, b = RenderedOutput(text, "text/json"), RenderedOutput(text, "text/json")
+    assert a.encoded("gzip") == b.encoded("gzip")
+
+def test_small_bodies_are_not_compressed():
+    output = RenderedOutput("tiny", "text/csv")
+    assert output.encoded("gzip, br") == (b"tiny", "")
+
+def test_response_honors_if_none_match():
+    rendered = RenderedResult(make_log(500))
+    etag = rendered.get("json").etag
+
+    result = rendered.response("json", "gzip", if_none_match=f'"other", {etag}')
+    assert result["body"] is None
+    assert result["etag"] == etag
+
+    result = rendered.response("json", "gzip", if_none_match='"other"')
+    assert gzip.decompress(result["body"]) == rendered.get("json").body
+    assert result["encoding"] == "gzip"
+    assert result["mimetype"] == "text/json"
+
+    with pytest.raises(Exception):
+        rendered.get("xml")
+
+def test_parse_accept_encoding():
+    assert parse_accept_encoding("gzip, br;q=0.5, *;q=0") == {"gzip": 1.0, "br": 0.5, "*": 0.0}
+    assert parse_accept_encoding(None) == {}
+    assert parse_accept_encoding("gzip;q=x") == {"gzip": 0.0}
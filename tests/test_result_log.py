@@ -0,0 +1,133 @@
+#
+# ResultLog against the list-of-messages implementation it replaced
+#
+import io
+import json
+import random
+from typing import List, Tuple
+
+import pandas as pd
+import pytest
+
+from app.log.result_log import ResultLog, ResultCategory
+from app.util import udatetime
+
+LOCATIONS = ["NY", "TX", "FL", "CA", "WA"]
+MESSAGE_IDS = ["", "", "", "a", "b", "c"]
+
+# (category, location, message, message_id)
+Entry = Tuple[ResultCategory, str, str, str]
+
+
+def reference_consolidate(entries: List[Entry], threshold: int = 10) -> List[Entry]:
+    " the original consolidate: collapse ids with more than threshold messages into the first one "
+
+    ids = {}
+    for i, x in enumerate(entries):
+        if x[3] == "": continue
+        ids.setdefault(x[3], []).append(i)
+
+    result = list(entries)
+    to_delete = []
+    for items in ids.values():
+        if len(items) > threshold:
+            cat, loc, msg, mid = result[items[0]]
+            result[items[0]] = (cat, loc, f"{msg} and {len(items)-1} more", mid)
+            to_delete.extend(items[1:])
+    for i in sorted(to_delete, reverse=True):
+        del result[i]
+    return result
+
+def by_category(entries: List[Entry]) -> List[Entry]:
+    return [x for cat in ResultCategory for x in entries if x[0] == cat]
+
+def reference_html(entries: List[Entry], loaded_at) -> str:
+    " the original to_html (one pandas table per category) "
+
+    lines = ['  <body>', '    <div class="container working-results">']
+    for cat in ResultCategory:
+        lines.append('    <div class="row">')
+        rows = [[x[1], x[2]] for x in entries if x[0] == cat]
+        if len(rows) > 0:
+            df = pd.DataFrame(rows, columns=["Location", "Message"])
+            table = df.to_html(justify='left', index=False, border=0)
+            # newer pandas leave out border="0"
+            table = table.replace('<table class="dataframe">', '<table border="0" class="dataframe">')
+            lines.extend([f"  <h5>{cat.value.upper()}</h5>", table])
+        lines.append('    </div>')
+    lines.append('    </div>')
+    lines.append(f'    <div class="timestamp">run against source at {udatetime.to_displayformat(loaded_at)}</div>')
+    lines.append('  </body>')
+    return '\n'.join(lines)
+
+
+def random_entries(n: int, seed: int) -> List[Entry]:
+    rng = random.Random(seed)
+    return [(rng.choice(list(ResultCategory)), rng.choice(LOCATIONS),
+             f"message <{i}> & \"{rng.randint(0, 9)}\"", rng.choice(MESSAGE_IDS)) for i in range(n)]
+
+def fill(log: ResultLog, entries: List[Entry]) -> ResultLog:
+    for cat, loc, msg, mid in entries:
+        log.add(cat, loc, msg, message_id=mid)
+    return log
+
+def as_entries(log: ResultLog) -> List[Entry]:
+    return [(x.category, x.location, x.message, x.message_id) for x in log.messages]
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+@pytest.mark.parametrize("n,threshold", [(0, 10), (5, 10), (200, 10), (200, 1), (400, 60)])
+def test_consolidate_matches_reference(n, threshold, incremental):
+    entries = random_entries(n, seed=n + threshold)
+    log = fill(ResultLog(consolidate_threshold=threshold, incremental=incremental), entries)
+    log.consolidate()
+    assert as_entries(log) == reference_consolidate(entries, threshold)
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_merge_matches_reference(incremental):
+    first, second = random_entries(150, seed=1), random_entries(150, seed=2)
+
+    log = fill(ResultLog(incremental=incremental), first)
+    other = fill(ResultLog(), second)
+    other.consolidate()
+    log.merge(other)
+    log.consolidate()
+
+    expected = reference_consolidate(first + reference_consolidate(second))
+    assert as_entries(log) == expected
+
+def test_category_threshold_overrides_default():
+    entries = [(ResultCategory.DATA_ENTRY, "NY", f"m{i}", "a") for i in range(5)] + \
+              [(ResultCategory.INTERNAL, "TX", f"m{i}", "b") for i in range(5)]
+    log = fill(ResultLog(thresholds={ResultCategory.DATA_ENTRY: 2}), entries)
+    log.consolidate()
+    assert as_entries(log) == reference_consolidate(entries[:5], 2) + entries[5:]
+
+@pytest.mark.parametrize("kwargs", [{"consolidate_threshold": 0}, {"thresholds": {"a": 0}}])
+def test_threshold_below_one_is_rejected(kwargs):
+    with pytest.raises(Exception):
+        ResultLog(**kwargs)
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_exports_match_reference(incremental):
+    entries = random_entries(300, seed=7)
+    log = fill(ResultLog(incremental=incremental), entries)
+    log.consolidate()
+    expected = by_category(reference_consolidate(entries))
+
+    df = log.to_frame()
+    assert list(df.columns) == ["category", "location", "message", "ms"]
+    assert list(zip(df["category"], df["location"], df["message"])) == \
+        [(x[0].value.upper(), x[1], x[2]) for x in expected]
+
+    csv = pd.read_csv(io.StringIO(log.to_csv()), keep_default_na=False)
+    assert list(zip(csv["category"], csv["location"], csv["message"])) == \
+        [(x[0].value.upper(), x[1], x[2]) for x in expected]
+
+    result = json.loads(log.to_json())
+    for cat in ResultCategory:
+        items = [(x["category"], x["location"], x["message"], x["message_id"]) for x in result[cat.name]]
+        assert items == [(x[0].value, x[1], x[2], x[3]) for x in expected if x[0] == cat]
+
+    assert log.to_html() == reference_html(expected, log.loaded_at)
+    assert "".join(log.iter_html(rows_per_chunk=7)) == log.to_html()
@@ -0,0 +1,46 @@
+#
+# RollupIndex medians against sorting the rollup rows for every state
+#
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.data.rollup_index import RollupIndex
+
+STATES = ["AK", "AL", "AR", "NY", "TX"]
+
+
+def make_rollup(seed: int) -> pd.DataFrame:
+    " per-source county totals, with ties "
+    rng = np.random.RandomState(seed)
+    rows = []
+    for st in STATES[:-1]:
+        for src in rng.permutation(["cds", "csbs", "nyt"])[:rng.randint(1, 4)]:
+            rows.append({"state": st, "source": src,
+                         "cases": int(rng.choice([100, 200, rng.randint(0, 300)])),
+                         "deaths": int(rng.choice([5, 10, rng.randint(0, 20)]))})
+    return pd.DataFrame(rows)
+
+def reference_median(df: pd.DataFrame, state: str):
+    " the original check: sort the state's rows by cases, then by deaths, and take the middle "
+    df = df[df.state == state].sort_values("source")
+    mid = df.shape[0] // 2
+    df = df.sort_values(by="cases", kind="stable")
+    cases = df.iloc[mid]
+    df = df.sort_values(by="deaths", kind="stable")
+    deaths = df.iloc[mid]
+    return int(cases.cases), cases.source, int(deaths.deaths), deaths.source
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_rollup_median_matches_sort(seed):
+    df = make_rollup(seed)
+    index = RollupIndex(df)
+
+    assert sorted(index.keys) == sorted(df.state.unique())
+    assert index.get(STATES[-1]) is None
+    for st in df.state.unique():
+        rollup = index.get(st)
+        assert len(rollup) == (df.state == st).sum()
+        assert (rollup.median_cases, rollup.median_cases_source,
+                rollup.median_deaths, rollup.median_deaths_source) == reference_median(df, st)
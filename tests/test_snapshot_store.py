@@ -0,0 +1,75 @@
+#
+# SnapshotStore save/load and pruning
+#
+import os
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+import pytz
+
+from app.data.snapshot_store import SnapshotStore, parse_as_of
+
+
+def utc(*args) -> datetime:
+    return pytz.UTC.localize(datetime(*args))
+
+def frame(n: int) -> pd.DataFrame:
+    return pd.DataFrame({"state": ["NY", "TX"], "positive": [n, n + 1]})
+
+def stamps(store: SnapshotStore, source: str):
+    return [stamp for stamp, _ in store.list(source)]
+
+
+def test_roundtrip_with_attrs(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    path = store.save("current", frame(1), utc(2020, 4, 1, 12), attrs={"sheet": "2020-04-01"})
+    assert os.path.basename(path) == "current_20200401-120000Z.feather"
+
+    df, attrs = store.load("current")
+    pd.testing.assert_frame_equal(df, frame(1))
+    assert attrs == {"sheet": "2020-04-01"}
+
+    # snapshots without attrs load with an empty dict
+    store.save("history", frame(2), utc(2020, 4, 1, 12))
+    assert store.load("history")[1] == {}
+
+def test_as_of_picks_newest_at_or_before(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    for day in [1, 2, 3]:
+        store.save("current", frame(day), utc(2020, 4, day, 12))
+    store.save("history", frame(9), utc(2020, 4, 5, 12))
+
+    assert store.load("current")[0]["positive"][0] == 3
+    assert store.load("current", utc(2020, 4, 2, 12))[0]["positive"][0] == 2
+    assert store.load("current", utc(2020, 4, 3, 11, 59))[0]["positive"][0] == 2
+    assert store.load("current", parse_as_of("20200401-120000Z"))[0]["positive"][0] == 1
+    with pytest.raises(Exception):
+        store.load("current", utc(2020, 3, 31))
+
+def test_parse_as_of_treats_naive_dates_as_eastern():
+    assert parse_as_of("2020-04-01T08:00:00") == utc(2020, 4, 1, 12)
+    assert parse_as_of("20200401-120000Z") == utc(2020, 4, 1, 12)
+    assert parse_as_of(None) is None
+
+def test_prune_by_count(tmp_path):
+    store = SnapshotStore(str(tmp_path), keep=2)
+    for day in [1, 2, 3, 4]:
+        store.save("current", frame(day), utc(2020, 4, day), attrs={"day": day})
+    store.save("history", frame(0), utc(2020, 4, 1))
+
+    assert stamps(store, "current") == ["20200403-000000Z", "20200404-000000Z"]
+    assert stamps(store, "history") == ["20200401-000000Z"]
+    assert not os.path.exists(tmp_path / "current_20200401-000000Z.json")
+    assert os.path.exists(tmp_path / "current_20200404-000000Z.json")
+
+def test_prune_by_age_keeps_newest(tmp_path):
+    store = SnapshotStore(str(tmp_path), max_age_days=2)
+    start = utc(2020, 4, 1)
+    for day in [0, 1, 2, 3]:
+        store.save("current", frame(day), start + timedelta(days=day))
+    assert stamps(store, "current") == ["20200402-000000Z", "20200403-000000Z", "20200404-000000Z"]
+
+    # a long gap still leaves the newest snapshot
+    store.prune("current", start + timedelta(days=30))
+    assert stamps(store, "current") == ["20200404-000000Z"]
@@ -0,0 +1,45 @@
+#
+# standardize_dates against standardize_date applied to every cell
+#
+import pandas as pd
+import pytest
+
+import app.util.udatetime as udatetime
+
+# inputs the per-cell version handles (it raises on some malformed values)
+VALUES = [
+    "4/10/2020 10:30", "04/10/2020 09:05", "4/1/2020 23:59", "4/10 9:15", "12/31/2020 00:00",
+    "4/10/2020 1:30 PM", "4/10/2020 11:45 AM", "4/10/2020 12:30 PM", "4/10/2020 10:00 AM",
+    "2020-04-10 10:30", "2020-4-9 08:00", "2020-04-10 2:15 PM",
+    "", "   ", "10:30", "7:05",
+]
+
+def reference(values):
+    " the original conversion: standardize_date per cell, then parse "
+    dates, errors = [], []
+    for v in values:
+        sd, err_num = udatetime.standardize_date(v)
+        dates.append(pd.to_datetime(sd, format="%m/%d/%Y %H:%M"))
+        errors.append(err_num)
+    return dates, errors
+
+
+def test_matches_per_cell_version():
+    s = pd.Series(VALUES, index=range(10, 10 + len(VALUES)))
+    dates, errors = udatetime.standardize_dates(s)
+
+    expected_dates, expected_errors = reference(VALUES)
+    assert list(dates.index) == list(s.index)
+    assert list(dates) == expected_dates
+    assert list(errors) == expected_errors
+
+def test_missing_values_are_blank():
+    dates, errors = udatetime.standardize_dates(pd.Series([None, float("nan")], dtype=object))
+    assert list(dates) == [pd.Timestamp(2020, 1, 1)] * 2
+    assert list(errors) == [2, 2]
+
+@pytest.mark.parametrize("value,error_num", [("13/45/2020 10:30", 5), ("4/10/2020 25:99", 6), ("4/10/2020 ab:cd", 6)])
+def test_bad_values_do_not_fail_the_column(value, error_num):
+    dates, errors = udatetime.standardize_dates(pd.Series(["4/10/2020 10:30", value]))
+    assert dates.iloc[0] == pd.Timestamp(2020, 4, 10, 10, 30)
+    assert errors.iloc[1] == error_num
@@ -0,0 +1,109 @@
+#
+# vectorized checks against running the row checks one row at a time
+#
+import numpy as np
+import pandas as pd
+import pytest
+
+import app.checks as checks
+import app.vector_checks as vector_checks
+from app.data.history_index import HistoryIndex
+from app.data.rollup_index import RollupIndex
+from app.log.result_log import ResultLog
+
+ROW_CHECKS = [
+    (vector_checks.TOTAL, checks.total),
+    (vector_checks.POSITIVES_RATE, checks.positives_rate),
+    (vector_checks.DEATH_RATE, checks.death_rate),
+    (vector_checks.LESS_RECOVERED_THAN_POSITIVE, checks.less_recovered_than_positive),
+    (vector_checks.PENDINGS_RATE, checks.pendings_rate),
+]
+
+
+def make_rows(seed: int, n: int = 200) -> pd.DataFrame:
+    " counts around the check thresholds, with blank (-1000) and invalid (-1001) markers "
+    rng = np.random.RandomState(seed)
+
+    def counts(high: int) -> np.ndarray:
+        x = rng.randint(0, high, n)
+        x[rng.rand(n) < 0.05] = -1000
+        x[rng.rand(n) < 0.03] = -1001
+        x[rng.rand(n) < 0.02] = -5
+        return x
+
+    df = pd.DataFrame({
+        "state": [f"S{i:03d}" for i in range(n)],
+        "positive": counts(2000),
+        "negative": counts(3000),
+        "pending": counts(1500),
+        "death": counts(150),
+        "recovered": counts(2000),
+    })
+    total = df.positive + df.negative + np.where(df.pending == -1000, 0, df.pending)
+    df["total"] = np.where(rng.rand(n) < 0.8, total, total + rng.randint(-5, 5, n))
+    return df
+
+def row_messages(df: pd.DataFrame, funcs) -> list:
+    log = ResultLog()
+    for row in df.itertuples():
+        for f in funcs: f(row, log)
+    return [(x.category, x.location, x.message) for x in log.messages]
+
+def vector_messages(results: vector_checks.VectorResults, names=None) -> list:
+    log = ResultLog()
+    results.emit_all(log, names)
+    return [(x.category, x.location, x.message) for x in log.messages]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_row_checks_match(seed):
+    df = make_rows(seed)
+    for name, func in ROW_CHECKS:
+        assert vector_messages(vector_checks.evaluate(df, [name])) == row_messages(df, [func]), name
+
+    # all of them, interleaved per row in check order
+    results = vector_checks.evaluate(df)
+    assert vector_messages(results, vector_checks.ALL_CHECKS) == row_messages(df, [f for _, f in ROW_CHECKS])
+
+@pytest.mark.parametrize("seed", range(20))
+def test_rollup_check_matches(seed):
+    rng = np.random.RandomState(seed)
+    states = [f"S{i}" for i in range(12)]
+    rows = []
+    for st in states[:-2]:
+        for src in rng.permutation(["cds", "csbs", "nyt"])[:rng.randint(1, 4)]:
+            rows.append((st, src, int(rng.choice([800, 1000, 2000, 3000, rng.randint(0, 5000)])),
+                         int(rng.choice([100, 300, rng.randint(0, 600)]))))
+    rollup = pd.DataFrame(rows, columns=["state", "source", "cases", "deaths"])
+    df = pd.DataFrame({"state": states, "positive": rng.randint(0, 6000, 12), "death": rng.randint(0, 700, 12)})
+
+    index = RollupIndex(rollup)
+    log = ResultLog()
+    for row in df.itertuples():
+        r = index.get(row.state)
+        if r is not None: checks.counties_rollup_to_state(row, r, log)
+    expected = [(x.category, x.location, x.message) for x in log.messages]
+
+    results = vector_checks.evaluate(df, [vector_checks.COUNTIES_ROLLUP_TO_STATE], rollup)
+    assert vector_messages(results) == expected
+
+@pytest.mark.parametrize("seed", range(5))
+def test_history_check_matches(seed):
+    rng = np.random.RandomState(seed)
+    rows = []
+    for st in ["AK", "AL", "NY", "TX"]:
+        vals = {c: 0 for c in ["positive", "negative", "hospitalized", "death"]}
+        for d in pd.date_range("2020-03-01", "2020-03-31"):
+            for c in vals:
+                vals[c] += rng.randint(-3, 20)
+            rows.append(dict(date=int(d.strftime("%Y%m%d")), state=st, **vals))
+    index = HistoryIndex(pd.DataFrame(rows))
+    states = index.states
+
+    log = ResultLog()
+    for st in states:
+        checks.monotonically_increasing(index.get(st), log)
+    expected = [(x.category, x.location, x.message) for x in log.messages]
+
+    results = vector_checks.evaluate_history(index, states, [vector_checks.MONOTONICALLY_INCREASING])
+    assert vector_messages(results) == expected